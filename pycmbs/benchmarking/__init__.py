@@ -6,4 +6,4 @@ For COPYING and LICENSE details, please refer to the file
 COPYRIGHT.md
 """
 
-from preprocessor import EnsemblePreprocessor, CMIP5Preprocessor
+from preprocessor import EnsemblePreprocessor, CMIP5Preprocessor, EnsembleStatistics
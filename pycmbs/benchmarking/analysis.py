@@ -22,11 +22,12 @@ import numpy as np
 from dateutil.rrule import rrule
 from dateutil.rrule import MONTHLY
 
-from pycmbs.diagnostic import PatternCorrelation, RegionalAnalysis, Diagnostic
+from pycmbs.diagnostic import PatternCorrelation, RegionalAnalysis, Diagnostic, ReichlerIndex
 from pycmbs.plots import GlobalMeanPlot, map_season, map_difference, ReichlerPlot, HstackTimeseries
 from pycmbs.mapping import map_plot
 from pycmbs.data import Data
 from pycmbs.benchmarking.utils import get_T63_landseamask, get_temporary_directory
+from pycmbs.benchmarking.report import get_fingerprint
 
 
 def preprocess_seasonal_data(raw_file, interval=None, themask=None,
@@ -551,6 +552,8 @@ def generic_analysis(plot_options, model_list, obs_type, obs_name,
     if f_pattern_correlation:  # init plot for PatternCorrelation
         PC_plot = HstackTimeseries()
 
+    gleckler_index = None  # reference for Gleckler plot; prepared only once
+
     if f_globalmeanplot:
         if GM is None:
             fG = plt.figure()
@@ -584,22 +587,27 @@ def generic_analysis(plot_options, model_list, obs_type, obs_name,
         GM_HT_clim.add_data(tmp.fldmean(), 'obs:' + obs_monthly.label)  # global mean climatology
         del tmp
 
-    if f_mapseasons is True:  # seasonal mean plot for observations
-
-        f_season = map_season(obs_orig, use_basemap=use_basemap,
-                              cmap_data='jet',
-                              show_zonal=False, zonal_timmean=True,
-                              nclasses=nclasses,
-                              vmin=vmin, vmax=vmax, cticks=cticks,
-                              proj=projection, stat_type=stat_type,
-                              show_stat=True, drawparallels=False,
-                              titlefontsize=8)
+    # all options which affect the maps; used to identify unchanged figures
+    map_options = [use_basemap, nclasses, vmin, vmax, dmin, dmax, cticks,
+                   cticks_diff, cticks_rdiff, projection, stat_type]
 
+    if f_mapseasons is True:  # seasonal mean plot for observations
         if len(obs_orig.data) == 4:
-            report.figure(f_season, caption='Seasonal mean ' + obs_name)
+            caption = 'Seasonal mean ' + obs_name
         else:
-            report.figure(f_season, caption='Monthly mean ' + obs_name)
-        plt.close(f_season.number)
+            caption = 'Monthly mean ' + obs_name
+        fp = get_fingerprint('map_season', obs_orig, map_options)
+        if not report.reuse_figure(fp, caption=caption):
+            f_season = map_season(obs_orig, use_basemap=use_basemap,
+                                  cmap_data='jet',
+                                  show_zonal=False, zonal_timmean=True,
+                                  nclasses=nclasses,
+                                  vmin=vmin, vmax=vmax, cticks=cticks,
+                                  proj=projection, stat_type=stat_type,
+                                  show_stat=True, drawparallels=False,
+                                  titlefontsize=8)
+            report.figure(f_season, caption=caption, fingerprint=fp)
+            plt.close(f_season.number)
 
     ####################################################################################################################
     # MAIN LIST OVER MODELS
@@ -671,21 +679,25 @@ def generic_analysis(plot_options, model_list, obs_type, obs_name,
             sys.stdout.write('\n *** Map difference plotting. \n')
             # generate difference map
             savegraphics_prefix = os.environ['PYCMBS_OUTPUTDIR'] + obs_orig._get_label() + '___' + model_data._get_label() + '.' + os.environ['PYCMBS_OUTPUTFORMAT']
-            f_dif = map_difference(model_data, obs_orig,
-                                   nclasses=nclasses,
-                                   use_basemap=use_basemap,
-                                   show_zonal=False, zonal_timmean=True,
-                                   dmin=dmin, dmax=dmax, vmin=vmin,
-                                   vmax=vmax, cticks=cticks,
-                                   proj=projection, stat_type=stat_type,
-                                   show_stat=True, drawparallels=False,
-                                   colorbar_orientation='horizontal',
-                                   savegraphics_prefix=savegraphics_prefix,
-                                   cticks_diff=cticks_diff,
-                                   cticks_rdiff=cticks_rdiff)
-            report.figure(f_dif, caption='Temporal mean fields (top) and absolute and relative differences (bottom)')
-            plt.close(f_dif.number)
-            del f_dif
+            caption = 'Temporal mean fields (top) and absolute and relative differences (bottom)'
+            # if the figure is reused, then the separate graphic files are not written again
+            fp = get_fingerprint('map_difference', model_data, obs_orig, map_options, savegraphics_prefix)
+            if not report.reuse_figure(fp, caption=caption):
+                f_dif = map_difference(model_data, obs_orig,
+                                       nclasses=nclasses,
+                                       use_basemap=use_basemap,
+                                       show_zonal=False, zonal_timmean=True,
+                                       dmin=dmin, dmax=dmax, vmin=vmin,
+                                       vmax=vmax, cticks=cticks,
+                                       proj=projection, stat_type=stat_type,
+                                       show_stat=True, drawparallels=False,
+                                       colorbar_orientation='horizontal',
+                                       savegraphics_prefix=savegraphics_prefix,
+                                       cticks_diff=cticks_diff,
+                                       cticks_rdiff=cticks_rdiff)
+                report.figure(f_dif, caption=caption, fingerprint=fp)
+                plt.close(f_dif.number)
+                del f_dif
 
         f_compare_timeseries = False  # todo
         if f_compare_timeseries is True:
@@ -721,48 +733,51 @@ def generic_analysis(plot_options, model_list, obs_type, obs_name,
             sys.stdout.write('\n *** Seasonal maps plotting\n')
 
             # seasonal map
-            f_season = map_season(model_data, use_basemap=use_basemap,
-                                  cmap_data='jet',
-                                  show_zonal=False, zonal_timmean=True,
-                                  nclasses=nclasses,
-                                  vmin=vmin, vmax=vmax, cticks=cticks,
-                                  proj=projection, stat_type=stat_type,
-                                  show_stat=True,
-                                  drawparallels=False, titlefontsize=8)
             if len(model_data.data) == 4:
-                report.figure(f_season, caption='Seasonal mean climatology for ' + model.name)
+                caption = 'Seasonal mean climatology for ' + model.name
             else:
-                report.figure(f_season, caption='Monthly mean climatology for ' + model.name)
-            plt.close(f_season.number)
-            del f_season
-
-        if f_mapseason_difference:
-            # generate seasonal plot of difference
-            f_season_dif = map_season(model_data.sub(obs_orig),
-                                      use_basemap=use_basemap,
-                                      cmap_data='RdBu_r',
-                                      show_zonal=False,
-                                      zonal_timmean=True,
+                caption = 'Monthly mean climatology for ' + model.name
+            fp = get_fingerprint('map_season', model_data, map_options)
+            if not report.reuse_figure(fp, caption=caption):
+                f_season = map_season(model_data, use_basemap=use_basemap,
+                                      cmap_data='jet',
+                                      show_zonal=False, zonal_timmean=True,
                                       nclasses=nclasses,
-                                      vmin=dmin, vmax=dmax,
-                                      proj=projection,
-                                      stat_type=stat_type,
+                                      vmin=vmin, vmax=vmax, cticks=cticks,
+                                      proj=projection, stat_type=stat_type,
                                       show_stat=True,
-                                      drawparallels=False,
-                                      cticks=[cticks_diff[0],
-                                              cticks_diff[-1]],
-                                      titlefontsize=10)
+                                      drawparallels=False, titlefontsize=8)
+                report.figure(f_season, caption=caption, fingerprint=fp)
+                plt.close(f_season.number)
+                del f_season
 
+        if f_mapseason_difference:
+            # generate seasonal plot of difference
             if len(model_data.data) == 4:
-                report.figure(f_season_dif,
-                              caption='Seasonal mean climatology of difference between '
-                                      + model.name.upper() + ' and ' + obs_orig.label.upper())
+                caption = 'Seasonal mean climatology of difference between ' \
+                    + model.name.upper() + ' and ' + obs_orig.label.upper()
             else:
-                report.figure(f_season_dif,
-                              caption='Monthly mean climatology of difference between '
-                                      + model.name.upper() + ' and ' + obs_orig.label.upper())
-            plt.close(f_season_dif.number)
-            del f_season_dif
+                caption = 'Monthly mean climatology of difference between ' \
+                    + model.name.upper() + ' and ' + obs_orig.label.upper()
+            fp = get_fingerprint('map_season_difference', model_data, obs_orig, map_options)
+            if not report.reuse_figure(fp, caption=caption):
+                f_season_dif = map_season(model_data.sub(obs_orig),
+                                          use_basemap=use_basemap,
+                                          cmap_data='RdBu_r',
+                                          show_zonal=False,
+                                          zonal_timmean=True,
+                                          nclasses=nclasses,
+                                          vmin=dmin, vmax=dmax,
+                                          proj=projection,
+                                          stat_type=stat_type,
+                                          show_stat=True,
+                                          drawparallels=False,
+                                          cticks=[cticks_diff[0],
+                                                  cticks_diff[-1]],
+                                          titlefontsize=10)
+                report.figure(f_season_dif, caption=caption, fingerprint=fp)
+                plt.close(f_season_dif.number)
+                del f_season_dif
 
         if f_pattern_correlation:
             # perform pattern correlation
@@ -871,8 +886,14 @@ def generic_analysis(plot_options, model_list, obs_type, obs_name,
 
         if f_gleckler is True:
             sys.stdout.write('\n *** Glecker plot. \n')
-            e2a = GP.calc_index(obs_orig, model_data, model, obs_type)
-            GP.add_data(obs_type, model._unique_name, e2a, pos=gleckler_pos)
+            if gleckler_index is None:
+                gleckler_index = ReichlerIndex(obs_orig)
+            GP.calc_indices(obs_orig, [model_data], [model._unique_name], obs_type,
+                            pos=gleckler_pos, index=gleckler_index)
+
+        del model_data
+
+    del gleckler_index
 
     # final plotting
     if f_pattern_correlation:
@@ -16,7 +16,7 @@ import ast
 import numpy as np
 
 from pycmbs.benchmarking import preprocessor
-from pycmbs.benchmarking.utils import get_T63_landseamask, get_temporary_directory
+from pycmbs.benchmarking.utils import get_T63_landseamask, get_generic_landseamask, get_temporary_directory
 from pycmbs.benchmarking.models.model_basic import *
 
 from pycmbs.utils import print_log, WARNING
@@ -14,6 +14,7 @@ import os
 import sys
 import numpy as np
 
+from pycmbs.statistic import quantiles, QuantileSketch
 from pycmbs.benchmarking import preprocessor
 from pycmbs.benchmarking.utils import get_T63_landseamask, get_temporary_directory
 
@@ -119,156 +120,499 @@ class Model(Data):
                 self.variables.update({k: None})
 
 
-class MedianModel(Model):
+class EnsembleAccumulator(object):
     """
-    implements a class that allows to handle multiple ensembles and calculate
-    ensemble statistics
+    online statistics of a field over ensemble members
+
+    The members are added one at a time. For each element (e.g. grid
+    cell) the number of valid members, the mean and variance (Welford's
+    online algorithm), as well as the minimum and maximum are updated.
+    The memory needed is therefore independent of the number of
+    members. Percentiles (e.g. the median) can be calculated in addition,
+    either exactly from a memory-mapped stack of all members on disk
+    (method='exact') or approximately using a QuantileSketch
+    (method='sketch').
+
+    The standard deviation is the population standard deviation
+    (like CDO ensstd).
+
+    Example
+    -------
+    A = EnsembleAccumulator(percentiles=[50.])
+    for x in fields:
+        A.add(x)
+    mean, std = A.mean(), A.std()
+    median = A.percentiles()[0]
     """
-    def __init__(self, dic_variables, intervals=None, **kwargs):
-        super(MeanModel, self).__init__(None, dic_variables,
-                                        name='median-model',
-                                        intervals=intervals, **kwargs)
-        self.n = 0  # specifies only the number of models that were used in general, does NOT specify if the data is valid!
-        self._unique_name = 'model_median'
-        self.ensmean_called = False
 
-    def add_member(self, M):
+    def __init__(self, percentiles=None, method='exact', stack_dir=None, sketch_size=200):
         """
-        add ensemble member
-        this routine adds an ensemble member to the already existing
-        dataset; note: to save memory, we
-        don't store the individual members, but calculate the median
-        on the fly
-        """
-
-        if not (M, Model):
-            if not issubclass(M, Model):
-                raise ValueError('Model instance or derived class expected here!')
-
-        if self.n == 0:
-            # copy only variables that are valid. This will be the basis
-            # for the whole output
-            self.variables = {}
-            for k in M.variables.keys():
-                if M.variables[k] is not None:
-                    self.variables.update({k: M.variables[k]})
-            self.name = 'median-model'
-            self._unique_name = 'model_median'
-            self.n_above = {}
-            self.n_below = {}
-
-            # init arrays that specify how much datasets are above/below
-            # the current value
-            for k in self.variables.keys():
-                if self.variables[k] is not None:
-                    self.n_above.update({k: np.zeros_like(self.variables[k].data)})
-                    self.n_below.update({k: np.zeros_like(self.variables[k].data)})
-        else:
-            # Processing in case that the data arrays already contain
-            # data. The actual value is compared to the new value
-            # and the information is stored how many values are
-            # above/below
-            for k in self.variables.keys():
-                # the variables[] list contains Data objects!
-                # hlp1 = self.variables[k]  # is a Data object or a tuple! The Data object contains already the climatological mean value!
-                if k in M.variables.keys():
-                    hlp2 = M.variables[k]
+        Parameters
+        ----------
+        percentiles : list
+            list of percentiles [0...100] to calculate. If None, then
+            no percentiles are calculated and no data of the individual
+            members is kept
+        method : str
+            ['exact','sketch']; exact: members are stored in a temporary
+            file in stack_dir and the percentiles are calculated exactly.
+            sketch: percentiles are estimated from a QuantileSketch;
+            these are exact as long as less than 2*sketch_size members
+            are added
+        stack_dir : str
+            directory for the temporary member stack (method='exact');
+            the system temporary directory is used if None
+        sketch_size : int
+            size of the quantile sketch (method='sketch')
+        """
+        if method not in ['exact', 'sketch']:
+            raise ValueError('Invalid method for ensemble percentiles: %s' % method)
+        if percentiles is not None:
+            percentiles = list(np.asarray(percentiles, dtype='float').flatten())
+            if np.any(np.asarray(percentiles) < 0.) or np.any(np.asarray(percentiles) > 100.):
+                raise ValueError('Percentiles need to be within [0,100]')
+        self.percentile_list = percentiles
+        self.method = method
+        self.stack_dir = stack_dir
+        self.sketch_size = sketch_size
+        self.shape = None
+        self.nmembers = 0
+        self._stack_file = None
+        self._sketch = None
+
+    def add(self, x):
+        """
+        add an ensemble member
+
+        Parameters
+        ----------
+        x : ndarray
+            field of the member; masked values and NaN are ignored
+        """
+        x = np.ma.masked_invalid(np.ma.asarray(x, dtype='float'))
+        if self.shape is None:
+            self.shape = x.shape
+            self._n = np.zeros(x.shape, dtype='int')
+            self._mean = np.zeros(x.shape)
+            self._m2 = np.zeros(x.shape)
+            self._min = np.ones(x.shape) * np.inf
+            self._max = np.ones(x.shape) * -np.inf
+            if self.percentile_list is not None:
+                if self.method == 'exact':
+                    fd, self._stack_file = tempfile.mkstemp(suffix='.ensstack', dir=self.stack_dir)
+                    os.close(fd)
                 else:
-                    print('Warning: variable %s is not available!' % k)
-                    hlp2 = None
-                if hlp2 is None:
-                    print('WARNING: Provided model is missing data field for variable %s' % k.upper())
-                    continue
-
-                if isinstance(self.variables[k], tuple):
-                    self.variables.update({k: (None, None, None)})
-                else:  # mean model!
-                    msk_below = M.variables[k].data <= self.variables[k].data
-                    raise ValueError('Implementation of median model has not yet been finished!')
-                    # could get_percentiles be used for that in some sense???
-                    stop
-
-                    up = self.n_above[k]
-
-                    theD = hlp1.copy()
-                    theD.add(hlp2, copy=False)  # SUM: by using masked arrays, the resulting field is automatically only valid, when both datasets contain valid information!
-                    theD.label = 'Mean-model'
-                    self.variables.update({k: theD})
-                    nn = self.N[k]
-                    self.N.update({k: nn + 1})
-                del hlp1, hlp2
-
-
-class MeanModel(Model):
+                    self._sketch = QuantileSketch(x.shape, size=self.sketch_size)
+        if x.shape != self.shape:
+            print x.shape, self.shape
+            raise ValueError('Geometry of ensemble member does not match!')
+
+        valid = ~np.ma.getmaskarray(x)
+        d = np.ma.filled(x, 0.)
+
+        # Welford update for valid elements only
+        self._n += valid
+        delta = np.where(valid, d - self._mean, 0.)
+        self._mean += delta / np.maximum(self._n, 1)
+        self._m2 += np.where(valid, delta * (d - self._mean), 0.)
+        self._min = np.where(valid, np.minimum(self._min, d), self._min)
+        self._max = np.where(valid, np.maximum(self._max, d), self._max)
+
+        if self._stack_file is not None:
+            f = open(self._stack_file, 'ab')
+            f.write(np.ma.filled(x, np.nan).astype('float64').tostring())
+            f.close()
+        if self._sketch is not None:
+            self._sketch.update(x.reshape((1,) + self.shape))
+        self.nmembers += 1
+
+    def _check(self):
+        if self.shape is None:
+            raise ValueError('No ensemble members available!')
+
+    def count(self):
+        """ number of valid members for each element """
+        self._check()
+        return self._n.copy()
+
+    def mean(self, nmin=1):
+        """
+        ensemble mean
+
+        Parameters
+        ----------
+        nmin : int
+            minimum number of valid members; elements with less valid
+            members are masked
+        """
+        self._check()
+        return np.ma.array(self._mean.copy(), mask=self._n < max(nmin, 1))
+
+    def std(self, nmin=1):
+        """ ensemble standard deviation; see mean() for nmin """
+        self._check()
+        return np.ma.array(np.sqrt(self._m2 / np.maximum(self._n, 1)), mask=self._n < max(nmin, 1))
+
+    def min(self, nmin=1):
+        """ ensemble minimum; see mean() for nmin """
+        self._check()
+        return np.ma.array(self._min.copy(), mask=self._n < max(nmin, 1))
+
+    def max(self, nmin=1):
+        """ ensemble maximum; see mean() for nmin """
+        self._check()
+        return np.ma.array(self._max.copy(), mask=self._n < max(nmin, 1))
+
+    def percentiles(self, nmin=1, chunksize=100000):
+        """
+        ensemble percentiles as specified in the constructor
+
+        Parameters
+        ----------
+        nmin : int
+            minimum number of valid members; see mean()
+        chunksize : int
+            number of elements processed at once (method='exact')
+
+        Returns
+        -------
+        res : ndarray
+            masked array [len(percentiles),...]
+        """
+        self._check()
+        if self.percentile_list is None:
+            raise ValueError('No percentiles were requested for the ensemble!')
+        p = np.asarray(self.percentile_list) / 100.
+        if self._sketch is not None:
+            res = self._sketch.quantiles(p)
+        else:
+            # read the member stack chunk by chunk of elements
+            ne = int(np.prod(self.shape))
+            stack = np.memmap(self._stack_file, dtype='float64', mode='r', shape=(self.nmembers, ne))
+            res = np.ma.array(np.zeros((len(p), ne)), mask=False)
+            for i in xrange(0, ne, chunksize):
+                res[:, i:i + chunksize] = quantiles(np.asarray(stack[:, i:i + chunksize]), p)
+            del stack
+            res = res.reshape((len(p),) + self.shape)
+        msk = np.ma.getmaskarray(res) | (self._n < max(nmin, 1))[np.newaxis, ...]
+        return np.ma.array(res.data, mask=msk)
+
+    def close(self):
+        """ remove temporary member stack """
+        if self._stack_file is not None:
+            if os.path.exists(self._stack_file):
+                os.remove(self._stack_file)
+            self._stack_file = None
+
+    def __del__(self):
+        self.close()
+
+
+class EnsembleModel(Model):
     """
     implements a class that allows to handle multiple ensembles and calculate
     ensemble statistics
+
+    The models are added one at a time using add_member(). For each
+    variable only the running statistics are kept (see
+    EnsembleAccumulator), thus the memory needed does not depend on the
+    number of models. The monthly timeseries of the models (the '_org'
+    tuples) are aggregated as well; these are aligned by date (year and
+    month for monthly data) to the time axis of the first model.
+
+    After all members were added, ensstat() needs to be called. The
+    ensemble mean fields are then available as variables like for any
+    other model, and the other statistics can be obtained using
+    get_ensemble_statistic().
+
+    Example
+    -------
+    E = EnsembleModel(dic_variables, intervals=intervals, percentiles=[50.])
+    for M in models:
+        E.add_member(M)
+    E.ensstat()
+    spread = E.get_ensemble_statistic('albedo', 'std')
+    median = E.get_ensemble_statistic('albedo', 'p50')
     """
-    def __init__(self, dic_variables, intervals=None, **kwargs):
-        super(MeanModel, self).__init__(None, dic_variables,
-                                        name='mean-model',
-                                        intervals=intervals, **kwargs)
+    def __init__(self, dic_variables, intervals=None, name='ensemble-model',
+                 percentiles=None, method='exact', stack_dir=None,
+                 sketch_size=200, nmin=1, **kwargs):
+        """
+        Parameters
+        ----------
+        dic_variables : dict
+            variables of the models
+        intervals : dict
+            temporal intervals; see Model
+        name : str
+            name of the ensemble model
+        percentiles : list
+            list of percentiles [0...100] to calculate in addition,
+            e.g. [50.] for the ensemble median
+        method : str
+            ['exact','sketch'] method to calculate the percentiles;
+            see EnsembleAccumulator
+        stack_dir : str
+            directory for the temporary member stacks (method='exact')
+        sketch_size : int
+            size of quantile sketch (method='sketch')
+        nmin : int
+            minimum number of valid members for a grid cell. If None,
+            then all models which provide a variable need to have valid
+            data
+        """
+        super(EnsembleModel, self).__init__(None, dic_variables, name=name,
+                                            intervals=intervals, **kwargs)
+        self.percentiles = percentiles
+        self.method = method
+        self.stack_dir = stack_dir
+        self.sketch_size = sketch_size
+        self.nmin = nmin
         self.n = 0  # specifies only the number of models that were used in general, does NOT specify if the data is valid!
-        self._unique_name = 'model_mean'
-        self.model_mean = None
-        self.ensmean_called = False
+        self.N = {}  # number of models for each variable
+        self._unique_name = 'model_ensemble'
+        self.variables = {}
+        self.ensemble_statistics = {}
+        self._accumulators = {}
+        self._templates = {}
+        self._org_keys = {}
+        self.ensstat_called = False
+
+    def _get_time_keys(self, D, daily=False):
+        """
+        key for each timestep of a Data object; (year,month) for monthly
+        data and (year,month,day) for data with a higher frequency
+        """
+        c = D._get_time_components()
+        if daily:
+            return (c['year'] * 100 + c['month']) * 100 + c['day']
+        else:
+            return c['year'] * 12 + c['month'] - 1
+
+    def _align_org(self, k, D):
+        """
+        align the timeseries of a member to the time axis of the ensemble;
+        timesteps not available in the member are masked
+        """
+        daily, ref = self._org_keys[k]
+        keys = self._get_time_keys(D, daily=daily)
+        if (len(keys) == len(ref)) and np.all(keys == ref):
+            return D.data
+        o = np.argsort(keys, kind='mergesort')
+        pos = np.minimum(np.searchsorted(keys[o], ref), len(keys) - 1)
+        idx = o[pos]
+        found = keys[idx] == ref
+        x = np.ma.array(D.data[idx], copy=True)
+        x[~found] = np.ma.masked
+        return x
+
+    def _new_accumulator(self):
+        return EnsembleAccumulator(percentiles=self.percentiles, method=self.method,
+                                   stack_dir=self.stack_dir, sketch_size=self.sketch_size)
 
     def add_member(self, M):
         """
         add ensemble member
-        this routine adds an ensemble member to the already existing
-        dataset; note: to save memory, we
-        don't store the individual members, but just the sum of them!
 
-        one needs to call ensmean() afterwards to get the ensemble mean!
-        """
+        this routine updates the ensemble statistics with the variables
+        of a model. The individual members are not stored.
 
-        if not (M, Model):
-            if not issubclass(M, Model):
-                raise ValueError('Model instance or derived class expected here!')
+        one needs to call ensstat() afterwards to get the ensemble
+        statistics!
 
-        if self.n == 0:
-            tmp = M.copy()
-            self.variables = tmp.variables
-            del tmp
-            self.name = 'mean-model'
-            self._unique_name = 'model_mean'
-            self.N = {}
+        Parameters
+        ----------
+        M : Model
+            model to add
+        """
+        if not isinstance(M, Model):
+            raise ValueError('Model instance or derived class expected here!')
+        if self.ensstat_called:
+            raise ValueError('Ensemble statistics have been already calculated!')
+
+        for k in M.variables.keys():
+            v = M.variables[k]
+            if isinstance(v, tuple):  # (time, meanfield, originalfield)
+                D = v[2] if len(v) > 2 else None
+            else:
+                D = v
+            if D is None:
+                print('WARNING: Provided model is missing data field for variable %s' % k.upper())
+                if k not in self.variables.keys():
+                    self.variables.update({k: v})
+                continue
+            if (self.n > 0) and (k not in self._accumulators.keys()):
+                print('Warning: variable %s is not available for all models!' % k)
+
+            if k not in self._accumulators.keys():
+                self._accumulators.update({k: self._new_accumulator()})
+                tmpl = D.copy()
+                self._templates.update({k: tmpl})
+                self.N.update({k: 0})
+                if isinstance(v, tuple):
+                    keys = self._get_time_keys(tmpl)
+                    daily = len(np.unique(keys)) < len(keys)
+                    if daily:
+                        keys = self._get_time_keys(tmpl, daily=True)
+                    self._org_keys.update({k: (daily, keys)})
+                self.variables.update({k: tmpl})
+
+            if isinstance(v, tuple):
+                x = self._align_org(k, D)
+            else:
+                x = D.data
+            if np.shape(x) != self._templates[k].data.shape:
+                print('WARNING: Invalid geometry of variable %s; model is skipped for this variable' % k.upper())
+                continue
+            self._accumulators[k].add(x)
+            self.N.update({k: self.N[k] + 1})
 
-            for k in self.variables.keys():  # count for each variable the number of valid models
-                if self.variables[k] is not None:
-                    self.N.update({k: 1})
-                else:
-                    self.N.update({k: 0})
+        self.n += 1  # specifies only the number of models that were used in general, does NOT specify if the data is valid!
+
+    def _get_nmin(self, k):
+        if self.nmin is None:
+            return self.N[k]
         else:
-            # Do processing for each variable ...
-            for k in self.variables.keys():
-                # the variables[] list contains Data objects!
-                hlp1 = self.variables[k]  # is a Data object or a tuple! The Data object contains already the climatological mean value!
-                if k in M.variables.keys():
-                    hlp2 = M.variables[k]
+            return self.nmin
+
+    def ensstat(self):
+        """
+        calculate ensemble statistics
+
+        The variables of the ensemble model are set to the ensemble mean.
+        The individual statistics (mean, std, min, max, count and the
+        percentiles, named e.g. 'p50') are stored as Data objects in
+        the dictionary self.ensemble_statistics[variable].
+        """
+        if self.ensstat_called:
+            raise ValueError('Ensemble statistics have been already calculated! MUST NOT be called a second time !')
+
+        for k in self._accumulators.keys():
+            A = self._accumulators[k]
+            tmpl = self._templates[k]
+            nmin = self._get_nmin(k)
+            res = {'mean': A.mean(nmin=nmin), 'std': A.std(nmin=nmin),
+                   'min': A.min(nmin=nmin), 'max': A.max(nmin=nmin),
+                   'count': np.ma.array(A.count())}
+            if self.percentiles is not None:
+                p = A.percentiles(nmin=nmin)
+                for i in xrange(len(self.percentiles)):
+                    res.update({'p' + ('%g' % self.percentiles[i]): p[i]})
+            A.close()
+
+            stats = {}
+            for s in res.keys():
+                if s == 'mean':
+                    r = tmpl  # template is not needed anymore
                 else:
-                    print('Warning: variable %s is not available!' % k)
-                    hlp2 = None
-
-                if hlp2 is None:
-                    print('WARNING: Provided model is missing data field for variable %s' % k.upper())
-                    continue
-
-                if isinstance(hlp1, tuple):
-                    self.variables.update({k: (None, None, None)})
-                else:  # mean model!
-                    if hlp1 is None:
-                        continue
-                    theD = hlp1.copy()
-                    theD.add(hlp2, copy=False)  # SUM: by using masked arrays, the resulting field is automatically only valid, when both datasets contain valid information!
-                    theD.label = 'Mean-model'
-                    self.variables.update({k: theD})
-                    nn = self.N[k]
-                    self.N.update({k: nn + 1})
-                del hlp1, hlp2
+                    r = tmpl.copy()
+                for a in ['std', 'n']:  # statistics of first member not valid for ensemble
+                    if hasattr(r, a):
+                        delattr(r, a)
+                r.data = res[s]
+                r.label = 'ens' + s + '_' + k
+                if s == 'count':
+                    r.unit = '-'
+                stats.update({s: r})
+            self.ensemble_statistics.update({k: stats})
+
+            if k in self._org_keys.keys():
+                D = stats['mean']
+                self.variables.update({k: (D.time, D.fldmean(), D)})
+            else:
+                self.variables.update({k: stats['mean']})
 
-        self.n += 1  # specifies only the number of models that were used in general, does NOT specify if the data is valid!
+        self._accumulators = {}
+        self._templates = {}
+        self.ensstat_called = True
+
+    def get_ensemble_statistic(self, k, stat):
+        """
+        get ensemble statistic of a variable
+
+        Parameters
+        ----------
+        k : str
+            name of variable
+        stat : str
+            name of statistic ['mean','std','min','max','count'] or
+            a percentile like 'p50'
+
+        Returns
+        -------
+        Data object
+        """
+        if not self.ensstat_called:
+            raise ValueError('Ensemble statistics need to be calculated first using ensstat()!')
+        if k not in self.ensemble_statistics.keys():
+            raise ValueError('Variable not available in ensemble: %s' % k)
+        if stat not in self.ensemble_statistics[k].keys():
+            raise ValueError('Invalid ensemble statistic: %s' % stat)
+        return self.ensemble_statistics[k][stat]
+
+    def save_statistics(self, directory, prefix=None):
+        """
+        save all ensemble statistics of all variables to file
+
+        Parameters
+        ----------
+        directory : str
+            directory where to store the data to
+        prefix : str
+            file prefix [obligatory]
+        """
+        if prefix is None:
+            raise ValueError('File prefix needs to be given!')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if directory[-1] != os.sep:
+            directory += os.sep
+        for k in self.ensemble_statistics.keys():
+            for s in self.ensemble_statistics[k].keys():
+                self.ensemble_statistics[k][s].save(directory + prefix + '_' + k.strip().upper() + '_ens' + s + '.nc', varname=k.strip().lower(), delete=True, mean=False, timmean=False)
+
+
+class MedianModel(EnsembleModel):
+    """
+    implements a class that allows to handle multiple ensembles and calculate
+    the ensemble median
+    """
+    def __init__(self, dic_variables, intervals=None, method='exact', **kwargs):
+        super(MedianModel, self).__init__(dic_variables, intervals=intervals,
+                                          name='median-model', percentiles=[50.],
+                                          method=method, **kwargs)
+        self._unique_name = 'model_median'
+
+    def ensmedian(self):
+        """
+        calculate ensemble median
+        """
+        self.ensstat()
+        for k in self.ensemble_statistics.keys():
+            D = self.ensemble_statistics[k]['p50']
+            D.label = 'ensmedian_' + k
+            if k in self._org_keys.keys():
+                self.variables.update({k: (D.time, D.fldmean(), D)})
+            else:
+                self.variables.update({k: D})
+
+
+class MeanModel(EnsembleModel):
+    """
+    implements a class that allows to handle multiple ensembles and calculate
+    ensemble statistics
+
+    Like in earlier versions, a grid cell of the ensemble mean is only
+    valid if all models providing the variable contain valid data. The
+    ensemble spread is available via get_ensemble_statistic().
+    """
+    def __init__(self, dic_variables, intervals=None, **kwargs):
+        if 'nmin' not in kwargs.keys():
+            kwargs.update({'nmin': None})
+        super(MeanModel, self).__init__(dic_variables, intervals=intervals,
+                                        name='mean-model', **kwargs)
+        self._unique_name = 'model_mean'
+        self.ensmean_called = False
 
     def ensmean(self):
         """
@@ -276,15 +620,9 @@ class MeanModel(Model):
         """
         if self.ensmean_called:
             raise ValueError('Ensemble mean has been already called! MUST NOT be called a second time !')
-
-        # now we have the sum and can calculate the average
-        for k in self.variables.keys():
-            if isinstance(self.variables[k], tuple):
-                pass
-            else:
-                if self.variables[k] is not None:
-                    self.variables[k].mulc(1. / float(self.N[k]), copy=False)  # weight with number of models
-                    self.variables[k].label = 'ensmean_' + k
+        self.ensstat()
+        for k in self.ensemble_statistics.keys():
+            self.ensemble_statistics[k]['mean'].label = 'ensmean_' + k
         self.ensmean_called = True
 
 #------------------------------------------------------------------------------
@@ -13,12 +13,125 @@ import glob
 import os
 import sys
 import numpy as np
+from multiprocessing.pool import ThreadPool
 
 from pycmbs.benchmarking import preprocessor
-from pycmbs.benchmarking.utils import get_T63_landseamask, get_temporary_directory
+from pycmbs.benchmarking.utils import get_T63_landseamask, get_generic_landseamask, get_temporary_directory
 from pycmbs.benchmarking.models.model_basic import *
 
 
+def _get_new_stream_files(files, logfile):
+    """
+    get the input files of a stream which have not been processed yet
+
+    Parameters
+    ----------
+    files : list
+        list of all input files of the stream
+    logfile : str
+        file which contains the names of the already processed
+        input files (one per line)
+
+    Returns
+    -------
+    list of files not contained in logfile (sorted)
+    """
+    done = set(_read_stream_log(logfile))
+    return sorted([x for x in files if x not in done])
+
+
+def _read_stream_log(logfile):
+    """ read names of processed input files """
+    if not os.path.exists(logfile):
+        return []
+    f = open(logfile, 'r')
+    done = [l.strip() for l in f.readlines() if len(l.strip()) > 0]
+    f.close()
+    return done
+
+
+def _write_stream_log(files, logfile):
+    """ write names of processed input files """
+    tmp = logfile + '.tmp'
+    f = open(tmp, 'w')
+    for x in sorted(files):
+        f.write(x + '\n')
+    f.close()
+    os.rename(tmp, logfile)  # atomic; log is only valid if complete
+
+
+def _merge_stream(stream):
+    """
+    merge the monthly files of a single model output stream
+
+    Time concatenation, assignment of the codetable and monthly
+    averaging are done in a single CDO operator chain without any
+    intermediate file. The processed input files are recorded in
+    <outfile>.files. If new input files were appended since the last
+    run, then only these are processed and appended to the existing
+    output file.
+
+    An output file which already exists without such a record (e.g.
+    from an older version) is used as is.
+
+    Parameters
+    ----------
+    stream : tuple
+        (key, pattern, outfile, codetable, monmean) with
+        key : str; name of stream
+        pattern : str; filename pattern of input files
+        outfile : str; name of output file
+        codetable : str; codetable to apply (None if not needed)
+        monmean : bool; calculate monthly mean (needed for
+        JSBACH streams as otherwise the interface does not work)
+
+    Returns
+    -------
+    (key, outfile)
+    """
+    key, pattern, outfile, codetable, monmean = stream
+
+    logfile = outfile + '.files'
+    if os.path.exists(outfile) and not os.path.exists(logfile):
+        return key, outfile
+
+    files = glob.glob(pattern)
+    if len(files) == 0:  # check if input files existing at all
+        return key, outfile
+    if not os.path.exists(outfile):
+        if os.path.exists(logfile):
+            os.remove(logfile)
+    new_files = _get_new_stream_files(files, logfile)
+    if len(new_files) == 0:
+        return key, outfile
+
+    print '   Merging %s stream (%i new files) ...' % (key, len(new_files))
+    cdo = Cdo()
+
+    if os.path.exists(outfile):  # append new months to existing file
+        target = tempfile.mktemp(suffix='.nc', prefix=os.path.basename(outfile)[:-3] + '_', dir=os.path.dirname(outfile))
+    else:
+        target = outfile
+
+    chain = '-mergetime ' + ' '.join(new_files)
+    if codetable is not None:
+        if os.path.exists(codetable):
+            chain = '-setpartab,' + codetable + ' ' + chain
+    if monmean:
+        cdo.monmean(options='-f nc', output=target, input=chain)
+    else:
+        cdo.mergetime(options='-f nc', output=target, input=' '.join(new_files))
+
+    if target != outfile:
+        tmp = tempfile.mktemp(suffix='.nc', prefix=os.path.basename(outfile)[:-3] + '_', dir=os.path.dirname(outfile))
+        cdo.mergetime(options='-f nc', output=tmp, input=outfile + ' ' + target)
+        os.rename(tmp, outfile)
+        os.remove(target)
+
+    _write_stream_log(_read_stream_log(logfile) + new_files, logfile)
+    return key, outfile
+
+
 class JSBACH_BOT(Model):
 
     def __init__(self, filename, dic_variables, experiment, name='', shift_lon=False, **kwargs):
@@ -187,7 +300,7 @@ class JSBACH_RAW2(Model):
     """
 
     #def __init__(self, filename, dic_variables, experiment, name='', shift_lon=False, model_dict=None, input_format='grb', raw_outdata='outdata/jsbach/', **kwargs):
-    def __init__(self, filename, dic_variables, experiment, name='', shift_lon=False, input_format='grb', raw_outdata='outdata/jsbach/', **kwargs):
+    def __init__(self, filename, dic_variables, experiment, name='', shift_lon=False, input_format='grb', raw_outdata='outdata/jsbach/', nproc=4, **kwargs):
         """
 
         The assignment of certain variables to different input streams is done in the routine
@@ -199,6 +312,8 @@ class JSBACH_RAW2(Model):
         input_format : str
             specifies file format of input data
             ['nc','grb']
+        nproc : int
+            number of input streams which are preprocessed concurrently
         """
 
         super(JSBACH_RAW2, self).__init__(filename, dic_variables, name=name, **kwargs)
@@ -212,6 +327,7 @@ class JSBACH_RAW2(Model):
         assert self.input_format in ['nc', 'grb']
 
         self.raw_outdata = raw_outdata
+        self.nproc = nproc
 
         self._unique_name = self._get_unique_name()
 
@@ -243,7 +359,7 @@ class JSBACH_RAW2(Model):
     def _get_filenames_echam_BOT(self):
         return self.data_dir + self.raw_outdata + '../echam6/' + self.experiment + '_echam6_BOT_mm_*.sz'
 
-    def _preproc_streams(self):
+    def _preproc_streams(self, nproc=None):
         """
         It is assumed that the standard JSBACH postprocessing scripts have been applied.
         Thus monthly mean data is available for each stream and code tables still need to be applied.
@@ -252,127 +368,50 @@ class JSBACH_RAW2(Model):
         1) merge all times from individual (monthly mean) output files
         2) assign codetables to work with proper variable names
         3) aggregate data from tiles to gridbox values
+
+        The streams are independent from each other and are therefore
+        processed concurrently. For each stream, merging, renaming and
+        monthly averaging is done in a single CDO operator chain,
+        without an intermediate file. The processed raw files are
+        recorded, so that a rerun only processes newly appended months
+        (see _merge_stream() for details).
+
+        Parameters
+        ----------
+        nproc : int
+            number of streams to process concurrently. If None, then
+            self.nproc is used
         """
 
         print 'Preprocessing JSBACH raw data streams (may take a while) ...'
 
-        cdo = Cdo()
-
-        # jsbach stream
-        print '   JSBACH stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_jsbach_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
-        else:
-            codetable = self.data_dir + 'log/' + self.experiment + '_jsbach.codes'
-            tmp = tempfile.mktemp(suffix='.nc', prefix=self.experiment + '_jsbach_', dir=get_temporary_directory())  # temporary file
-            #~ print self.data_dir
-            #~ print self.raw_outdata
-            #~ print 'Files: ', self._get_filenames_jsbach_stream()
-            #~ stop
-            if len(glob.glob(self._get_filenames_jsbach_stream())) > 0:  # check if input files existing at all
-                print 'Mering the following files:', self._get_filenames_jsbach_stream()
-                cdo.mergetime(options='-f nc', output=tmp, input=self._get_filenames_jsbach_stream())
-                if os.path.exists(codetable):
-                    cdo.monmean(options='-f nc', output=outfile, input='-setpartab,' + codetable + ' ' + tmp)  # monmean needed here, as otherwise interface does not work
-                else:
-                    cdo.monmean(options='-f nc', output=outfile, input=tmp)  # monmean needed here, as otherwise interface does not work
-                print 'Outfile: ', outfile
-                #~ os.remove(tmp)
-
-                print 'Temporary name: ', tmp
-
-        self.files.update({'jsbach': outfile})
-
-        # veg stream
-        print '   VEG stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_jsbach_veg_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
-        else:
-            codetable = self.data_dir + 'log/' + self.experiment + '_jsbach_veg.codes'
-            tmp = tempfile.mktemp(suffix='.nc', prefix=self.experiment + '_jsbach_veg_', dir=get_temporary_directory())  # temporary file
-            if len(glob.glob(self._get_filenames_veg_stream())) > 0:  # check if input files existing at all
-                cdo.mergetime(options='-f nc', output=tmp, input=self._get_filenames_veg_stream())
-                if os.path.exists(codetable):
-                    cdo.monmean(options='-f nc', output=outfile, input='-setpartab,' + codetable + ' ' + tmp)  # monmean needed here, as otherwise interface does not work
-                else:
-                    cdo.monmean(options='-f nc', output=outfile, input=tmp)  # monmean needed here, as otherwise interface does not work
-                os.remove(tmp)
-        self.files.update({'veg': outfile})
-
-        # veg land
-        print '   LAND stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_jsbach_land_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
+        if nproc is None:
+            nproc = self.nproc
+
+        tdir = get_temporary_directory()
+        ldir = self.data_dir + 'log/' + self.experiment
+
+        # key, filename pattern, output file, codetable, monthly mean
+        streams = [('jsbach', self._get_filenames_jsbach_stream(), tdir + self.experiment + '_jsbach_mm_full.nc', ldir + '_jsbach.codes', True),
+                   ('veg', self._get_filenames_veg_stream(), tdir + self.experiment + '_jsbach_veg_mm_full.nc', ldir + '_jsbach_veg.codes', True),
+                   ('land', self._get_filenames_land_stream(), tdir + self.experiment + '_jsbach_land_mm_full.nc', ldir + '_jsbach_land.codes', True),
+                   ('surf', self._get_filenames_surf_stream(), tdir + self.experiment + '_jsbach_surf_mm_full.nc', ldir + '_jsbach_surf.codes', True),
+                   ('echam', self._get_filenames_echam_BOT(), tdir + self.experiment + '_echam6_echam_mm_full.nc', ldir + '_echam6_echam.codes', True),
+                   # albedo files as preprocessed by a script of Thomas
+                   ('albedo_vis', self._get_filenames_albedo_VIS(), tdir + self.experiment + '_jsbach_VIS_albedo_mm_full.nc', None, False),
+                   ('albedo_nir', self._get_filenames_albedo_NIR(), tdir + self.experiment + '_jsbach_NIR_albedo_mm_full.nc', None, False)]
+
+        if nproc > 1:
+            # the work is done by CDO processes; threads are thus sufficient
+            pool = ThreadPool(processes=min(nproc, len(streams)))
+            res = pool.map(_merge_stream, streams)
+            pool.close()
+            pool.join()
         else:
-            codetable = self.data_dir + 'log/' + self.experiment + '_jsbach_land.codes'
-            tmp = tempfile.mktemp(suffix='.nc', prefix=self.experiment + '_jsbach_land_', dir=get_temporary_directory())  # temporary file
-            if len(glob.glob(self._get_filenames_land_stream())) > 0:  # check if input files existing at all
-                cdo.mergetime(options='-f nc', output=tmp, input=self._get_filenames_land_stream())
-                if os.path.exists(codetable):
-                    cdo.monmean(options='-f nc', output=outfile, input='-setpartab,' + codetable + ' ' + tmp)  # monmean needed here, as otherwise interface does not work
-                else:
-                    cdo.monmean(options='-f nc', output=outfile, input=tmp)  # monmean needed here, as otherwise interface does not work
-                os.remove(tmp)
-        self.files.update({'land': outfile})
-
-        # surf stream
-        print '   SURF stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_jsbach_surf_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
-        else:
-            codetable = self.data_dir + 'log/' + self.experiment + '_jsbach_surf.codes'
-            tmp = tempfile.mktemp(suffix='.nc', prefix=self.experiment + '_jsbach_surf_', dir=get_temporary_directory())  # temporary file
-            if len(glob.glob(self._get_filenames_surf_stream())) > 0:  # check if input files existing at all
-                print glob.glob(self._get_filenames_surf_stream())
-                cdo.mergetime(options='-f nc', output=tmp, input=self._get_filenames_surf_stream())
-                if os.path.exists(codetable):
-                    cdo.monmean(options='-f nc', output=outfile, input='-setpartab,' + codetable + ' ' + tmp)  # monmean needed here, as otherwise interface does not work
-                else:
-                    cdo.monmean(options='-f nc', output=outfile, input=tmp)  # monmean needed here, as otherwise interface does not work
-                os.remove(tmp)
-
-        self.files.update({'surf': outfile})
-
-        # ECHAM BOT stream
-        print '   BOT stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_echam6_echam_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
-        else:
-            codetable = self.data_dir + 'log/' + self.experiment + '_echam6_echam.codes'
-            tmp = tempfile.mktemp(suffix='.nc', prefix=self.experiment + '_echam6_echam_', dir=get_temporary_directory())  # temporary file
-            if len(glob.glob(self._get_filenames_echam_BOT())) > 0:  # check if input files existing at all
-                cdo.mergetime(options='-f nc', output=tmp, input=self._get_filenames_echam_BOT())
-                if os.path.exists(codetable):
-                    cdo.monmean(options='-f nc', output=outfile, input='-setpartab,' + codetable + ' ' + tmp)  # monmean needed here, as otherwise interface does not work
-                else:
-                    cdo.monmean(options='-f nc', output=outfile, input=tmp)  # monmean needed here, as otherwise interface does not work
-                os.remove(tmp)
-        self.files.update({'echam': outfile})
-
-        # ALBEDO file
-        # albedo files as preprocessed by a script of Thomas
-        print '   ALBEDO VIS stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_jsbach_VIS_albedo_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
-        else:
-            if len(glob.glob(self._get_filenames_albedo_VIS())) > 0:  # check if input files existing at all
-                cdo.mergetime(options='-f nc', output=outfile, input=self._get_filenames_albedo_VIS())
-        self.files.update({'albedo_vis': outfile})
+            res = map(_merge_stream, streams)
 
-        print '   ALBEDO NIR stream ...'
-        outfile = get_temporary_directory() + self.experiment + '_jsbach_NIR_albedo_mm_full.nc'
-        if os.path.exists(outfile):
-            pass
-        else:
-            if len(glob.glob(self._get_filenames_albedo_NIR())) > 0:  # check if input files existing at all
-                cdo.mergetime(options='-f nc', output=outfile, input=self._get_filenames_albedo_NIR())
-        self.files.update({'albedo_nir': outfile})
+        for key, outfile in res:
+            self.files.update({key: outfile})
 
     def _get_unique_name(self):
         """
@@ -7,7 +7,249 @@ COPYRIGHT.md
 
 import os
 import glob
-import tempfile
+import datetime
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+from pycmbs.netcdf import NETCDF_LOCK, prefetch
+
+
+class EnsembleStatistics(object):
+    """
+    single pass calculation of ensemble statistics
+
+    All ensemble members are read in lockstep in chunks of timesteps.
+    The ensemble mean, standard deviation, minimum, maximum and the
+    number of valid members are calculated for each chunk at once
+    using Welford's online algorithm. Each member is therefore read
+    only once and no temporal merging of the individual files of a
+    member is needed. A time window can be applied while reading.
+    The next chunk is read on a background thread while the current
+    one is processed.
+
+    The standard deviation is the population standard deviation
+    (like CDO ensstd).
+
+    Example
+    -------
+    E = EnsembleStatistics([member1_files, member2_files], 'tas')
+    E.calc({'mean': 'tas_ensmean.nc', 'std': 'tas_ensstd.nc'})
+    """
+
+    stats = ['mean', 'std', 'min', 'max', 'count']
+
+    def __init__(self, members, variable, start_time=None, stop_time=None, chunksize=120, prefetch=1):
+        """
+        Parameters
+        ----------
+        members : list
+            list with the files of each ensemble member, e.g.
+            [['r1_1850.nc', 'r1_1900.nc'], ['r2_1850.nc', 'r2_1900.nc']]
+            The files of a member are ordered by time automatically.
+        variable : str
+            name of netCDF variable
+        start_time : datetime
+            start date of period (inclusive); only the date is used
+        stop_time : datetime
+            end date of period (inclusive); only the date is used
+        chunksize : int
+            number of timesteps processed at once
+        prefetch : int
+            number of chunks read ahead on a background thread;
+            0 disables reading in the background
+        """
+        if len(members) == 0:
+            raise ValueError('No ensemble members given!')
+        if (start_time is None) != (stop_time is None):
+            raise ValueError('Both, start_time and stop_time need to be specified!')
+        self.members = members
+        self.variable = variable
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.chunksize = chunksize
+        self.prefetch = prefetch
+
+    def _date_key(self, d):
+        """ comparable representation of a date (calendar independent) """
+        return (d.year, d.month, d.day, d.hour, d.minute, d.second)
+
+    def _in_window(self, d):
+        """ check if a date is within the time window (calendar independent) """
+        if self.start_time is None:
+            return True
+        t = self._date_key(d)
+        t1 = (self.start_time.year, self.start_time.month, self.start_time.day, 0, 0, 0)
+        t2 = (self.stop_time.year, self.stop_time.month, self.stop_time.day, 23, 59, 59)
+        return (t >= t1) and (t <= t2)
+
+    def _get_member_index(self, files):
+        """
+        get for each selected timestep of an ensemble member the file
+        and the index within this file
+
+        Returns
+        -------
+        index : list
+            list of tuples (filename, index)
+        dates : list
+            dates of the selected timesteps
+        """
+        import netCDF4
+        tmp = []
+        for f in files:
+            F = netCDF4.Dataset(f, 'r')
+            t = F.variables['time']
+            calendar = getattr(t, 'calendar', 'standard')
+            dates = netCDF4.num2date(np.atleast_1d(t[:]), t.units, calendar=calendar)
+            F.close()
+            for i, d in enumerate(dates):
+                if self._in_window(d):
+                    tmp.append((self._date_key(d), f, i, d))
+        tmp.sort(key=lambda x: x[0])  # files are not necessarily given in temporal order
+        return [(x[1], x[2]) for x in tmp], [x[3] for x in tmp]
+
+    def _read_chunk(self, index):
+        """
+        read the data for a list of (filename, index) as masked array
+        """
+        import netCDF4
+        res = []
+        i = 0
+        while i < len(index):
+            # read consecutive timesteps from the same file at once
+            f = index[i][0]
+            j = i
+            while (j + 1 < len(index)) and (index[j + 1][0] == f) and (index[j + 1][1] == index[j][1] + 1):
+                j += 1
+            with NETCDF_LOCK:
+                F = netCDF4.Dataset(f, 'r')
+                x = F.variables[self.variable][index[i][1]:index[j][1] + 1]
+                F.close()
+            res.append(np.ma.masked_invalid(np.ma.array(x, dtype='float')))
+            i = j + 1
+        return np.ma.concatenate(res, axis=0)
+
+    def _read_chunks(self, index, nt):
+        """
+        generator reading the chunks of all members in lockstep
+        """
+        for t1 in xrange(0, nt, self.chunksize):
+            t2 = min(t1 + self.chunksize, nt)
+            yield t1, t2, [self._read_chunk(idx[t1:t2]) for idx in index]
+
+    def _update(self, acc, x):
+        """
+        update accumulators with data of a single member (Welford)
+        """
+        valid = ~np.ma.getmaskarray(x)
+        x = np.ma.filled(x, 0.)
+        acc['count'] += valid
+        delta = np.where(valid, x - acc['mean'], 0.)
+        acc['mean'] += delta / np.maximum(acc['count'], 1)
+        acc['M2'] += delta * np.where(valid, x - acc['mean'], 0.)
+        acc['min'] = np.where(valid, np.minimum(acc['min'], x), acc['min'])
+        acc['max'] = np.where(valid, np.maximum(acc['max'], x), acc['max'])
+
+    def _create_output(self, filename, template, dates, stat):
+        """
+        create output file with the geometry and coordinates of the template file
+        """
+        import netCDF4
+        T = netCDF4.Dataset(template, 'r')
+        O = netCDF4.Dataset(filename, 'w', format='NETCDF4_CLASSIC')
+        tvar = T.variables['time']
+        for k, d in T.dimensions.items():
+            if k == 'time':
+                O.createDimension(k, None)
+            else:
+                O.createDimension(k, len(d))
+        for k, v in T.variables.items():
+            if k == self.variable:
+                continue
+            if ('time' in v.dimensions) and (k != 'time'):  # e.g. time bounds
+                continue
+            o = O.createVariable(k, v.dtype, v.dimensions)
+            o.setncatts(dict([(a, v.getncattr(a)) for a in v.ncattrs() if a != '_FillValue']))
+            if k == 'time':
+                calendar = getattr(tvar, 'calendar', 'standard')
+                if len(dates) > 0:
+                    o[:] = netCDF4.date2num(dates, tvar.units, calendar=calendar)
+            else:
+                o[:] = v[:]
+        v = T.variables[self.variable]
+        dtype = 'i4' if stat == 'count' else 'f4'
+        fill = -1 if stat == 'count' else 1.e20
+        o = O.createVariable(self.variable, dtype, v.dimensions, fill_value=fill, zlib=True)
+        o.setncatts(dict([(a, v.getncattr(a)) for a in v.ncattrs() if a not in ['_FillValue', 'missing_value', 'scale_factor', 'add_offset']]))
+        if stat == 'count':
+            o.units = '-'
+        o.setncattr('ensemble_statistic', stat)
+        o.setncattr('ensemble_members', len(self.members))
+        T.close()
+        return O
+
+    def calc(self, outfiles):
+        """
+        calculate ensemble statistics and write results to files
+
+        Parameters
+        ----------
+        outfiles : dict
+            output filenames for the different statistics; valid keys
+            are ['mean', 'std', 'min', 'max', 'count']. Only the
+            specified statistics are written.
+        """
+        for k in outfiles.keys():
+            if k not in self.stats:
+                raise ValueError('Invalid ensemble statistic: %s' % k)
+
+        index = []
+        for files in self.members:
+            idx, dates = self._get_member_index(files)
+            if len(index) > 0:
+                if len(idx) != len(index[0]):
+                    raise ValueError('Ensemble members have different number of timesteps! %i != %i' % (len(idx), len(index[0])))
+                for d, r in zip(dates, ref_dates):
+                    if self._date_key(d) != self._date_key(r):
+                        raise ValueError('Ensemble members have different timesteps! %s != %s' % (str(d), str(r)))
+            else:
+                ref_dates = dates
+                template = idx[0][0] if len(idx) > 0 else files[0]
+            index.append(idx)
+        nt = len(index[0])
+
+        out = {}
+        for k in outfiles.keys():
+            out.update({k: self._create_output(outfiles[k], template, ref_dates, k)})
+
+        chunks = self._read_chunks(index, nt)
+        if self.prefetch > 0:
+            chunks = prefetch(chunks, size=self.prefetch)
+        for t1, t2, data in chunks:
+            acc = None
+            for x in data:
+                if acc is None:
+                    acc = {'count': np.zeros(x.shape, dtype='int'),
+                           'mean': np.zeros(x.shape), 'M2': np.zeros(x.shape),
+                           'min': np.ones(x.shape) * np.inf, 'max': np.ones(x.shape) * -np.inf}
+                if x.shape != acc['mean'].shape:
+                    print x.shape, acc['mean'].shape
+                    raise ValueError('Ensemble members have different geometries!')
+                self._update(acc, x)
+
+            invalid = acc['count'] == 0
+            res = {'mean': acc['mean'],
+                   'std': np.sqrt(acc['M2'] / np.maximum(acc['count'], 1)),
+                   'min': acc['min'], 'max': acc['max'], 'count': acc['count']}
+            with NETCDF_LOCK:
+                for k in out.keys():
+                    if k == 'count':
+                        out[k].variables[self.variable][t1:t2] = res[k]
+                    else:
+                        out[k].variables[self.variable][t1:t2] = np.ma.array(res[k], mask=invalid)
+
+        for k in out.keys():
+            out[k].close()
 
 
 class EnsemblePreprocessor(object):
@@ -18,7 +260,8 @@ class EnsemblePreprocessor(object):
     ensemble statistic calculations
 
     The processor basically provides a logic. Number crunching is
-    exclusively done using the CDO's
+    done using the CDO's, except for the ensemble statistics which are
+    calculated by EnsembleStatistics
     """
 
     def __init__(self, data_dir, outfile, **kwargs):
@@ -152,25 +395,11 @@ class CMIP5Preprocessor(EnsemblePreprocessor):
             ofile += '_' + str(start_time)[0:10] + '_' + str(stop_time)[0:10]
         ofile += '.nc'
 
-        self.mergetime_files.append(ofile)
-
-        # cdo
+        # cdo; time selection is chained to avoid an intermediate file
         if selstr == '':
             cmd = 'cdo -f nc mergetime ' + fstr + ' ' + ofile
         else:
-            # merge first and the select time (not the most performant way to do it)
-            tmpfile = tempfile.mktemp(suffix='.nc')
-            if os.path.exists(tmpfile):
-                os.remove(tmpfile)
-            cmd1 = 'cdo -f nc mergetime ' + fstr + ' ' + tmpfile
-            os.system(cmd1)
-
-            if not os.path.exists(tmpfile):
-                tmp_s = 'Error in creating temporary file: ABORT! ' + self.model + ' ' + self.experiment + ' ' + tmpfile
-                print tmp_s
-                self._log(tmp_s)
-
-            cmd = 'cdo -f nc ' + selstr + ' ' + tmpfile + ' ' + ofile
+            cmd = 'cdo -f nc ' + selstr + ' -mergetime ' + fstr + ' ' + ofile
 
         # calculate final output file
         if os.path.exists(ofile):
@@ -179,13 +408,18 @@ class CMIP5Preprocessor(EnsemblePreprocessor):
             else:
                 self.mergetime_files.append(ofile)
                 print('File already existing ... no processing is done')
-                return
+                return ofile
 
         print('Doing temporal preprocessing for ensemble member ... %s' % n)
         os.system(cmd)
         if os.path.exists(ofile):  # just ensure that everything wen well
             self.mergetime_files.append(ofile)
-
+            return ofile
+        else:
+            tmp_s = 'Error in creating file: ABORT! ' + self.model + ' ' + self.experiment + ' ' + ofile
+            print tmp_s
+            self._log(tmp_s)
+            return None
 
     def get_ensemble_files(self, maxens=50):
         """
@@ -214,61 +448,96 @@ class CMIP5Preprocessor(EnsemblePreprocessor):
         p = self.data_dir + self.institute + os.sep + self.model + os.sep + self.experiment + os.sep + 'mon' + os.sep + self.realm + os.sep + self.mip + os.sep + 'r' + str(ens) + 'i1p1' + os.sep + self.variable + os.sep + self.variable + '_' + self.mip + '_' + self.model + '_' + self.experiment + '_r' + '*.nc'
         return p
 
-    def mergetime_ensembles(self, delete=False, start_time=None, stop_time=None):
+    def mergetime_ensembles(self, delete=False, start_time=None, stop_time=None, nproc=4):
+        """
+        perform mergetime for all ensemble members
+
+        Parameters
+        ----------
+        nproc : int
+            number of ensemble members processed in parallel
+        """
         self.get_ensemble_files()
-        for i in self.ensemble_files.keys():
-            self.mergetime(i, delete=delete, start_time=start_time, stop_time=stop_time)
+        members = sorted(self.ensemble_files.keys())
 
-    def ensemble_mean(self, delete=False, start_time=None, stop_time=None):
+        def _merge(i):
+            return self.mergetime(i, delete=delete, start_time=start_time, stop_time=stop_time)
+
+        if nproc > 1 and len(members) > 1:
+            # the work is done by CDO processes; threads are thus sufficient
+            pool = ThreadPool(processes=min(nproc, len(members)))
+            res = pool.map(_merge, members)
+            pool.close()
+            pool.join()
+        else:
+            res = map(_merge, members)
+        # keep order of ensemble members
+        self.mergetime_files = [f for f in res if f is not None]
+
+    def ensemble_mean(self, delete=False, start_time=None, stop_time=None, chunksize=120):
         """
+        calculate ensemble mean, standard deviation, minimum, maximum
+        and number of valid members in a single pass over all members
+        (see EnsembleStatistics). The original files of each member are
+        used directly and the time period is selected while reading,
+        thus no temporal merging is needed. If temporally merged files
+        are already available (self.mergetime_files), then these are used.
+
+        The resulting filenames are available by self.outfile_ensmean,
+        self.outfile_ensstd, self.outfile_ensmin, self.outfile_ensmax
+        and self.outfile_enscount
+
         Parameters
         ----------
         start_time : datetime
             start time of period
         stop_time : datetime
             end time of period
+        chunksize : int
+            number of timesteps processed at once
         """
         print('Doing ensemble mean calculation ...')
-        # if temporal merged files are not yet there, do preprocessing
-        if len(self.mergetime_files) < 2:
-            self.mergetime_ensembles(delete=delete, start_time=start_time, stop_time=stop_time)
+        if len(self.mergetime_files) >= 2:
+            members = [[f] for f in self.mergetime_files]
+        else:
+            self.get_ensemble_files()
+            members = [sorted(self.ensemble_files[k]) for k in sorted(self.ensemble_files.keys())]
 
-        if len(self.mergetime_files) < 2:
-            print self.mergetime_files
+        if len(members) < 2:
+            print members
             print 'No ensemble mean calculation possible as not enough files!'
             self._log('No ensemble mean calculation possible as not enough files! ' + self.institute + ' ' + self.model + ' ' + self.experiment)
 
-        fstr = self._filelist(self.mergetime_files)
-
-        # ensemble mean calculation
+        # output files
         ofile = self.output_dir + self.outfile
         ofile = os.path.splitext(ofile)[0]
         if start_time is not None:
             ofile += '_' + str(start_time)[0:10] + '_' + str(stop_time)[0:10]
-        #~ ofile += '.nc'
         self.outfile = ofile
         self.outfile_ensmean = self.outfile + '_ensmean.nc'
-        cmd = 'cdo -f nc ensmean ' + fstr + ' ' + self.outfile_ensmean
-        if os.path.exists(ofile):
-            if delete:
-                os.remove(ofile)
-                os.system(cmd)
-            else:
-                print('File already existing ... no processing is done')
-        else:
-            os.system(cmd)
-
-        # ensemble standard deviation
         self.outfile_ensstd = self.outfile_ensmean.replace('_ensmean', '_ensstd')
-        cmd = 'cdo -f nc ensstd ' + fstr + ' ' + self.outfile_ensstd
-        if os.path.exists(self.outfile_ensstd):
+        self.outfile_ensmin = self.outfile_ensmean.replace('_ensmean', '_ensmin')
+        self.outfile_ensmax = self.outfile_ensmean.replace('_ensmean', '_ensmax')
+        self.outfile_enscount = self.outfile_ensmean.replace('_ensmean', '_enscount')
+        outfiles = {'mean': self.outfile_ensmean, 'std': self.outfile_ensstd,
+                    'min': self.outfile_ensmin, 'max': self.outfile_ensmax,
+                    'count': self.outfile_enscount}
+
+        if os.path.exists(self.outfile_ensmean) and os.path.exists(self.outfile_ensstd):
             if delete:
-                os.remove(self.outfile_ensstd)
-                os.system(cmd)
+                for k in outfiles.keys():
+                    if os.path.exists(outfiles[k]):
+                        os.remove(outfiles[k])
             else:
                 print('File already existing ... no processing is done')
-        else:
-            os.system(cmd)
+                return
+
+        if len(members) == 0:
+            return
+
+        E = EnsembleStatistics(members, self.variable, start_time=start_time,
+                               stop_time=stop_time, chunksize=chunksize)
+        E.calc(outfiles)
 
 
 class CMIP5ModelParser(object):
@@ -7,9 +7,110 @@ COPYRIGHT.md
 
 import os
 import sys
+import time
+import json
+import shutil
+import hashlib
+import multiprocessing
 
+import numpy as np
 from matplotlib import pylab as pl
 
+from pycmbs.data import Data
+
+
+def _copy_file(src, dst):
+    """ copy a file; a hard link is used if possible """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copyfile(src, dst)
+
+
+def _save_figure(f, filename, bbox_inches, dpi, cachefile=None):
+    """ save a figure and store a copy in the figure cache """
+    if os.path.exists(filename):
+        os.remove(filename)  # might be a link to a file in the cache
+    f.savefig(filename, bbox_inches=bbox_inches, dpi=dpi)
+    if cachefile is not None:
+        _copy_file(filename, cachefile)
+
+
+def _update_hash(h, x, depth=0):
+    """ update a hash object with the content of x """
+    if depth > 20:
+        raise ValueError('Nesting too deep for fingerprint')
+    if x is None or isinstance(x, (bool, int, long, float, str, unicode)):
+        h.update(type(x).__name__ + ':' + repr(x) + ';')
+    elif isinstance(x, Data):
+        # identity of the data: values, mask, coordinates, weighting and description
+        h.update('Data;')
+        d = x.data
+        _update_hash(h, np.ma.filled(d, 0.) if isinstance(d, np.ma.MaskedArray) else d, depth + 1)
+        _update_hash(h, np.ma.getmaskarray(d), depth + 1)
+        for k in ['time', 'lat', 'lon', 'cell_area', 'weighting_type', 'label', 'unit']:
+            _update_hash(h, getattr(x, k, None), depth + 1)
+    elif isinstance(x, np.ndarray):
+        x = np.ascontiguousarray(np.ma.filled(x, 0) if isinstance(x, np.ma.MaskedArray) else x)
+        h.update('ndarray:' + str(x.dtype) + str(x.shape) + ';')
+        if x.dtype == object:
+            for v in x.flat:
+                _update_hash(h, v, depth + 1)
+        else:
+            h.update(x.tostring())
+    elif isinstance(x, dict):
+        h.update('dict:%i;' % len(x))
+        for k in sorted(x.keys(), key=repr):
+            _update_hash(h, k, depth + 1)
+            _update_hash(h, x[k], depth + 1)
+    elif isinstance(x, (list, tuple)):
+        h.update(type(x).__name__ + ':%i;' % len(x))
+        for v in x:
+            _update_hash(h, v, depth + 1)
+    elif hasattr(x, 'date') and hasattr(x, 'isoformat'):  # datetime
+        h.update('date:' + x.isoformat() + ';')
+    elif hasattr(x, '__dict__'):
+        # objects like PlotOptions are described by their attributes
+        h.update('object:' + x.__class__.__name__ + ';')
+        _update_hash(h, dict([(k, v) for k, v in x.__dict__.iteritems() if not k.startswith('__')]), depth + 1)
+    else:
+        raise ValueError('Can not calculate fingerprint for type %s' % type(x))
+
+
+def get_fingerprint(*args):
+    """
+    calculate a fingerprint of all inputs which are used to draw a figure
+
+    Data objects are identified by their data, mask, coordinates,
+    time, cell area, weighting type, label and unit. Other objects (like PlotOptions) are
+    identified by their attributes. The version of pyCMBS is included
+    as well, thus figures are redrawn after an update.
+
+    Parameters
+    ----------
+    args : list
+        inputs; Data objects, arrays, dictionaries, lists, scalars,
+        strings or other objects with attributes
+
+    Returns
+    -------
+    fingerprint : str
+
+    Example
+    -------
+    fp = get_fingerprint('map_difference', model_data, obs_data, plot_options.options['sis'])
+    if not report.reuse_figure(fp, caption='...'):
+        f = map_difference(model_data, obs_data)
+        report.figure(f, caption='...', fingerprint=fp)
+    """
+    from pycmbs import __version__
+    h = hashlib.md5()
+    _update_hash(h, ['pycmbs', str(__version__)])
+    _update_hash(h, list(args))
+    return h.hexdigest()
+
 
 class Report(object):
     """
@@ -18,7 +119,8 @@ class Report(object):
 
     def __init__(self, filename, title, author, format='png',
                  outdir='./', dpi=300, logofile='Phytonlogo5.pdf',
-                 usehyperlinks=True, autocompile=True):
+                 usehyperlinks=True, autocompile=True, nproc=1,
+                 figure_cache=True, cache_dir=None):
         """
         constructor for Latex report class
 
@@ -43,6 +145,22 @@ class Report(object):
         autocompile : bool
             ensure automatic PDF creation when
             report is closed
+        nproc : int
+            number of processes used to save figures in the background.
+            If nproc > 1, then each figure is saved by a forked process
+            which works on a snapshot of the figure, thus the figure
+            can be changed or closed immediately after figure() returns.
+            At most nproc figures are saved at the same time, which
+            limits the memory needed. All figures are written when
+            the report is closed (see wait()).
+        figure_cache : bool
+            store figures which were saved with a fingerprint in a
+            cache, which allows to reuse these in later reports instead
+            of drawing them again (see reuse_figure())
+        cache_dir : str
+            directory of the figure cache. The default is the directory
+            'figure_cache' in outdir, thus figures of the previous report
+            in the same output directory are reused
         """
 
         ext = ''
@@ -60,6 +178,20 @@ class Report(object):
         self.figure_counter = 0
         self.dpi = dpi
         self.autocompile = autocompile
+        self.nproc = nproc
+        self._pending = []  # [(process, filename)] of figures being saved
+        self.failed_figures = []
+
+        # figure cache
+        self.figure_cache = figure_cache
+        if cache_dir is None:
+            cache_dir = self.outdir + 'figure_cache' + os.sep
+        if cache_dir[-1] != os.sep:
+            cache_dir += os.sep
+        self.cache_dir = cache_dir
+        self.figures = []  # information on all figures of the report
+        self.reused_figures = []  # names of figures taken from cache
+        self._cache_index = self._read_cache_index()
 
     def open(self, landscape=False):
         """ open report """
@@ -73,8 +205,15 @@ class Report(object):
 
     def close(self):
         """ close report """
-        self._write_footer()
-        self.file.close()
+        try:
+            self.wait()
+        finally:
+            # the report is completed also if figures could not be saved
+            self._write_figure_info()
+            self._write_footer()
+            self.file.close()
+        if len(self.reused_figures) > 0:
+            print('%i of %i figures reused from cache' % (len(self.reused_figures), len(self.figures)))
         if self.autocompile:
             print 'Compiling REPORT ...'
             self.compile()
@@ -149,7 +288,8 @@ class Report(object):
         self.write('%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
         self.write('')
 
-    def figure(self, f, caption='', width='\\textwidth', height='\\textheight,keepaspectratio', bbox_inches='tight'):
+    def figure(self, f, caption='', width='\\textwidth', height='\\textheight,keepaspectratio', bbox_inches='tight',
+               fingerprint=None):
         """
         add a figure string to the report
 
@@ -163,6 +303,9 @@ class Report(object):
             width as string like in latext e.g. width='12cm'
         bbox_inches : str
             option for savefig
+        fingerprint : str
+            fingerprint of the inputs of the figure (see get_fingerprint());
+            if given, the figure is stored in the figure cache
         """
 
         if f is None:
@@ -172,8 +315,161 @@ class Report(object):
         figname = 'fig_' + str(self.figure_counter).zfill(5) + '.' + self.format
         self._include_figure(figname, caption=caption, width=width, height=height)
 
+        cachefile = None
+        if self.figure_cache and (fingerprint is not None):
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            cachefile = self._get_cache_file(fingerprint)
+        self.figures.append({'figure': figname, 'fingerprint': fingerprint, 'reused': False})
+
         print('Saving figure %s' % self.outdir + figname)
-        f.savefig(self.outdir + figname, bbox_inches=bbox_inches, dpi=self.dpi)
+        if (self.nproc > 1) and hasattr(os, 'fork'):
+            self._save_background(f, self.outdir + figname, bbox_inches, cachefile)
+        else:
+            _save_figure(f, self.outdir + figname, bbox_inches, self.dpi, cachefile)
+
+    def _cache_key(self, fingerprint):
+        """ fingerprint including the output options of the report """
+        return hashlib.md5(fingerprint + ';' + self.format + ';' + str(self.dpi)).hexdigest()
+
+    def _get_cache_file(self, fingerprint):
+        return self.cache_dir + self._cache_key(fingerprint) + '.' + self.format
+
+    def _read_cache_index(self):
+        """ read the list of the figures in the cache """
+        fname = self.cache_dir + 'index.json'
+        if (not self.figure_cache) or (not os.path.exists(fname)):
+            return {}
+        try:
+            f = open(fname, 'r')
+            r = json.load(f)
+            f.close()
+        except ValueError:
+            print('WARNING: invalid index of figure cache: %s' % fname)
+            return {}
+        return r
+
+    def _write_figure_info(self):
+        """
+        write information on all figures of the report and which
+        were reused from the cache, and update the cache index
+
+        The cache keeps only the figures of the current report; files
+        of figures which are not part of it any more are removed.
+        """
+        if len(self.figures) == 0:
+            return
+        info = self.filename[:-4] + '_figures.json'
+        f = open(info, 'w')
+        json.dump(self.figures, f, indent=1)
+        f.close()
+
+        if not self.figure_cache:
+            return
+        index = {}
+        for r in self.figures:
+            if r['fingerprint'] is None:
+                continue
+            if self.outdir + r['figure'] in self.failed_figures:
+                continue
+            index.update({self._cache_key(r['fingerprint']): r['figure']})
+        self._cache_index = index
+        if not os.path.exists(self.cache_dir):
+            return
+        f = open(self.cache_dir + 'index.json', 'w')
+        json.dump(self._cache_index, f, indent=1, sort_keys=True)
+        f.close()
+
+        # remove figures of earlier reports
+        keep = [k + '.' + self.format for k in self._cache_index.keys()] + ['index.json']
+        for fname in os.listdir(self.cache_dir):
+            if (fname not in keep) and os.path.isfile(self.cache_dir + fname):
+                os.remove(self.cache_dir + fname)
+
+    def reuse_figure(self, fingerprint, caption='', width='\\textwidth', height='\\textheight,keepaspectratio'):
+        """
+        include a figure from the figure cache if a figure with the same
+        fingerprint was already drawn before. The figure is then not
+        drawn again.
+
+        Parameters
+        ----------
+        fingerprint : str
+            fingerprint of the inputs of the figure (see get_fingerprint())
+        caption : str
+            caption for the figure to be put in the report
+
+        Returns
+        -------
+        True if the figure was reused, False otherwise. In the latter
+        case the figure needs to be drawn and added using figure()
+        """
+        if (not self.figure_cache) or (fingerprint is None):
+            return False
+        key = self._cache_key(fingerprint)
+        cachefile = self._get_cache_file(fingerprint)
+        if (key not in self._cache_index.keys()) or (not os.path.exists(cachefile)):
+            return False
+
+        self.figure_counter += 1
+        figname = 'fig_' + str(self.figure_counter).zfill(5) + '.' + self.format
+        self.write('% figure reused from cache: ' + fingerprint)
+        self._include_figure(figname, caption=caption, width=width, height=height)
+        _copy_file(cachefile, self.outdir + figname)
+        print('Reusing figure %s' % self.outdir + figname)
+        self.figures.append({'figure': figname, 'fingerprint': fingerprint, 'reused': True})
+        self.reused_figures.append(figname)
+        return True
+
+    def _save_background(self, f, filename, bbox_inches, cachefile=None):
+        """
+        save figure in a separate process; waits if already
+        nproc figures are being saved
+        """
+        while len(self._pending) >= self.nproc:
+            self._collect(block=True)
+        p = multiprocessing.Process(target=_save_figure, args=(f, filename, bbox_inches, self.dpi, cachefile))
+        p.start()
+        self._pending.append((p, filename))
+
+    def _collect(self, block=False):
+        """
+        remove processes which have finished from the list of pending
+        figures
+
+        Parameters
+        ----------
+        block : bool
+            wait until at least one process has finished
+        """
+        while True:
+            running = []
+            for p, filename in self._pending:
+                if p.is_alive():
+                    running.append((p, filename))
+                else:
+                    p.join()
+                    if (p.exitcode != 0) or (not os.path.exists(filename)):
+                        print('ERROR: figure could not be saved: %s' % filename)
+                        self.failed_figures.append(filename)
+            n = len(self._pending) - len(running)
+            self._pending = running
+            if (not block) or (n > 0) or (len(self._pending) == 0):
+                return n
+            time.sleep(0.01)
+
+    def wait(self):
+        """
+        wait until all figures have been saved
+
+        Raises
+        ------
+        ValueError if figures could not be saved
+        """
+        while len(self._pending) > 0:
+            self._collect(block=True)
+        if len(self.failed_figures) > 0:
+            raise ValueError('Figures could not be saved: %s' % ', '.join(self.failed_figures))
 
     def _include_figure(self, figname, caption='', width='\\textwidth', height='\\textheight,keepaspectratio'):
         """
@@ -7,6 +7,10 @@ COPYRIGHT.md
 
 import unittest
 import os
+import tempfile
+import datetime
+import numpy as np
+from netCDF4 import Dataset
 from pycmbs.benchmarking import preprocessor
 
 class TestPreprocessor(unittest.TestCase):
@@ -17,6 +21,57 @@ class TestPreprocessor(unittest.TestCase):
     def test_StubTest(self):
         self.assertEqual(1, 1)
 
+    def _write_member_file(self, filename, t0, x):
+        F = Dataset(filename, 'w')
+        F.createDimension('time', None)
+        F.createDimension('lat', x.shape[1])
+        F.createDimension('lon', x.shape[2])
+        t = F.createVariable('time', 'f8', ('time',))
+        t.units = 'days since 2000-01-01'
+        t.calendar = '365_day'
+        t[:] = (np.arange(len(x)) + t0) * 30. + 15.
+        v = F.createVariable('tas', 'f4', ('time', 'lat', 'lon'), fill_value=1.e20)
+        v[:] = x
+        F.close()
+
+    def test_ensemble_statistics(self):
+        d = tempfile.mkdtemp() + os.sep
+        X = np.ma.array(np.random.random((3, 10, 2, 3)))
+        X[1, 2, 0, 0] = np.ma.masked
+        members = []
+        for i in xrange(len(X)):
+            # each member consists of two files; given in reverse order
+            self._write_member_file(d + 'r%i_b.nc' % i, 6, X[i, 6:])
+            self._write_member_file(d + 'r%i_a.nc' % i, 0, X[i, :6])
+            members.append([d + 'r%i_b.nc' % i, d + 'r%i_a.nc' % i])
+
+        E = preprocessor.EnsembleStatistics(members, 'tas', start_time=datetime.datetime(2000, 2, 1),
+                                            stop_time=datetime.datetime(2000, 8, 20), chunksize=3)
+        outfiles = dict([(k, d + 'ens_' + k + '.nc') for k in E.stats])
+        E.calc(outfiles)
+
+        Y = X[:, 1:8]  # timesteps within period
+        ref = {'mean': Y.mean(axis=0), 'std': Y.std(axis=0), 'min': Y.min(axis=0),
+               'max': Y.max(axis=0), 'count': Y.count(axis=0)}
+        for k in E.stats:
+            F = Dataset(outfiles[k], 'r')
+            r = F.variables['tas'][:]
+            t = F.variables['time'][:]
+            F.close()
+            self.assertEqual(r.shape, (7, 2, 3))
+            self.assertTrue(np.all(np.abs(r - ref[k]) < 1.e-6))
+            self.assertEqual(t[0], 45.)
+        self.assertEqual(ref['count'][1, 0, 0], 2)
+
+        # members with different number of timesteps
+        E = preprocessor.EnsembleStatistics([members[0], members[1][0:1]], 'tas')
+        self.assertRaises(ValueError, E.calc, {'mean': d + 'dummy.nc'})
+
+        # members covering different periods of the same length
+        self._write_member_file(d + 'shifted.nc', 2, X[2, :6])
+        E = preprocessor.EnsembleStatistics([[d + 'r0_a.nc'], [d + 'shifted.nc']], 'tas')
+        self.assertRaises(ValueError, E.calc, {'mean': d + 'dummy.nc'})
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -7,7 +7,11 @@ COPYRIGHT.md
 
 import unittest
 import os
+import tempfile
+import shutil
+import numpy as np
 import pycmbs.benchmarking.utils as utils
+from pycmbs.data import Data
 
 
 class TestUtils(unittest.TestCase):
@@ -94,6 +98,55 @@ class TestUtils(unittest.TestCase):
             if os.path.exists(f):
                 os.remove(f)
 
+    def test_landseamask_registry(self):
+        self.nbuild = 0
+
+        def _builder():
+            self.nbuild += 1
+            d = Data(None, None)
+            d._init_sample_object(nt=None, ny=3, nx=4)
+            d._apply_mask(d.data > 0.5)
+            return d
+
+        R = utils.LandSeaMaskRegistry()
+        key = ('t63grid', 'land', True, False)
+        m1 = R.get(key, _builder)
+        m2 = R.get(key, _builder)
+        self.assertEqual(self.nbuild, 1)
+        self.assertTrue(m1 is m2)
+        self.assertEqual(R.hits, 1)
+        self.assertEqual(R.misses, 1)
+
+        # shared arrays are read-only
+        with self.assertRaises(ValueError):
+            m1.data[0, 0] = 5.
+        with self.assertRaises(ValueError):
+            m1.data.mask[0, 0] = True
+        x = m1.copy()
+        x.data[0, 0] = 5.
+
+        m3 = R.get(('t63grid', 'ocean', True, False), _builder)
+        self.assertEqual(self.nbuild, 2)
+        R.get(key, _builder, force=True)
+        self.assertEqual(self.nbuild, 3)
+
+    def test_landseamask_registry_persistence(self):
+        def _builder():
+            d = Data(None, None)
+            d._init_sample_object(nt=None, ny=3, nx=4)
+            return d
+
+        def _fail():
+            raise ValueError('Mask should be read from disk!')
+
+        tdir = tempfile.mkdtemp()
+        key = ('some/grid', 'land', False, True)
+        m1 = utils.LandSeaMaskRegistry(cache_dir=tdir).get(key, _builder)
+        m2 = utils.LandSeaMaskRegistry(cache_dir=tdir).get(key, _fail)
+        self.assertTrue(np.all(m1.data == m2.data))
+        self.assertTrue(np.all(m1.lat == m2.lat))
+        shutil.rmtree(tdir)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -10,6 +10,7 @@ from pycmbs.data import Data
 from cdo import Cdo
 import numpy as np
 import warnings
+import pickle
 
 
 def get_data_pool_directory():
@@ -64,6 +65,125 @@ def get_temporary_directory():
     return tempdir
 
 
+class LandSeaMaskRegistry(object):
+    """
+    process-wide registry of land/sea masks
+
+    Each land/sea mask is generated only once per combination of
+    target grid, area, masking of Antarctica and longitude shift and
+    is then shared between all callers. The data and mask arrays of
+    the handed out Data objects are therefore read-only; use
+    Data.copy() to obtain a modifiable version.
+
+    If a cache directory is given (or the environment variable
+    PYCMBS_LSMASK_DIR is set), then the masks are in addition
+    persisted on disk and reused by subsequent runs.
+
+    Example
+    -------
+    ls_mask = LSM_REGISTRY.get(('t63grid', 'land', True, False), builder)
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            directory to persist masks to. If None, then the environment
+            variable PYCMBS_LSMASK_DIR is used if set, otherwise masks
+            are only kept in memory
+        """
+        self.cache_dir = cache_dir
+        self._masks = {}
+        self.hits = 0  # number of requests served from the registry
+        self.misses = 0  # number of masks generated
+
+    def _get_cache_dir(self):
+        if self.cache_dir is not None:
+            d = self.cache_dir
+        elif 'PYCMBS_LSMASK_DIR' in os.environ.keys():
+            d = os.environ['PYCMBS_LSMASK_DIR']
+        else:
+            return None
+        if d[-1] != os.sep:
+            d += os.sep
+        return d
+
+    def _get_cache_file(self, key):
+        d = self._get_cache_dir()
+        if d is None:
+            return None
+        s = '_'.join([str(k) for k in key]).replace(os.sep, '_')
+        return d + 'lsmask_' + s + '.pkl'
+
+    def _freeze(self, ls_mask):
+        """ make data and mask arrays read-only """
+        if isinstance(ls_mask.data, np.ma.MaskedArray):
+            m = np.ma.getmaskarray(ls_mask.data)
+            ls_mask.data = np.ma.array(ls_mask.data.data, mask=m)
+            ls_mask.data.unshare_mask()
+            ls_mask.data.mask.flags.writeable = False
+        ls_mask.data.flags.writeable = False
+
+    def get(self, key, builder, force=False):
+        """
+        get a land/sea mask from the registry
+
+        Parameters
+        ----------
+        key : tuple
+            unique identifier of the mask, e.g.
+            (target_grid, area, mask_antarctica, shift_lon)
+        builder : callable
+            function without arguments which generates the mask as
+            Data object if it is not available yet
+        force : bool
+            generate mask again, even if it is already registered
+
+        Returns
+        -------
+        returns a Data object with read-only data
+        """
+        if not force:
+            if key in self._masks.keys():
+                self.hits += 1
+                return self._masks[key]
+
+        ls_mask = None
+        cache_file = self._get_cache_file(key)
+        if (cache_file is not None) and (not force) and os.path.exists(cache_file):
+            f = open(cache_file, 'rb')
+            ls_mask = pickle.load(f)
+            f.close()
+            self.hits += 1
+
+        if ls_mask is None:
+            ls_mask = builder()
+            self.misses += 1
+            if cache_file is not None:
+                if not os.path.exists(os.path.dirname(cache_file)):
+                    os.makedirs(os.path.dirname(cache_file))
+                f = open(cache_file, 'wb')
+                pickle.dump(ls_mask, f, protocol=2)
+                f.close()
+
+        self._freeze(ls_mask)
+        self._masks.update({key: ls_mask})
+        return ls_mask
+
+    def clear(self):
+        """
+        remove all masks from the registry (the persisted masks on
+        disk are not removed)
+        """
+        self._masks = {}
+        self.hits = 0
+        self.misses = 0
+
+
+LSM_REGISTRY = LandSeaMaskRegistry()
+
+
 def get_generic_landseamask(shift_lon, mask_antarctica=True,
                             area='land', interpolation_method='remapnn',
                             target_grid='t63grid', force=False):
@@ -108,7 +228,24 @@ def get_generic_landseamask(shift_lon, mask_antarctica=True,
 
     Returns
     -------
-    returns a Data object
+    returns a Data object; the masks are shared via LSM_REGISTRY and
+    are therefore read-only
+    """
+    key = ('generic', target_grid, interpolation_method, area, mask_antarctica, shift_lon)
+
+    def _builder():
+        return _generate_generic_landseamask(shift_lon, mask_antarctica=mask_antarctica,
+                                             area=area, interpolation_method=interpolation_method,
+                                             target_grid=target_grid, force=force)
+    return LSM_REGISTRY.get(key, _builder, force=force)
+
+
+def _generate_generic_landseamask(shift_lon, mask_antarctica=True,
+                                  area='land', interpolation_method='remapnn',
+                                  target_grid='t63grid', force=False):
+    """
+    generate generic land/sea mask using CDO;
+    see get_generic_landseamask() for details
     """
 
     print ('WARNING: Automatic generation of land/sea mask. \
@@ -168,6 +305,20 @@ def get_T63_landseamask(shift_lon, mask_antarctica=True, area='land'):
 
     mask_antarctica : bool
         if True, then the mask is FALSE over Antarctica (<60S)
+
+    The mask is shared via LSM_REGISTRY and is therefore read-only
+    """
+    key = ('jsbach_T63', area, mask_antarctica, shift_lon)
+
+    def _builder():
+        return _read_T63_landseamask(shift_lon, mask_antarctica=mask_antarctica, area=area)
+    return LSM_REGISTRY.get(key, _builder)
+
+
+def _read_T63_landseamask(shift_lon, mask_antarctica=True, area='land'):
+    """
+    read JSBACH T63 land sea mask from file;
+    see get_T63_landseamask() for details
     """
     ls_file = get_data_pool_directory() \
         + 'data_sources/LSMASK/jsbach_T63_GR15_4tiles_1992.nc'
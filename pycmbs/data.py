@@ -10,7 +10,10 @@ import os
 import sys
 
 from pycmbs.statistic import get_significance, ttest_ind
-from pycmbs.netcdf import NetCDFHandler
+from pycmbs.statistic import quantiles, QuantileSketch
+from pycmbs.netcdf import NetCDFHandler, NETCDF_POOL, netcdf_session
+from pycmbs.expression import Expression
+from pycmbs.utils import hashable
 from pycmbs.polygon import Raster
 from pycmbs.polygon import Polygon as pycmbsPolygon
 
@@ -45,7 +48,7 @@ class Data(object):
                  verbose=False, cell_area=None, time_var='time',
                  checklat=True, weighting_type='valid', oldtime=False,
                  warnings=True, calc_cell_area=True,
-                 geometry_file=None):
+                 geometry_file=None, lazy=False):
         """
         Constructor for Data class
 
@@ -165,6 +168,11 @@ class Data(object):
         geometry_file : str
             name of individual file with coordinates. This can be usefull in the case
             that no coordinate information is stored within the actual data files
+        lazy : bool
+            if True, then arithmetic operations (add, sub, mul, div,
+            addc, subc, mulc, divc and the corresponding operators) are
+            deferred. The results are calculated in a single pass when
+            the data is accessed or compute() is called. See compute()
         """
 
         self.weighting_type = weighting_type
@@ -181,6 +189,7 @@ class Data(object):
         # assume that coordinates are always in 0 < lon < 360
         self._lon360 = True
         self._calc_cell_area = calc_cell_area
+        self.lazy = lazy
 
         self.inmask = mask
         self.level = level
@@ -237,7 +246,37 @@ class Data(object):
                 print self.lon.min(), self.lon.max()
                 print 'WARNING: plotting etc not supported for longitudes which are not equal to 0 ... 360'
 
+    def _get_data(self):
+        if self.__dict__.get('_expr') is not None:
+            self.compute()
+        return self._data
+
+    def _set_data(self, x):
+        self.__dict__['_expr'] = None
+        # version of the data for the cache of derived quantities
+        self.__dict__['_data_version'] = self.__dict__.get('_data_version', 0) + 1
+        self._data = x
+
+    def _del_data(self):
+        self.__dict__.pop('_expr', None)
+        del self._data
+    data = property(_get_data, _set_data, _del_data)
+
+    def __getstate__(self):
+        self.compute()
+        state = self.__dict__.copy()
+        state.pop('_derived', None)  # cache of derived quantities
+        return state
+
+    def __setstate__(self, state):
+        # objects pickled with earlier versions store the data directly
+        if 'data' in state.keys():
+            state['_data'] = state.pop('data')
+        self.__dict__.update(state)
+
     def _get_shape(self):
+        if self.__dict__.get('_expr') is not None:
+            return self._expr.shape
         return self.data.shape
     shape = property(_get_shape)
 
@@ -268,7 +307,7 @@ class Data(object):
     date = property(_get_date)
 
     def _get_ndim(self):
-        return self.data.ndim
+        return len(self.shape)
     ndim = property(_get_ndim)
 
     def _get_nt(self):
@@ -488,7 +527,9 @@ class Data(object):
                                        calendar=self.calendar) - offset
 
     def save(self, filename, varname=None, format='nc',
-             delete=False, mean=False, timmean=False, compress=True):
+             delete=False, mean=False, timmean=False, compress=True,
+             dtype='d', chunksizes=None, complevel=6, shuffle=True,
+             append=False, pack_range=None):
         """
         saves the data object to a file
 
@@ -510,6 +551,29 @@ class Data(object):
             save temporal mean field
         compress : bool
             compress resulting file if supported by library
+        dtype : str
+            datatype of the data variable in netCDF files, e.g.
+            'd' (default), 'f4' or 'i2'. For integer types, the data
+            is packed using scale_factor and add_offset
+        chunksizes : tuple
+            chunk shape of the data variable in netCDF4 files
+            (e.g. (1, ny, nx)); if None, the library default is used
+        complevel : int
+            compression level [1...9] for netCDF4 files
+        shuffle : bool
+            apply shuffle filter before compression for netCDF4 files
+        append : bool
+            append the timesteps of the data to an existing netCDF
+            file. If the file is not existing yet, then it is
+            generated with an unlimited time dimension. This allows
+            to write data chunk by chunk.
+        pack_range : tuple
+            (vmin, vmax) range of values used to derive the packing
+            parameters for integer types. By default the range of the
+            data is used. This needs to be given when packed output
+            is generated with append=True, as the data appended later
+            needs to fit into the range of the packing. Values outside
+            of the range can not be packed and raise an error
         """
 
         map_formats = {'nc': 'NETCDF4', 'nc3':
@@ -524,7 +588,7 @@ class Data(object):
             print('Saving MEAN FIELD of object in file %s' % filename)
             tmp = self.fldmean(return_data=True)
         elif timmean:
-            tmp = self.timmean(return_object=True)
+            tmp = self.get_derived('timmean', return_object=True)
         else:
             print('Saving object in file %s' % filename)
             tmp = self
@@ -533,7 +597,9 @@ class Data(object):
         if format in ['nc', 'nc3', 'nc4']:
             tmp._save_netcdf(
                 filename, varname=varname, delete=delete, compress=compress,
-                format=map_formats[format])
+                format=map_formats[format], dtype=dtype, chunksizes=chunksizes,
+                complevel=complevel, shuffle=shuffle, append=append,
+                pack_range=pack_range)
         elif format == 'ascii':
             tmp._save_ascii(filename, varname=varname, delete=delete)
         else:
@@ -637,7 +703,9 @@ class Data(object):
 
         return s
 
-    def _save_netcdf(self, filename, varname=None, delete=False, compress=True, format='NETCDF4'):
+    def _save_netcdf(self, filename, varname=None, delete=False, compress=True, format='NETCDF4',
+                     dtype='d', chunksizes=None, complevel=6, shuffle=True, append=False,
+                     pack_range=None):
         """
         saves the data object to a netCDF file
 
@@ -654,22 +722,47 @@ class Data(object):
             compress resulting file if supported by backend
         format : str
             output file format specifier as used by netCDF4 library
+        dtype : str
+            datatype of data variable; integer types are packed
+        chunksizes : tuple
+            chunk shape of data variable
+        complevel : int
+            compression level
+        shuffle : bool
+            apply shuffle filter before compression
+        append : bool
+            append timesteps to existing file
+        pack_range : tuple
+            (vmin, vmax) range of values for packing of integer types
         """
 
+        # variable name
+        if varname is None:
+            if self.varname is None:
+                varname = 'var1'
+            else:
+                varname = self.varname
+
         # check if output file already there
         if os.path.exists(filename):
+            if append:
+                return self._append_netcdf(filename, varname)
             if delete:
                 os.remove(filename)
             else:
                 raise ValueError('File already existing. Please delete \
                                   manually or use DELETE option: \
                                   %s' % filename)
-        # variable name
-        if varname is None:
-            if self.varname is None:
-                varname = 'var1'
-            else:
-                varname = self.varname
+
+        dtype = np.dtype(dtype)
+        if dtype.kind not in ['f', 'i', 'u']:
+            raise ValueError('Unsupported datatype for netCDF output: %s' % dtype)
+        if append and (dtype.kind != 'f') and (pack_range is None):
+            raise ValueError('Packed output which is appended needs an explicit pack_range!')
+        if not format.startswith('NETCDF4'):
+            # chunking and compression need HDF5 based files
+            compress = False
+            chunksizes = None
 
         # create new file
         File = NetCDFHandler()
@@ -697,16 +790,27 @@ class Data(object):
         # Create variables
         if hasattr(self, 'time'):
             if self.time is not None:
-                File.create_dimension('time', size=len(self.time))
+                if append:  # unlimited, to allow appending of further timesteps
+                    File.create_dimension('time', size=None)
+                else:
+                    File.create_dimension('time', size=len(self.time))
                 File.create_variable('time', 'd', ('time',))
                 File.F.variables['time'].units = self.time_str
 
         if hasattr(self, 'data'):
             if self.data.ndim == 3:
-                File.create_variable(
-                    varname, 'd', ('time', 'ny', 'nx'), zlib=compress)
+                dims = ('time', 'ny', 'nx')
             elif self.data.ndim == 2:
-                File.create_variable(varname, 'd', ('ny', 'nx'), zlib=compress)
+                dims = ('ny', 'nx')
+            if chunksizes is not None:
+                if len(chunksizes) != len(dims):
+                    raise ValueError('Chunksizes need to be given for each dimension %s' % str(dims))
+            if dtype.kind == 'f':
+                fill_value = None
+            else:
+                fill_value = np.iinfo(dtype).min
+            File.create_variable(varname, dtype.str[1:], dims, zlib=compress, complevel=complevel,
+                                 fill_value=fill_value, chunksizes=chunksizes, shuffle=shuffle)
 
         if self.lat is not None:
             File.create_variable('lat', 'd', ('ny', 'nx'))
@@ -724,6 +828,20 @@ class Data(object):
             if hasattr(self, 'cell_area'):
                 File.create_variable('cell_area', 'd', ('ny', 'nx'))
 
+        if hasattr(self, 'data'):
+            if hasattr(self, 'long_name'):
+                if self.long_name is not None:
+                    File.F.variables[varname].long_name = self.long_name
+            if hasattr(self, 'unit'):
+                if self.unit is not None:
+                    File.F.variables[varname].units = self.unit
+
+            # packing parameters need to be set before writing
+            scale_factor, add_offset = self._get_netcdf_packing(dtype, pack_range=pack_range)
+            File.F.variables[varname].scale_factor = scale_factor
+            File.F.variables[varname].add_offset = add_offset
+            File.F.variables[varname].coordinates = "lon lat"
+
         #/// write data
         if hasattr(self, 'time'):
             if self.time is not None:
@@ -731,7 +849,7 @@ class Data(object):
                 File.F.variables['time'].calendar = self.calendar
 
         if hasattr(self, 'data'):
-            File.assign_value(varname, self.data)
+            self._write_netcdf_data(File.F.variables[varname], 0)
 
         if self.lat is not None:
             File.assign_value('lat', self.lat)
@@ -743,20 +861,140 @@ class Data(object):
                 if self.cell_area is not None:
                     File.assign_value('cell_area', self.cell_area)
 
-        if hasattr(self, 'data'):
-            if hasattr(self, 'long_name'):
-                if self.long_name is not None:
-                    File.F.variables[varname].long_name = self.long_name
-            if hasattr(self, 'unit'):
-                if self.unit is not None:
-                    File.F.variables[varname].units = self.unit
+        File.close()
 
-            File.F.variables[varname].scale_factor = 1.
-            File.F.variables[varname].add_offset = 0.
-            File.F.variables[varname].coordinates = "lon lat"
+    def _append_netcdf(self, filename, varname):
+        """
+        append the timesteps of the data object to an existing netCDF
+        file, which was generated by _save_netcdf()
+
+        Parameters
+        ----------
+        filename : str
+            filename of existing file
+        varname : str
+            name of variable in file
+        """
+        if self.data.ndim != 3:
+            raise ValueError('Only 3D data can be appended to a file!')
+        if self.time is None:
+            raise ValueError('No time variable existing! Can not append data!')
+
+        File = NetCDFHandler()
+        File.open_file(filename, 'a')
+        if varname not in File.get_variable_keys():
+            File.close()
+            raise ValueError('Variable %s not existing in file %s' % (varname, filename))
+        V = File.get_variable_handler(varname)
+        shape = V.shape
+        if shape[1:] != self.data.shape[1:]:
+            File.close()
+            raise ValueError('Geometry of data does not match the file %s: %s' % (filename, str(shape)))
+        T = File.get_variable_handler('time')
+        if not File.F.dimensions[T.dimensions[0]].isunlimited():
+            File.close()
+            raise ValueError('File %s was not generated for appending (save with append=True)' % filename)
+        if T.units != self.time_str:
+            File.close()
+            raise ValueError('Time units of data and file are different: %s / %s' % (self.time_str, T.units))
 
+        t0 = len(T)
+        try:
+            self._write_netcdf_data(V, t0)  # checks the data range first
+        except ValueError:
+            File.close()
+            raise
+        T[t0:t0 + len(self.time)] = self.time
         File.close()
 
+    def _get_netcdf_packing(self, dtype, pack_range=None):
+        """
+        get scale_factor and add_offset for packing of data into an
+        integer datatype. The full range of the datatype (except the
+        minimum which is used as fill value) is used.
+
+        Parameters
+        ----------
+        dtype : dtype
+            datatype of output variable
+        pack_range : tuple
+            (vmin, vmax) range of values to be packed. If None, then
+            the range of the data is used
+
+        Returns
+        -------
+        scale_factor, add_offset
+        """
+        if dtype.kind == 'f':
+            return 1., 0.
+        info = np.iinfo(dtype)
+        if pack_range is not None:
+            vmin, vmax = float(pack_range[0]), float(pack_range[1])
+            if not vmax >= vmin:
+                raise ValueError('Invalid range for packing: %s' % str(pack_range))
+        else:
+            x = np.ma.masked_invalid(self.data)
+            vmin = np.ma.min(x)
+            vmax = np.ma.max(x)
+        if (vmin is np.ma.masked) or (vmax == vmin):  # no valid data or constant field
+            return 1., float(vmin) if vmin is not np.ma.masked else 0.
+        add_offset = 0.5 * (float(vmax) + float(vmin))
+        scale_factor = (float(vmax) - float(vmin)) / (float(info.max) - float(info.min) - 1.)
+        return scale_factor, add_offset
+
+    def _write_netcdf_data(self, V, t0, nblock=12):
+        """
+        write data to a netCDF variable; 3D data is written in
+        blocks of timesteps to avoid copies of the full field.
+        For integer variables, the data is packed according to the
+        attributes scale_factor and add_offset of the variable. An
+        error is raised if the data exceeds the range of the packing
+
+        Parameters
+        ----------
+        V : netCDF variable
+            handler to netCDF variable
+        t0 : int
+            index of first timestep to write (3D data only)
+        nblock : int
+            number of timesteps written at once
+        """
+        packed = np.dtype(V.dtype).kind in ['i', 'u']
+        if packed:
+            info = np.iinfo(V.dtype)
+            scale_factor = V.getncattr('scale_factor')
+            add_offset = V.getncattr('add_offset')
+            V.set_auto_maskandscale(False)
+
+            # check range of all data before anything is written
+            lo = (float(info.min) + 0.5) * scale_factor + add_offset
+            hi = (float(info.max) + 0.5) * scale_factor + add_offset
+            for i in xrange(0, len(self.data), nblock):
+                x = np.ma.masked_invalid(self.data[i:i + nblock])
+                if x.count() == 0:
+                    continue
+                if (float(x.min()) < lo) or (float(x.max()) > hi):
+                    raise ValueError('Data range %f ... %f exceeds range of packing %f ... %f; use pack_range!' %
+                                     (float(x.min()), float(x.max()), lo, hi))
+
+        def _pack(x):
+            if not packed:
+                return x
+            msk = np.ma.getmaskarray(x) | ~np.isfinite(np.ma.filled(x, 0.))
+            y = np.round((np.ma.filled(x, add_offset) - add_offset) / scale_factor)
+            y = np.clip(np.nan_to_num(y), info.min + 1, info.max).astype(V.dtype)
+            y[msk] = info.min
+            return y
+
+        if self.data.ndim == 3:
+            for i in xrange(0, len(self.data), nblock):
+                x = self.data[i:i + nblock]
+                V[t0 + i:t0 + i + len(x), :, :] = _pack(x)
+        elif self.data.ndim == 2:
+            V[:, :] = _pack(self.data)
+        else:
+            raise ValueError('Unsupported dimension!')
+
     def _equal_lon(self):
         """
         This routine identifies if all longitudes in the dataset
@@ -981,8 +1219,7 @@ class Data(object):
         # read cell_area file ---
         if os.path.exists(cell_file):
             # read cell area from file
-            File = NetCDFHandler()
-            File.open_file(cell_file, 'r')
+            File = NETCDF_POOL.get(cell_file)
             self.cell_area = File.get_variable('cell_area')
             File.close()
 
@@ -1015,7 +1252,7 @@ class Data(object):
                 print 'actual geometry:  ', self.data.ndim, self.data.shape
                 raise ValueError('Invalid geometry!')
 
-    def get_zonal_mean(self, return_object=False):
+    def get_zonal_mean(self, return_object=False, lat_bands=None):
         """
         calculate zonal mean statistics of the data for each timestep
         returns zonal statistics [time,ny]
@@ -1027,93 +1264,234 @@ class Data(object):
         ----------
         return_object : bool
             if True, then returns a Data object
+        lat_bands : ndarray
+            edges of latitude bands [deg]. If given, the zonal means
+            are calculated for these bands instead of for each row of
+            the data; see get_zonal_statistics()
 
         Returns
         -------
         r : ndarray, Data
             array with zonal statistics
         """
+        sw, swx, swxx, n, sa, m0, zlat = self._get_zonal_sums(lat_bands=lat_bands)
 
-        # TODO implement check if latitudes in y-axis direction are all the
-        # same! Otherwise the routine does not make sense
-
-        if self.cell_area is None:
-            self._log_warning(
-                'WARNING: no cell area given, zonal means are based on equal weighting!')
-            w = np.ones(self.data.shape)
+        # the weights are normalized by the area of all valid cells.
+        # If no cell area is given or the weighting type is 'all', then
+        # the normalization is done by the area of all cells
+        if (self.cell_area is not None) and (self.weighting_type == 'valid'):
+            norm = sw
         else:
-            w = self._get_weighting_matrix()
-
-        #/// weight data
-        dat = self.data * w
-
-        #/// calculate zonal mean
-        if dat.ndim == 2:
-            r = dat.sum(axis=1) / w.sum(axis=1)  # zonal mean
-        elif dat.ndim == 3:
-            nt, ny, nx = dat.shape
-            r = np.ones((nt, ny)) * np.nan
-            W = np.ones((nt, ny)) * np.nan
-
-            for i in xrange(nt):
-                # weighted sum, normalized by valid data why ???
-                r[i] = dat[i, :, :].sum(axis=1) / w[i, :, :].sum(axis=1)
-                W[i] = w[i, :, :].sum(axis=1)
-            r = np.ma.array(r, mask=W == 0.)
-
-        else:
-            print dat.shape
-            raise ValueError('Unsupported geometry')
+            norm = sa[np.newaxis, :] * np.ones_like(sw)
+        r = np.ma.array((swx + m0 * sw) / np.where(norm > 0., norm, 1.), mask=(sw == 0.) | (norm == 0.))
+        if self.data.ndim == 2:
+            r = r[0]
 
         if return_object:
             res = self.copy()
             res.label = self.label + ' zonal mean'
             res.data = r.T  # [lat,time]
-            res.lat = self.lat[:, 0]  # latitudes as a vector
+            res.lat = zlat  # latitudes as a vector
         else:
             res = r
         return res
 
-    def get_percentile(self, p, return_object=True):
+    def get_zonal_statistics(self, lat_bands=None, return_object=False):
+        """
+        calculate area weighted zonal mean, standard deviation and
+        number of valid grid cells for all timesteps at once
+
+        By default, the statistics are calculated for each row of the
+        data, which requires that each row has a constant latitude.
+        For curvilinear or unstructured grids, latitude bands can be
+        specified instead. The assignment of grid cells to bands is
+        cached and reused (see pycmbs.grid.get_latitude_bands).
+
+        Parameters
+        ----------
+        lat_bands : ndarray
+            edges of latitude bands [deg], e.g. np.arange(-90., 91., 5.)
+        return_object : bool
+            return Data objects [lat,time] instead of arrays
+
+        Returns
+        -------
+        mean, std, count : ndarray, Data
+            zonal mean, weighted standard deviation and number of valid
+            cells [time,nzones]; [nzones] for 2D data
+        """
+        sw, swx, swxx, n, sa, m0, zlat = self._get_zonal_sums(lat_bands=lat_bands)
+
+        msk = sw == 0.
+        sw1 = np.where(msk, 1., sw)
+        mean = swx / sw1
+        std = np.sqrt(np.maximum(swxx / sw1 - mean ** 2., 0.))
+        mean = np.ma.array(mean + m0, mask=msk)
+        std = np.ma.array(std, mask=msk)
+        if self.data.ndim == 2:
+            mean = mean[0]
+            std = std[0]
+            n = n[0]
+
+        if return_object:
+            res = []
+            for r, lab in [(mean, 'zonal mean'), (std, 'zonal std'), (n, 'zonal count')]:
+                x = self.copy()
+                x.label = self.label + ' ' + lab
+                x.data = np.ma.array(r).T  # [lat,time]
+                x.lat = zlat
+                res.append(x)
+            return tuple(res)
+        else:
+            return mean, std, n
+
+    def _get_zonal_sums(self, lat_bands=None):
+        """
+        calculate weighted sums required for zonal statistics in a
+        single reduction for all timesteps
+
+        Returns
+        -------
+        sw : ndarray
+            sum of weights of valid cells [time,nzones]
+        swx : ndarray
+            weighted sum of data (centered by m0) [time,nzones]
+        swxx : ndarray
+            weighted sum of squared data (centered by m0) [time,nzones]
+        n : ndarray
+            number of valid cells [time,nzones]
+        sa : ndarray
+            sum of weights of all cells [nzones]
+        m0 : float
+            mean value used for centering of the data
+        zlat : ndarray
+            latitudes of zones
+        """
+        if self.data.ndim == 2:
+            x = self.data[np.newaxis, :, :]
+        elif self.data.ndim == 3:
+            x = self.data
+        else:
+            print self.data.shape
+            raise ValueError('Unsupported geometry')
+        nt = len(x)
+
+        if self.cell_area is None:
+            self._log_warning(
+                'WARNING: no cell area given, zonal means are based on equal weighting!')
+            a = np.ones(x.shape[1:])
+        else:
+            a = np.asarray(self.cell_area, dtype='float').reshape(x.shape[1:])
+        a = np.where(np.isfinite(a), a, 0.)
+
+        x = np.ma.masked_invalid(x)
+        valid = ~np.ma.getmaskarray(x)
+        m0 = np.ma.mean(x)  # centering to avoid numerical cancellation
+        m0 = 0. if m0 is np.ma.masked else float(m0)
+        d = np.ma.filled(x, m0) - m0
+        w = valid * a[np.newaxis, :, :]
+        wd = w * d
+
+        if lat_bands is None:
+            sw = w.sum(axis=2)
+            swx = wd.sum(axis=2)
+            swxx = (wd * d).sum(axis=2)
+            n = valid.sum(axis=2)
+            sa = a.sum(axis=1)
+            zlat = self.lat[:, 0]
+        else:
+            from pycmbs.grid import get_latitude_bands
+            edges = np.asarray(lat_bands, dtype='float')
+            idx = get_latitude_bands(self.lat, edges)
+            if len(idx) != a.size:
+                raise ValueError('Geometry of latitudes and data are inconsistent!')
+            nb = len(edges) - 1
+            sel = idx >= 0
+            ids = (np.arange(nt)[:, np.newaxis] * nb + idx[np.newaxis, sel]).flatten()
+
+            def _bandsum(v):
+                v = v.reshape((nt, -1))[:, sel].flatten()
+                return np.bincount(ids, weights=v, minlength=nt * nb).reshape((nt, nb))
+
+            sw = _bandsum(w)
+            swx = _bandsum(wd)
+            swxx = _bandsum(wd * d)
+            n = _bandsum(valid.astype('float')).astype('int')
+            sa = np.bincount(idx[sel], weights=a.flatten()[sel], minlength=nb)
+            zlat = 0.5 * (edges[1:] + edges[:-1])
+
+        return sw, swx, swxx, n, sa, m0, zlat
+
+    def get_percentile(self, p, return_object=True, method='exact', chunksize=100, sketch_size=200):
         """
         calculate percentile
 
+        Multiple percentiles are calculated at once from a single sort
+        of the data of each grid cell. The percentiles are defined
+        like in scipy.stats.mstats.scoreatpercentile(); masked values
+        are ignored.
+
         Parameters
         ----------
-        p : float
+        p : float, list
             percentile value to obtain, e.g. 0.05 corresponds to 5% percentil
+            A list of values can be given as well.
         return_object : bool
             specifies of a C{Data} object shall be returned [True] or a numpy array [False]
+        method : str
+            ['exact','sketch']
+            exact: exact percentiles from the full data
+            sketch: approximate percentiles which are estimated by
+            processing the data in chunks of timesteps
+            (see pycmbs.statistic.QuantileSketch)
+        chunksize : int
+            number of timesteps processed at once for method 'sketch'
+        sketch_size : int
+            size of the summary per grid cell for method 'sketch'
 
         Returns
         -------
         r : ndarray, Data
-            returns the percentiles as either C{Data} object or as numpy array
+            returns the percentiles as either C{Data} object or as numpy array.
+            If a list of percentiles was given, then a list of C{Data}
+            objects or an array [percentile,ny,nx] is returned
         """
 
         if self.data.ndim != 3:
             raise ValueError(
                 'Percentile calculation only supported for 3D data!')
 
-        nt = len(self.data)
-        x = self.data.copy()
-        x.shape = (nt, -1)
-
-        # calculate percentile
-        res = stats.mstats.scoreatpercentile(x, p * 100.)
+        single = np.isscalar(p)
+        P = np.atleast_1d(np.asarray(p, dtype='float'))
 
-        # reshape data array
-        res.shape = np.shape(self.data[0, :, :])
-        res = np.ma.array(res, mask=np.isnan(res))
+        if method == 'exact':
+            res = quantiles(self.data, P)
+        elif method == 'sketch':
+            S = QuantileSketch(self.data.shape[1:], size=sketch_size)
+            for i in xrange(0, len(self.data), chunksize):
+                S.update(self.data[i:i + chunksize])
+            res = S.quantiles(P)
+        else:
+            raise ValueError('Invalid method for percentile calculation: %s' % method)
+        res = np.ma.array(res, mask=np.ma.getmaskarray(res) | np.isnan(res.data))
 
         # return
         if return_object:
-            r = self.copy()
-            r.label = self.label + '\n percentile: ' + str(round(p, 2))
-            r.data = res
-            return r
+            R = []
+            for i in xrange(len(P)):
+                r = self.copy()
+                r.label = self.label + '\n percentile: ' + str(round(P[i], 2))
+                r.data = res[i]
+                R.append(r)
+            if single:
+                return R[0]
+            else:
+                return R
         else:
-            return res
+            if single:
+                return res[0]
+            else:
+                return res
 
     def _get_unit(self):
         """
@@ -1174,7 +1552,9 @@ class Data(object):
         for i in xrange(len(mask)):
             if mask[i]:
                 self.data.mask[i, :, :] = True
+        self.clear_derived()
 
+    @netcdf_session
     def read(self, shift_lon, start_time=None, stop_time=None,
              time_var='time', checklat=True, fmt='nc'):
         """
@@ -1343,8 +1723,7 @@ class Data(object):
             return res
 
 
-        F = NetCDFHandler(netcdf_backend=netcdf_backend)
-        F.open_file(filename, 'r')
+        F = NETCDF_POOL.get(filename, netcdf_backend=netcdf_backend)
 
         # read lat field
         if self.lat_name is None:
@@ -1592,6 +1971,221 @@ class Data(object):
             file_content += r
         return file_content
 
+    def _get_time_components(self):
+        """
+        get year, month, day and day of year for each timestep
+
+        The conversion of the time axis into dates is rather expensive.
+        The results are therefore cached and only calculated again if
+        the time axis or its definition changes.
+
+        Returns
+        -------
+        res : dict
+            dictionary with integer arrays [time] for the keys
+            'year', 'month', 'day', 'doy'
+        """
+        key = (self.time_str, getattr(self, 'calendar', None), getattr(self, '_oldtime', None))
+        if hasattr(self, '_time_components'):
+            t, k, res = self._time_components
+            if (k == key) and (len(t) == len(self.time)) and np.all(t == self.time):
+                return res
+
+        dates = self.date
+        res = {'year': np.asarray([x.year for x in dates], dtype='int'),
+               'month': np.asarray([x.month for x in dates], dtype='int'),
+               'day': np.asarray([x.day for x in dates], dtype='int'),
+               'doy': np.asarray([x.timetuple().tm_yday for x in dates], dtype='int')}
+        self._time_components = (np.asarray(self.time).copy(), key, res)
+        return res
+
+    def _get_time_groups(self, freq):
+        """
+        assign an integer group code to each timestep
+
+        Parameters
+        ----------
+        freq : str
+            ['year','season','month','pentad']
+            season: DJF, MAM, JJA, SON; DECEMBER is assigned to the
+            DJF season of the following year (season year)
+
+        Returns
+        -------
+        codes : ndarray
+            group index for each timestep [time]
+        keys : ndarray
+            unique group keys [ngroups,2]; (year,0) for years,
+            (year,month), (seasonyear,season[0..3]) or (year,pentad[0..72])
+        dates : list
+            representative date for each group; first day of the year,
+            month or pentad and the 15th of the central month of a season
+        """
+        c = self._get_time_components()
+        if freq == 'year':
+            k1 = c['year']
+            k2 = np.zeros_like(k1)
+        elif freq == 'month':
+            k1 = c['year']
+            k2 = c['month']
+        elif freq == 'season':
+            k1 = c['year'] + (c['month'] == 12)  # DJF belongs to the year of January
+            k2 = (c['month'] % 12) // 3  # 0:DJF, 1:MAM, 2:JJA, 3:SON
+        elif freq == 'pentad':
+            k1 = c['year']
+            k2 = np.minimum((c['doy'] - 1) // 5, 72)  # 31.12 in leap years to last pentad
+        else:
+            raise ValueError('Invalid frequency for time resampling: %s' % freq)
+
+        key = k1.astype('int64') * 1000 + k2
+        ukeys, codes = np.unique(key, return_inverse=True)
+        keys = np.vstack([ukeys // 1000, ukeys % 1000]).T
+
+        dates = []
+        for y, m in keys:
+            if freq == 'year':
+                dates.append(datetime.datetime(y, 1, 1))
+            elif freq == 'month':
+                dates.append(datetime.datetime(y, m, 1))
+            elif freq == 'season':
+                dates.append(datetime.datetime(y, [1, 4, 7, 10][m], 15))
+            else:
+                dates.append(datetime.datetime(y, 1, 1) + datetime.timedelta(days=5 * int(m)))
+        return codes, keys, dates
+
+    def _group_reduce(self, codes, ngroups, stats=['mean'], mask=None):
+        """
+        calculate statistics over groups of timesteps for all groups
+        at once. Masked values are not taken into account.
+
+        Parameters
+        ----------
+        codes : ndarray
+            group index [0...ngroups-1] for each timestep [time];
+            timesteps with negative codes are not used
+        ngroups : int
+            number of groups
+        stats : list
+            statistics to calculate
+            ['mean','sum','std','min','max','count']
+            std is the population standard deviation
+        mask : ndarray
+            temporal mask [time]; only timesteps with True are used
+
+        Returns
+        -------
+        res : dict
+            masked arrays [ngroups,...] for each statistic; groups
+            without any valid data are masked
+        """
+        for k in stats:
+            if k not in ['mean', 'sum', 'std', 'min', 'max', 'count']:
+                raise ValueError('Invalid statistic: %s' % k)
+        if self.data.ndim not in [1, 2, 3]:
+            raise ValueError('Unsupported dimension!')
+
+        codes = np.asarray(codes, dtype='int')
+        if len(codes) != len(self.data):
+            raise ValueError('Group codes need to be given for each timestep!')
+        use = codes >= 0
+        if mask is not None:
+            mask = np.asarray(mask)
+            if (mask.ndim != 1) or (len(mask) != len(self.data)):
+                raise ValueError('Mask needs to be 1-D of length of time!')
+            use &= mask.astype('bool')
+
+        shape = self.data.shape[1:]
+        x = np.ma.asarray(self.data).reshape((len(self.data), -1))
+
+        # sort timesteps by group; then each group is a contiguous block
+        idx = np.where(use)[0]
+        o = np.argsort(codes[idx], kind='mergesort')
+        idx = idx[o]
+        g = codes[idx]
+        groups, start = np.unique(g, return_index=True)
+
+        v = x[idx]
+        valid = ~np.ma.getmaskarray(v)
+        d = np.ma.filled(v, 0.).astype('float')
+
+        def _reduce(func, y):
+            # reduction of the contiguous blocks of all groups at once
+            r = np.zeros((ngroups, y.shape[1]), dtype=y.dtype)
+            if len(groups) == 0:
+                return r
+            r[groups] = func.reduceat(y, start, axis=0)
+            return r
+
+        n = _reduce(np.add, valid.astype('int'))
+        msk = n == 0
+        res = {}
+        if ('sum' in stats) or ('mean' in stats):
+            su = _reduce(np.add, d)
+            if 'sum' in stats:
+                res.update({'sum': su})
+            if 'mean' in stats:
+                res.update({'mean': su / np.where(msk, 1, n)})
+        if 'std' in stats:
+            # centering by overall mean to avoid numerical cancellation
+            m0 = np.ma.filled(np.ma.mean(v, axis=0), 0.)
+            dc = np.where(valid, d - m0[np.newaxis, :], 0.)
+            s1 = _reduce(np.add, dc) / np.where(msk, 1, n)
+            s2 = _reduce(np.add, dc * dc) / np.where(msk, 1, n)
+            res.update({'std': np.sqrt(np.maximum(s2 - s1 * s1, 0.))})
+        if 'min' in stats:
+            res.update({'min': _reduce(np.minimum, np.where(valid, d, np.inf))})
+        if 'max' in stats:
+            res.update({'max': _reduce(np.maximum, np.where(valid, d, -np.inf))})
+        if 'count' in stats:
+            res.update({'count': n})
+
+        for k in res.keys():
+            if k == 'count':
+                r = np.ma.array(res[k])
+            else:
+                r = np.ma.array(res[k], mask=msk)
+            res[k] = r.reshape((ngroups,) + shape)
+        return res
+
+    def resample_time(self, freq, stats=['mean'], mask=None, return_data=False):
+        """
+        calculate temporal statistics for groups of timesteps
+        (years, seasons, months or pentads) in a single pass
+
+        Parameters
+        ----------
+        freq : str
+            ['year','season','month','pentad']; the seasons are
+            DJF, MAM, JJA and SON, whereas DJF is assigned to the year
+            of its January and February
+        stats : list
+            statistics to calculate
+            ['mean','sum','std','min','max','count']
+        mask : ndarray (bool)
+            temporal mask [time]; only timesteps with True are used
+        return_data : bool
+            return Data objects instead of arrays
+
+        Returns
+        -------
+        keys : ndarray
+            group keys [ngroups,2]; see _get_time_groups()
+        res : dict
+            dictionary with results for each statistic [ngroups,...];
+            either as array or Data objects (if return_data=True)
+        """
+        codes, keys, dates = self._get_time_groups(freq)
+        res = self._group_reduce(codes, len(keys), stats=stats, mask=mask)
+        if return_data:
+            t = self.date2num(np.asarray(dates))
+            for k in res.keys():
+                r = self.copy()
+                r.data = res[k]
+                r.time = t
+                r.time_cycle = {'year': 1, 'season': 4, 'month': 12, 'pentad': 73}[freq]
+                res[k] = r
+        return keys, res
+
     def get_yearmean(self, mask=None, return_data=False):
         """
         This routine calculate the yearly mean of the data field
@@ -1609,56 +2203,17 @@ class Data(object):
             specifies if results should be returned as C{Data} object
         """
 
-        if mask is None:
-            # if no mask is provided, take everything
-            mask = np.ones(len(self.time)).astype('bool')
-        else:
+        if mask is not None:
             if mask.ndim != 1:
                 raise ValueError('Mask needs to be 1-D of length of time!')
             if len(mask) != len(self.time):
                 raise ValueError('Mask needs to be 1-D of length of time!')
 
-        #/// get data
-        ye = np.asarray(self._get_years())
-        years = np.unique(ye)
-        dat = self.data
-
-        # calculate mean
-        if self.data.ndim == 1:
-            res = np.zeros(len(years)) * np.nan
-            su = np.zeros(len(years)) * np.nan
-        elif self.data.ndim == 3:
-            nt, ny, nx = self.data.shape
-            res = np.zeros((len(years), ny, nx))
-            su = np.zeros((len(years), ny, nx))
-        else:
-            raise ValueError('Unsupported dimension!')
-
-        for i in xrange(len(years)):
-            y = years[i]
-            hlp = (ye == y) & mask
-            if self.data.ndim == 1:
-                res[i] = dat[hlp].mean()
-                # calculate sum also (needed for masking in the end)
-                su[i] = dat[hlp].sum()
-            else:
-                res[i, :, :] = dat[hlp, :].mean(axis=0)
-                # calculate sum also (needed for masking in the end)
-                su[i, :, :] = dat[hlp].sum(axis=0)
-
-        # this is still not the best solution, but works
-        res = np.ma.array(res, mask=(su == 0.))
-
+        keys, res = self.resample_time('year', stats=['mean'], mask=mask, return_data=return_data)
         if return_data:
-            # generate data object
-            r = self.copy()
-            r.data = res
-            r.time = self.date2num(
-                np.asarray([datetime.datetime(year, 1, 1) for year in years]))
-            r.time_cycle = 1
-            return r
+            return res['mean']
         else:
-            return years, res
+            return keys[:, 0], res['mean']
 
     def get_yearsum(self, mask=None, return_data=False):
         """
@@ -1676,46 +2231,64 @@ class Data(object):
             specifies if a Data object shall be returned
         """
 
-        if mask is None:
-            # if no mask is provided, take everything
-            mask = np.ones(len(self.time)).astype('bool')
-        else:
+        if mask is not None:
             if mask.ndim != 1:
                 raise ValueError('Mask needs to be 1-D of length of time!')
             if len(mask) != len(self.time):
                 raise ValueError('Mask needs to be 1-D of length of time!')
 
-        #/// get data
-        ye = pl.asarray(self._get_years())
-        years = pl.unique(ye)
-        dat = self.data
-
-        #/// calculate mean
-        res = []
-        for y in years:
-            hlp = (ye == y) & mask
-            if self.data.ndim == 1:
-                res.append(dat[hlp].sum())
-            else:
-                res.append(dat[hlp, :].sum(axis=0))
+        keys, res = self.resample_time('year', stats=['sum'], mask=mask, return_data=return_data)
+        if return_data:
+            return res['sum']
+        else:
+            return keys[:, 0], res['sum']
+
+    def get_seasonmean(self, mask=None, return_data=False):
+        """
+        This routine calculates the seasonal (DJF, MAM, JJA, SON) mean
+        of the data field for each year. DECEMBER is assigned to the
+        DJF season of the following year.
+
+        Parameters
+        ----------
+        mask : ndarray (bool)
+            temporal mask [time]
+        return_data : bool
+            specifies if results should be returned as C{Data} object
 
-        res = pl.asarray(res)
-        msk = dat.count(0) == 0
+        Returns
+        -------
+        years, seasons, res or Data object
+            seasons are given as strings ['DJF','MAM','JJA','SON']
+        """
+        keys, res = self.resample_time('season', stats=['mean'], mask=mask, return_data=return_data)
+        if return_data:
+            return res['mean']
+        else:
+            seasons = np.asarray(['DJF', 'MAM', 'JJA', 'SON'])[keys[:, 1]]
+            return keys[:, 0], seasons, res['mean']
+
+    def get_monthmean(self, mask=None, return_data=False):
+        """
+        This routine calculates the monthly mean of the data field,
+        e.g. from daily data
 
-        for i in xrange(len(res)):
-            res[i, msk] = np.nan
-        # mask all data that contained no single valid value!
-        res = np.ma.array(res, mask=np.isnan(res))
+        Parameters
+        ----------
+        mask : ndarray (bool)
+            temporal mask [time]
+        return_data : bool
+            specifies if results should be returned as C{Data} object
 
+        Returns
+        -------
+        years, months, res or Data object
+        """
+        keys, res = self.resample_time('month', stats=['mean'], mask=mask, return_data=return_data)
         if return_data:
-            r = self.copy()
-            r.data = res
-            r.time = self.date2num(
-                np.asarray([datetime.datetime(year, 1, 1) for year in years]))
-            r.time_cycle = 1
-            return r
+            return res['mean']
         else:
-            return years, res
+            return keys[:, 0], keys[:, 1], res['mean']
 
     def partial_correlation(self, Y, Z, ZY=None, pthres=1.01, return_object=True):
         """
@@ -1989,40 +2562,13 @@ class Data(object):
             raise ValueError(
                 'Climatology can not be calculated without a valid time_cycle')
 
-        # generate output fields
-        if self.data.ndim > 1:
-            clim = np.ones(np.shape(self.data[0:self.time_cycle, :])) * np.nan
-            slim = np.ones(np.shape(self.data[0:self.time_cycle, :])) * np.nan
-        else:
-            clim = np.ones(np.shape(self.data[0:self.time_cycle])) * np.nan
-            slim = np.ones(np.shape(self.data[0:self.time_cycle])) * np.nan
-
-        if clim.ndim == 1:
-            for i in xrange(self.time_cycle):
-                clim[i::self.time_cycle] = self.data[
-                    i::self.time_cycle].mean(axis=0)
-                slim[i::self.time_cycle] = self.data[
-                    i::self.time_cycle].sum(axis=0)
-        elif clim.ndim == 2:
-            for i in xrange(self.time_cycle):
-                clim[i::self.time_cycle, :] = self.data[
-                    i::self.time_cycle, :].mean(axis=0)
-                slim[i::self.time_cycle, :] = self.data[
-                    i::self.time_cycle, :].sum(axis=0)
-        elif clim.ndim == 3:
-            for i in xrange(self.time_cycle):
-                clim[i::self.time_cycle, :, :] = self.data[
-                    i::self.time_cycle, :, :].mean(axis=0)
-                slim[i::self.time_cycle, :, :] = self.data[
-                    i::self.time_cycle, :, :].sum(axis=0)
-        else:
+        if self.data.ndim not in [1, 2, 3]:
             raise ValueError('Invalid dimension when calculating climatology')
 
-        n = slim / clim
-        del slim  # number of data taken into account for climatology
-        clim = np.ma.array(
-            clim, mask=(np.isnan(clim) | (n < nmin) | np.isnan(n)))
-        del n
+        # position within the cycle as group code
+        codes = np.arange(len(self.data)) % self.time_cycle
+        res = self._group_reduce(codes, self.time_cycle, stats=['mean', 'count'])
+        clim = np.ma.array(res['mean'], mask=np.ma.getmaskarray(res['mean']) | (res['count'] < nmin))
 
         # create a data object
         r = self.copy()
@@ -2111,22 +2657,13 @@ class Data(object):
         else:
             raise ValueError(
                 'Anomalies can not be calculated without a valid time_cycle')
-        ret = np.ones_like(self.data) * np.nan
-
-        if ret.ndim == 1:
-            for i in xrange(self.time_cycle):
-                ret[i::self.time_cycle] = self.data[i::self.time_cycle] - \
-                    clim[i]
-        elif ret.ndim == 2:
-            for i in xrange(self.time_cycle):
-                ret[i::self.time_cycle, :] = self.data[
-                    i::self.time_cycle, :] - clim[i, :]
-        elif ret.ndim == 3:
-            for i in xrange(self.time_cycle):
-                ret[i::self.time_cycle, :, :] = self.data[i::self.time_cycle, :, :] - clim[i, :, :]
-        else:
+        if self.data.ndim not in [1, 2, 3]:
             raise ValueError('Invalid dimension when calculating anomalies')
-        ret = np.ma.array(ret, mask=(np.isnan(ret) | self.data.mask))
+
+        # subtract climatology for all timesteps at once
+        codes = np.arange(len(self.data)) % self.time_cycle
+        ret = np.ma.filled(self.data - np.ma.asarray(clim)[codes], np.nan)
+        ret = np.ma.array(ret, mask=(np.isnan(ret) | np.ma.getmaskarray(self.data)))
 
         # return a data object
         res = self.copy()
@@ -2713,13 +3250,13 @@ class Data(object):
         """
         get years from timestamp
         """
-        return [x.year for x in self.date]
+        return list(self._get_time_components()['year'])
 
     def _get_months(self):
         """
         get months from timestamp
         """
-        return [x.month for x in self.date]
+        return list(self._get_time_components()['month'])
 
     def _get_days_per_month(self):
         """ get number of days for each month """
@@ -2752,8 +3289,8 @@ class Data(object):
         if filename is None:
             filename = self.filename
 
-        File = NetCDFHandler(netcdf_backend=netcdf_backend)
-        File.open_file(filename, 'r')
+        # files are kept open and their metadata is cached by the pool
+        File = NETCDF_POOL.get(filename, netcdf_backend=netcdf_backend)
 
         if self.verbose:
             print 'Reading file ', filename
@@ -2769,7 +3306,7 @@ class Data(object):
         except:
             print('ERROR when reading variable %s' % varname)
             return None
-        var = File.get_variable_handler(varname)
+        info = File.get_variable_info(varname)
 
         if data.ndim > 3:
             if self.level is None:
@@ -2788,7 +3325,7 @@ class Data(object):
             del tmp
 
         self.fill_value = None
-        self.fill_value = File._get_fill_value(varname)
+        self.fill_value = info['fill_value']
         if self.fill_value is not None:
             msk = data == self.fill_value
             # set to nan, as otherwise problems with masked and scaled data
@@ -2801,10 +3338,10 @@ class Data(object):
             self.fill_value = -99999.
 
         #--- scale factor
-        scal = File._get_scale_factor(varname)
+        scal = info['scale_factor']
         self._scale_factor_netcdf = scal * 1.
 
-        offset = File._get_add_offset(varname)
+        offset = info['add_offset']
         self._add_offset_netcdf = offset * 1.
 
         #data = data * scal + offset
@@ -2816,23 +3353,21 @@ class Data(object):
 
         # check if file has cell_area attribute and only use it if it has not
         # been set by the user
-        if 'cell_area' in File.get_variable_keys() and self.cell_area is None:
+        variables = File.get_variable_keys()
+        if 'cell_area' in variables and self.cell_area is None:
             self.cell_area = File.get_variable('cell_area')
 
         # set units if possible; if given by user, this is taken
         # otherwise unit information from file is used if available
         if self.unit is None:
-            self.unit = File._get_unit(varname)
+            self.unit = info['units']
 
-        if self.time_var in File.get_variable_keys():
-            tvar = File.get_variable_handler(self.time_var)
-            if hasattr(tvar, 'units'):
-                self.time_str = tvar.units
-            else:
-                self.time_str = None
+        if self.time_var in variables:
+            tinfo = File.get_variable_info(self.time_var)
+            self.time_str = tinfo['units']
 
-            if hasattr(tvar, 'calendar'):
-                self.calendar = tvar.calendar
+            if tinfo['calendar'] is not None:
+                self.calendar = tinfo['calendar']
                 # when climatology means, reset calendar to standard
                 if self.calendar == 'climatology_bounds':
                     self.calendar = 'standard'
@@ -3146,87 +3681,119 @@ class Data(object):
         """
         implements the Hodrick-Prescott filter
 
-        Todo
-        ----
-        - use more efficient implementation from statsmodels
-        - support HP filter for multidimensional data
-        - implement unittests
-        - how to handle gaps ???
+        The filter is applied to the timeseries of each grid cell.
+        The banded linear system of the filter is solved using a
+        Cholesky decomposition which is calculated only once for all
+        timeseries without gaps. Timeseries with gaps are filtered
+        using zero weights for the missing values, thus the trend
+        is interpolated across the gaps. The result is masked where
+        the original data is masked.
 
         Parameters
         ----------
         lam : float
             lambda parameter of HP filter. The larger it is, the smoother
-            the resulting trend timeseries will be
+            the resulting trend timeseries will be. For lam=0 the data
+            is returned unchanged
         return_object : bool
-            return a Data object if True
+            return a Data object if True. Otherwise an array with the
+            same geometry as the data is returned; for a single
+            timeseries this is a 1D array
 
         References
         ----------
         http://python4econ.blogspot.de/2012/05/hodrick-prescott-filter.html
         """
-        from scipy import linalg as la
-        from scipy import sparse
-        import scipy as sp
-
-        def _hp_filter(y, w):
-            # make sure the inputs are the right shape
-            m, n = y.shape
-            if m < n:
-                y = y.T
-                m = n
-            a = sp.array([w, -4 * w, ((6 * w + 1) / 2.)])
-            d = sp.tile(a, (m, 1))
-
-            d[0, 1] = -2. * w
-            d[m - 2, 1] = -2. * w
-            d[0, 2] = (1 + w) / 2.
-            d[m - 1, 2] = (1 + w) / 2.
-            d[1, 2] = (5 * w + 1) / 2.
-            d[m - 2, 2] = (5 * w + 1) / 2.
-
-            B = sparse.spdiags(d.T, [-2, -1, 0], m, m)
-            B = B + B.T
-            # report the filtered series, s
-            return sp.dot(la.inv(B.todense()), y)
-
-        if self.ndim != 1:
-            if self.ndim == 3:
-                if (self.shape[1] == 1) and (self.shape[2] == 1):
-                    pass
-                else:
-                    print self.shape
-                    raise ValueError(
-                        'HP filter currently only implemented for 1D data! (A)')
-            else:
-                print self.shape
-                raise ValueError(
-                    'HP filter currently only implemented for 1D data! (B)')
+        if self.ndim not in [1, 3]:
+            print self.shape
+            raise ValueError(
+                'HP filter only implemented for timeseries or 3D data!')
 
         if lam < 0.:
-            raise ValueError('HP filter needs lambda>0. as input!')
+            raise ValueError('HP filter needs lambda>=0. as input!')
+
+        nt = len(self.data)
+        x = self.data.reshape((nt, -1))  # [time,ngridcells]
+        msk = np.ma.getmaskarray(x)
 
         # the HP filter is based on the log() of the data
         # avoid therefore negative numbers
-        dmin = self.data.min()
-        x = self.data.flatten() - dmin + 1.
-        # work only on valid data; note that this approech is probably not the
-        # best one!
-        msk = x.mask
-        hp = _hp_filter(np.log(np.asarray([x[~msk]])), lam)  # 2D input needed
-        y = np.ones_like(x) * np.nan
-        y[~msk] = np.exp(hp)
-        y += dmin - 1.
+        dmin = x.min(axis=0)
+        z = np.ma.filled(np.log(x - dmin + 1.), 0.)
+        dmin = np.ma.filled(dmin, np.nan)
+
+        if lam == 0.:
+            # no smoothing; the trend is the data itself
+            trend = z
+        else:
+            trend = np.ones(x.shape) * np.nan
+            nvalid = (~msk).sum(axis=0)
+
+            # timeseries without gaps; one factorization for all
+            full = np.where(nvalid == nt)[0]
+            if len(full) > 0:
+                trend[:, full] = self._hp_solve(z[:, full], lam, np.ones(nt))
+
+            # timeseries with gaps; one factorization per gap pattern
+            gaps = np.where((nvalid < nt) & (nvalid > 1))[0]
+            if len(gaps) > 0:
+                patterns = np.ascontiguousarray(msk[:, gaps].T)
+                patterns = patterns.view(np.dtype((np.void, patterns.dtype.itemsize * nt))).ravel()
+                u, inv = np.unique(patterns, return_inverse=True)
+                for i in xrange(len(u)):
+                    idx = gaps[inv == i]
+                    w = (~msk[:, idx[0]]).astype('float')
+                    trend[:, idx] = self._hp_solve(z[:, idx], lam, w)
+
+        y = np.exp(trend) + dmin - 1.
         y[msk] = np.nan
 
         if return_object:
             r = self.copy()
-            tmp = np.ones((self.nt, 1, 1)) * np.nan
-            tmp[:, 0, 0] = y[:]
+            if self.ndim == 1:
+                tmp = np.ones((self.nt, 1, 1)) * np.nan
+                tmp[:, 0, 0] = y[:, 0]
+            else:
+                tmp = y.reshape(self.data.shape)
             r.data = np.ma.array(tmp, mask=np.isnan(tmp))
             return r
         else:
-            return y
+            if x.shape[1] == 1:
+                return y[:, 0]
+            else:
+                return y.reshape(self.data.shape)
+
+    def _hp_solve(self, y, lam, w):
+        """
+        solve the banded linear system (W + lam*K'K) t = W y of the
+        Hodrick-Prescott filter for multiple timeseries at once,
+        where K is the second difference operator
+
+        Parameters
+        ----------
+        y : ndarray
+            timeseries [time,nseries]
+        lam : float
+            lambda parameter of HP filter
+        w : ndarray
+            weights of each timestep [time]; zero for missing values
+        """
+        from scipy import linalg as la
+
+        n = len(w)
+        # diagonals of K'K in upper banded storage
+        ab = np.zeros((3, n))
+        ab[2, 0:n - 2] += 1.
+        ab[2, 1:n - 1] += 4.
+        ab[2, 2:n] += 1.
+        ab[1, 1:n - 1] -= 2.
+        ab[1, 2:n] -= 2.
+        ab[0, 2:n] = 1.
+        ab *= lam
+        ab[2, :] += w
+
+        c = la.cholesky_banded(ab, lower=False)
+        return la.cho_solve_banded((c, False), y * w[:, np.newaxis])
 
     def _get_weighting_matrix(self):
         """
@@ -4086,17 +4653,13 @@ class Data(object):
             del tmp1
 
         elif self.data.ndim == 3:
-            for i in xrange(self.nt):
-                tmp = self.data[i, :, :].copy()
-                tmp[~msk] = np.nan
-                self.data[i, :, :] = tmp[:, :] * 1.
-                del tmp
-
-                if hasattr(self, 'std'):
-                    tmps = self.std[i, :, :].copy()
-                    tmps[~msk] = np.nan
-                    self.std[i, :, :] = tmps
-                    del tmps
+            # set all invalid cells to NaN for all timesteps at once
+            invalid = ~np.asarray(msk, dtype='bool')
+            if invalid.ndim == 0:
+                invalid = np.ones(self.data.shape[1:], dtype='bool') * invalid
+            self.data.data[:, invalid] = np.nan
+            if hasattr(self, 'std'):
+                self.std.data[:, invalid] = np.nan
 
             if keep_mask:
                 if self.__oldmask.ndim > 0:
@@ -4254,9 +4817,22 @@ class Data(object):
         """
         copy complete C{Data} object including all attributes
         """
+        self.compute()
+        return self._copy_attributes()
+
+    def _copy_attributes(self, skip=None):
+        """
+        copy C{Data} object including all attributes except the ones
+        given in skip
+        """
+        if skip is None:
+            skip = []
+        skip = skip + ['_derived']  # cache belongs to the original object
         d = Data(None, None)
 
         for attr, value in self.__dict__.iteritems():
+            if attr in skip:
+                continue
             try:
                 # copy (needed for arrays)
                 cmd = "d." + attr + " = self." + attr + '.copy()'
@@ -4269,6 +4845,212 @@ class Data(object):
 
 #-----------------------------------------------------------------------
 
+    def get_derived(self, name, *args, **kwargs):
+        """
+        get a quantity derived from the data, like the temporal mean,
+        from a cache
+
+        The quantity is calculated by calling the method 'name' with
+        the given arguments. The result is stored and returned again
+        for subsequent calls with the same arguments, as long as the
+        data, the mask and the coordinates are not replaced. Changes
+        of the arrays in place are not detected; call clear_derived()
+        after these.
+
+        Results which are Data objects are copies of the cached
+        object, thus these can be modified. Arrays of the results
+        are read-only, as they are shared between all callers. Use
+        copy() to obtain modifiable versions.
+
+        Parameters
+        ----------
+        name : str
+            name of the method to calculate the quantity, e.g.
+            'timmean', 'fldmean', 'fldstd', 'get_zonal_mean' or
+            '_get_histogram'
+        args, kwargs :
+            arguments for the method
+
+        Example
+        -------
+        xm = x.get_derived('timmean', return_object=True)
+        me = xm.get_derived('fldmean')
+        """
+        if name == 'timmean' and (not kwargs.get('return_object', args[0] if len(args) > 0 else False)):
+            # array of the temporal mean is the data of the object
+            return self._get_derived('timmean', (), {'return_object': True}).data
+
+        res = self._get_derived(name, args, kwargs)
+        if isinstance(res, Data):
+            return res.copy()  # modifications must not change the cache
+        return res
+
+    def _get_derived(self, name, args, kwargs):
+        """ cached result of get_derived() """
+        token = self._get_derived_token()
+        cache = self.__dict__.get('_derived')
+        if (cache is None) or (cache['token'][0] != token[0]) or \
+                (not all([a is b for a, b in zip(cache['token'][1:], token[1:])])):
+            cache = {'token': token, 'values': {}}
+            self.__dict__['_derived'] = cache
+
+        key = (name, self._derived_key(args), self._derived_key(kwargs))
+        if key not in cache['values'].keys():
+            res = getattr(self, name)(*args, **kwargs)
+            self._freeze_derived(res)
+            cache['values'].update({key: res})
+        return cache['values'][key]
+
+    def _get_derived_token(self):
+        """
+        state of the object for the cache of derived quantities: the
+        version of the data and the objects of data, mask and
+        coordinates, which are compared by identity
+        """
+        d = self.data
+        return [self.__dict__.get('_data_version', 0), d, np.ma.getmask(d),
+                self.__dict__.get('lat'), self.__dict__.get('lon'),
+                self.__dict__.get('time'), self.__dict__.get('cell_area')]
+
+    def clear_derived(self):
+        """
+        remove all cached derived quantities (see get_derived()). This
+        is needed after modifying the data or coordinates in place
+        """
+        self.__dict__.pop('_derived', None)
+
+    def _derived_key(self, x):
+        """ hashable representation of the arguments of a derived quantity """
+        return hashable(x)
+
+    def _freeze_derived(self, x):
+        """ make the arrays of a cached result read-only """
+        if isinstance(x, Data):
+            self._freeze_derived(x.data)
+        elif isinstance(x, tuple):
+            for v in x:
+                self._freeze_derived(v)
+        elif isinstance(x, np.ma.MaskedArray):
+            x.flags.writeable = False  # x.data is only a view
+            if x.mask is not np.ma.nomask:
+                x.mask.flags.writeable = False
+        elif isinstance(x, np.ndarray):
+            x.flags.writeable = False
+
+    def _get_histogram(self, bins=10, **kwargs):
+        """
+        frequency distribution of all valid data
+
+        Parameters
+        ----------
+        bins : int or list
+            bins for the histogram
+        kwargs : dict
+            arguments for np.histogram
+
+        Returns
+        -------
+        counts : ndarray
+            number of values in each bin
+        edges : ndarray
+            edges of the bins
+        n : int
+            number of valid data
+        """
+        x = self.data
+        if isinstance(x, np.ma.MaskedArray):
+            x = x.data[~np.ma.getmaskarray(x)]
+        x = np.asarray(x).ravel()
+        x = x[~np.isnan(x)]
+        counts, edges = np.histogram(x, bins=bins, **kwargs)
+        return counts, edges, len(x)
+
+    def compute(self, chunksize=None):
+        """
+        calculate the results of pending (lazy) arithmetic operations
+
+        If the object was created with lazy=True, then arithmetic
+        operations only build an expression. All operations are then
+        calculated in a single pass over chunks of timesteps when
+        the data is accessed or this routine is called. Only temporary
+        arrays of the size of a chunk are needed and the masks are
+        combined only once.
+
+        Note that the data of the operands is referenced, not copied.
+        It must therefore not be modified in place before the result
+        has been calculated.
+
+        Parameters
+        ----------
+        chunksize : int
+            number of timesteps calculated at once; chosen
+            automatically if None
+
+        Returns
+        -------
+        returns the object itself
+        """
+        e = self.__dict__.get('_expr')
+        if e is not None:
+            self._data = e.evaluate(chunksize=chunksize)
+            self.__dict__['_expr'] = None
+        return self
+
+    def _get_operand(self):
+        """ data of the object or its pending expression """
+        e = self.__dict__.get('_expr')
+        if e is not None:
+            return e
+        return self._data
+
+    def _arithmetic(self, op, x, copy=True, label=None, reverse=False):
+        """
+        perform an elementwise arithmetic operation with another
+        C{Data} object, an array or a constant
+
+        The operation is either evaluated immediately in a single pass
+        or deferred if the object is lazy (see compute()).
+        Fields without time dimension are applied to each timestep.
+
+        Parameters
+        ----------
+        op : str
+            operation ['add','sub','mul','div','truediv']
+        x : Data, ndarray or float
+            second operand
+        copy : bool
+            if True, then a new data object is returned
+            else, the data of the present object is changed
+        label : str
+            label of the result; unchanged if None
+        reverse : bool
+            swap operands, thus calculate x op self
+        """
+        a = self._get_operand()
+        if isinstance(x, Data):
+            b = x._get_operand()
+        else:
+            b = x
+        args = [b, a] if reverse else [a, b]
+        e = Expression(op, args)
+        if e.shape != self.shape:  # result needs the geometry of self
+            raise ValueError('Inconsistent geometry (%s): can not calculate! %s != %s' % (op, str(self.shape), str(e.shape)))
+
+        if copy:
+            d = self._copy_attributes(skip=['_data', '_expr'])
+        else:
+            d = self
+        if getattr(self, 'lazy', False):
+            d.__dict__['_expr'] = e
+        elif copy:
+            d.data = e.evaluate()
+        else:
+            # reuse the memory of the current data if possible
+            d.data = e.evaluate(out=a if isinstance(a, np.ma.MaskedArray) else None)
+        if label is not None:
+            d.label = label
+        return d
+
     def add(self, x, copy=True):
         """
         Add a Data object to the current object field
@@ -4276,7 +5058,9 @@ class Data(object):
         Parameters
         ----------
         x : Data
-            object to be added to the current object
+            object to be added to the current object. The data needs
+            to have either the same geometry as self.data or second
+            and third dimension need to match
         copy : bool
             if True, then a copy is returned. Otherwise the actual data
             is modified
@@ -4285,17 +5069,7 @@ class Data(object):
         ----
         unittest implemented
         """
-
-        if np.shape(self.data) != np.shape(x.data):
-            raise ValueError('Inconsistent geometry (add): can not calculate!')
-
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        d.data = d.data + x.data
-        d.label = self.label + ' + ' + x.label
-        return d
+        return self._arithmetic('add', x, copy=copy, label=self.label + ' + ' + x.label)
 
     def sub(self, x, copy=True):
         """
@@ -4304,7 +5078,9 @@ class Data(object):
         Parameters
         ----------
         x : Data
-            object to be substracted from the current object
+            object to be substracted from the current object. The data
+            needs to have either the same geometry as self.data or
+            second and third dimension need to match
         copy : bool
             if True, then a copy is returned. Otherwise the actual data
             is modified
@@ -4313,29 +5089,7 @@ class Data(object):
         ----
         unittest implemented
         """
-
-        f_elementwise = False
-        if np.shape(self.data) != np.shape(x.data):
-            s1 = np.shape(self.data)
-            if (s1[1] == x.data.shape[0]) & (s1[2] == x.data.shape[1]):
-                f_elementwise = True
-            else:
-                sys.stdout.write(str(self.shape))
-                sys.stdout.write(str(x.shape))
-                raise ValueError(
-                    'Inconsistent geometry (sub): can not calculate!')
-
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        if f_elementwise:
-            for i in xrange(len(d.data)):
-                d.data[i, :, :] = d.data[i, :, :] - x.data[:, :]
-        else:
-            d.data = d.data - x.data
-        d.label = self.label + ' - ' + x.label
-        return d
+        return self._arithmetic('sub', x, copy=copy, label=self.label + ' - ' + x.label)
 
     def diff(self, x, axis=0, equal_var=True, mask_data=False,
              pthres=0.05):
@@ -4433,18 +5187,10 @@ class Data(object):
             if True, then a new data object is returned
             else, the data of the present object is changed
         """
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        if np.isscalar(x):
-            d.data -= x
-        elif x.ndim == 2:  # x is an array
-            for i in xrange(len(self.time)):
-                d.data[i, :, :] -= x[:, :]
-        else:
-            raise ValueError('Invalid geometry in detrend()')
-        return d
+        if not np.isscalar(x):
+            if np.ndim(x) != 2:
+                raise ValueError('Invalid geometry in subc()')
+        return self._arithmetic('sub', x, copy=copy)
 
     def addc(self, x, copy=True):
         """
@@ -4462,13 +5208,7 @@ class Data(object):
         ----
         unittest implemented
         """
-
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        d.data += x
-        return d
+        return self._arithmetic('add', x, copy=copy)
 
     def mulc(self, x, copy=True):
         """
@@ -4486,13 +5226,7 @@ class Data(object):
         ----
         unittest implemented
         """
-
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        d.data *= x
-        return d
+        return self._arithmetic('mul', x, copy=copy)
 
     def divc(self, x, copy=True):
         """
@@ -4510,13 +5244,7 @@ class Data(object):
         ----
         unittest implemented
         """
-
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        d.data /= x
-        return d
+        return self._arithmetic('div', x, copy=copy)
 
 #-----------------------------------------------------------------------
 
@@ -4537,44 +5265,7 @@ class Data(object):
         ----
         unittest implemented
         """
-
-        if np.shape(self.data) != np.shape(x.data):
-            if self.data.ndim == 3:
-                if x.data.ndim == 2:
-                    if np.shape(self.data[0, :, :]) == np.shape(x.data):
-                        # second and third dimension match
-                        pass
-                    else:
-                        print np.shape(self.data)
-                        print np.shape(x.data)
-                        raise ValueError(
-                            'Inconsistent geometry (div): can not calculate!')
-                else:
-                    print np.shape(self.data)
-                    print np.shape(x.data)
-                    raise ValueError(
-                        'Inconsistent geometry (div): can not calculate!')
-            else:
-                print np.shape(self.data)
-                print np.shape(x.data)
-                raise ValueError(
-                    'Inconsistent geometry (div): can not calculate!')
-
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        if np.shape(d.data) == np.shape(x.data):
-            d.data /= x.data
-        elif np.shape(d.data[0, :, :]) == np.shape(x.data):
-            for i in xrange(len(self.time)):
-                d.data[i, :, :] /= x.data
-        else:
-            raise ValueError('Can not handle this geometry in div()')
-
-        d.label = self.label + ' / ' + x.label
-
-        return d
+        return self._arithmetic('div', x, copy=copy, label=self.label + ' / ' + x.label)
 
     def mul_tvec(self, x, copy=True):
         """
@@ -4636,43 +5327,52 @@ class Data(object):
         ----
         unittest implemented
         """
+        return self._arithmetic('mul', x, copy=copy, label=self.label + ' * ' + x.label)
 
-        if np.shape(self.data) != np.shape(x.data):
-            if self.data.ndim == 3:
-                if x.data.ndim == 2:
-                    if np.shape(self.data[0, :, :]) == np.shape(x.data):
-                        # second and third dimension match
-                        pass
-                    else:
-                        print np.shape(self.data)
-                        print np.shape(x.data)
-                        raise ValueError(
-                            'Inconsistent geometry (div): can not calculate!')
-                else:
-                    print np.shape(self.data)
-                    print np.shape(x.data)
-                    raise ValueError(
-                        'Inconsistent geometry (div): can not calculate!')
-            else:
-                print np.shape(self.data)
-                print np.shape(x.data)
-                raise ValueError(
-                    'Inconsistent geometry (div): can not calculate!')
+    # operators; constants and arrays are handled like in addc() etc.
+    __array_priority__ = 20
 
-        if copy:
-            d = self.copy()
-        else:
-            d = self
-        if np.shape(d.data) == np.shape(x.data):
-            d.data = d.data * x.data
-        elif np.shape(d.data[0, :, :]) == np.shape(x.data):
-            for i in xrange(len(self.time)):
-                d.data[i, :, :] = d.data[i, :, :] * x.data
-        else:
-            raise ValueError('Can not handle this geometry in div()')
+    def __add__(self, x):
+        if isinstance(x, Data):
+            return self.add(x)
+        return self.addc(x)
 
-        d.label = self.label + ' * ' + x.label
-        return d
+    def __radd__(self, x):
+        return self.addc(x)
+
+    def __sub__(self, x):
+        if isinstance(x, Data):
+            return self.sub(x)
+        return self._arithmetic('sub', x)
+
+    def __rsub__(self, x):
+        return self._arithmetic('sub', x, reverse=True)
+
+    def __mul__(self, x):
+        if isinstance(x, Data):
+            return self.mul(x)
+        return self.mulc(x)
+
+    def __rmul__(self, x):
+        return self.mulc(x)
+
+    def __div__(self, x):
+        if isinstance(x, Data):
+            return self.div(x)
+        return self.divc(x)
+
+    def __rdiv__(self, x):
+        return self._arithmetic('div', x, reverse=True)
+
+    def __truediv__(self, x):
+        label = self.label + ' / ' + x.label if isinstance(x, Data) else None
+        return self._arithmetic('truediv', x, label=label)
+
+    def __rtruediv__(self, x):
+        return self._arithmetic('truediv', x, reverse=True)
+
+    def __neg__(self):
+        return self.mulc(-1.)
 
     def _sub_sample(self, step):
         """
@@ -5280,11 +5980,14 @@ class Data(object):
             lon = np.linspace(-180., 180., nx)
             self.lon, self.lat = np.meshgrid(lon, lat)
 
-    def _rasterize(self, lon, lat, radius=None, return_object=True):
+    def _rasterize(self, lon, lat, radius=None, return_object=True, method='nearest', k=4):
         """
         rasterize data to a target grid specified by the input arguments
 
-        CAUTION: this is a rather slow function!s
+        The resampling is based on a KD-tree on unit sphere coordinates
+        (see pycmbs.grid.Resampler). The neighbour tables are cached
+        and are reused for all timesteps and all data objects on the
+        same pair of geometries.
 
         Parameters
         ----------
@@ -5293,43 +5996,36 @@ class Data(object):
         lon : ndarray
             longitude [deg]
         radius : float
-            threshold radius
+            threshold radius (great circle distance) [deg]
         return_object : bool
             return a Data object
+        method : str
+            ['nearest','idw']
+            nearest: each data point is assigned to the closest target cell
+            idw: inverse distance weighting of the k closest data points
+        k : int
+            number of neighbours used for method 'idw'
 
         Returns
         -------
         returns data object with gridded results
         """
+        from pycmbs.grid import get_resampler
 
         if lon.shape != lat.shape:
             raise ValueError('Inconsistent geometry!')
         if radius is None:
             raise ValueError('Search radius obligatory')
-
-        # flatten data
-        dlon = self.lon.flatten()
-        dlat = self.lat.flatten()
-        data = self.data.flatten()
-        res = np.ones_like(lon) * np.nan
-
-        for i in xrange(len(dlon)):
-            # distance
-            d = np.sqrt((lon - dlon[i]) ** 2. + (lat - dlat[i]) ** 2.)
-            #d = np.ma.array(d, mask= d <= radius)
-            dmin = d.min()
-            m = d == dmin
-            if dmin <= radius:  # threshold
-                res[m] = data[i]
-
-        if return_object:
-            x = self.copy()
-            x.lon = lon * 1.
-            x.lat = lat * 1.
-            x.data = np.ma.array(res, mask=np.isnan(res))
-        else:
+        if not return_object:
             raise ValueError('Not implemented yet!')
 
+        R = get_resampler(self.lon, self.lat, lon, lat, radius, method=method, k=k)
+        res = R.resample(self.data)
+
+        x = self.copy()
+        x.lon = lon * 1.
+        x.lat = lat * 1.
+        x.data = res
         return x
 
     def mask_region(self, r, return_object=False, method='full', maskfile=None, force=False):
@@ -29,6 +29,7 @@ becase all data are stored in the data4D array, the normal data attribude is del
 #### from pylab import *
 
 from data import Data
+from pycmbs.netcdf import netcdf_session
 import matplotlib.colors as col
 import matplotlib.cm as cm
 from matplotlib import pyplot as plt
@@ -38,6 +39,7 @@ from cdo import *
 class Data4D(Data):
 
 #-----------------------------------------------------------------------
+    @netcdf_session
     def read(self, shift_lon, start_time=None, stop_time=None, time_var='time', checklat=True):
         cdo = Cdo()
 
@@ -25,6 +25,86 @@ from pycmbs.data import Data
 from pycmbs.anova import *
 from pycmbs.taylor import Taylor
 
+import multiprocessing
+
+# cumulative sums shared with worker processes of Diagnostic.slice_corr()
+THE_SLICE_SUMS = None
+
+
+def _regression_from_sums(n, sx, sy, sxx, syy, sxy):
+    """
+    calculate linear regression statistics from sufficient statistics.
+    The results are the same as from stats.linregress(), but for
+    arbitrary many samples at once.
+
+    Parameters
+    ----------
+    n : ndarray
+        number of samples
+    sx, sy : ndarray
+        sum of x and y
+    sxx, syy, sxy : ndarray
+        sum of x*x, y*y and x*y
+
+    Returns
+    -------
+    r, p, slope : ndarray
+        correlation coefficient, two-sided p-value and slope
+    """
+    TINY = 1.0e-20
+    n = np.asarray(n, dtype='float')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssxm = np.maximum(sxx - sx * sx / n, 0.)
+        ssym = np.maximum(syy - sy * sy / n, 0.)
+        ssxym = sxy - sx * sy / n
+        r_den = np.sqrt(ssxm * ssym)
+        r = np.where(r_den == 0., 0., ssxym / r_den)
+        r = np.where(n > 0, np.clip(r, -1., 1.), np.nan)
+        df = n - 2.
+        t = r * np.sqrt(df / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+        p = 2. * stats.t.sf(np.abs(t), df)
+        slope = ssxym / ssxm
+    return r, p, slope
+
+
+def _slice_corr_timmean_row(i1):
+    """
+    regression statistics of temporal mean fields for all
+    periods starting at index i1; uses the cumulative sums
+    stored in THE_SLICE_SUMS
+
+    as separate function to allow for parallel operations
+
+    Returns
+    -------
+    i1, lengths, r, p, slope
+    """
+    cx, cy, cnx, cny = THE_SLICE_SUMS
+    n = len(cx) - 1
+    i2 = np.arange(i1 + 2, n - 1)
+    if len(i2) == 0:
+        return i1, i2, None, None, None
+
+    # temporal mean fields of all periods [period,ngridcells]
+    nx = cnx[i2] - cnx[i1]
+    ny = cny[i2] - cny[i1]
+    valid = (nx > 0) & (ny > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mx = np.where(valid, (cx[i2] - cx[i1]) / nx, 0.)
+        my = np.where(valid, (cy[i2] - cy[i1]) / ny, 0.)
+
+    # center data of each period to avoid numerical cancellation
+    k = valid.sum(axis=1).astype('float')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mx = np.where(valid, mx - (mx.sum(axis=1) / k)[:, np.newaxis], 0.)
+        my = np.where(valid, my - (my.sum(axis=1) / k)[:, np.newaxis], 0.)
+
+    r, p, slope = _regression_from_sums(k, mx.sum(axis=1), my.sum(axis=1),
+                                        (mx * mx).sum(axis=1), (my * my).sum(axis=1),
+                                        (mx * my).sum(axis=1))
+    return i1, i2 - i1, r, p, slope
+
+
 class DiagnosticMaster(object):
     """
     a master class for diganostics
@@ -940,13 +1020,9 @@ class SVD(object):
         mx = np.sum(~x.mask, axis=0) == nt  # get mask for valid pixels only
         m1 = mx
 
-        r = np.ones((nt, sum(mx))) * np.nan
-        for i in xrange(nt):
-            tmp = x.data[i, :]
-            if np.any(np.isnan(tmp[m1])):
-                raise ValueError('Nans are not allowed here!')
-            r[i, :] = tmp[m1] * 1.
-            del tmp
+        r = x.data[:, m1] * 1.
+        if np.any(np.isnan(r)):
+            raise ValueError('Nans are not allowed here!')
 
         return np.ma.array(r), m1
 
@@ -970,10 +1046,13 @@ class SVD(object):
         if x.ndim != 2:
             raise ValueError('Invalid shape for detrending')
         n, m = x.shape
-        for i in xrange(m):
-            h = x[:, i].copy()
-            h = plt.detrend_linear(h)
-            x[:, i] = h.copy()
+
+        # least squares fit for all positions at once; this gives the
+        # same result as applying plt.detrend_linear() to each column
+        t = np.arange(n) - 0.5 * (n - 1)
+        x -= x.mean(axis=0)
+        b = dot(t, x) / np.sum(t * t)
+        x -= t[:, np.newaxis] * b[np.newaxis, :]
         return x
 
 #-----------------------------------------------------------------------
@@ -1001,7 +1080,7 @@ class SVD(object):
 
 #-----------------------------------------------------------------------
 
-    def svd_analysis(self, detrend=True, varnorm=False):
+    def svd_analysis(self, detrend=True, varnorm=False, nmodes=None):
         """
         perform SVD analysis
 
@@ -1011,6 +1090,13 @@ class SVD(object):
             detrend data
         varnorm : bool
             normalize variance of time series
+        nmodes : int
+            number of leading modes to calculate. If None (default), then
+            the full covariance matrix is constructed and decomposed.
+            Otherwise a truncated decomposition is performed which works
+            on the [time,position] data matrices only and never constructs
+            the covariance matrix. This is the recommended option for
+            large fields.
         """
 
         #/// perform SVN only for data points which are valid throughout entire time series ///
@@ -1031,22 +1117,13 @@ class SVD(object):
             x = self.__time_normalization(x)
             y = self.__time_normalization(y)
 
-        #/// calculate covariance matrix
-        print 'Construct covariance matrix ...'
-        C = dot(x.T, y)  # this covariance matrix does NOT contain the variances of the individual
-        # grid points, but only the covariance terms!
-        print 'Done!'
-        self.C = C
         self.x_used = x.copy()  # store vectors like they are used for SVD calculations
         self.y_used = y.copy()
 
-        #/// singular value decomposition
-        print '   Doing singular value decomposition xxxxxx ...'
-
-        U, s, V = linalg.svd(C)
-        print 'Done!'
-        L = linalg.diagsvd(s, len(C), len(V))  # construct diagonal maxtrix such that U L V.T = C; this is
-        # somewhat python specific
+        if nmodes is None:
+            U, s, V = self._svd_full(x, y)
+        else:
+            U, s, V, s_all = self._svd_truncated(x, y, nmodes)
 
         #/// expansion coefficients (time series)
         A = dot(x, U)
@@ -1055,12 +1132,85 @@ class SVD(object):
         #/// store results
         self.U = U
         self.V = V
-        self.L = L
+        self.s = s
         self.A = A
         self.B = B
-        self.scf = (s * s) / sum(s * s)  # fractions of variance explained CAUTION: not properly described in manual if squared or not!
+        if nmodes is None:
+            self.scf = (s * s) / sum(s * s)  # fractions of variance explained CAUTION: not properly described in manual if squared or not!
+        else:
+            # normalize by the total squared covariance of ALL modes
+            self.scf = (s * s) / sum(s_all * s_all)
         self.__get_mode_correlation()  # calculate correlation between modes
 
+    def _svd_full(self, x, y):
+        """
+        singular value decomposition of the full
+        cross-covariance matrix C = x.T y
+
+        Parameters
+        ----------
+        x : ndarray
+            data array [time,nvalid_x]
+        y : ndarray
+            data array [time,nvalid_y]
+
+        Returns
+        -------
+        U, s, V where V are the right singular vectors as rows
+        """
+        #/// calculate covariance matrix
+        print 'Construct covariance matrix ...'
+        C = dot(x.T, y)  # this covariance matrix does NOT contain the variances of the individual
+        # grid points, but only the covariance terms!
+        print 'Done!'
+        self.C = C
+
+        #/// singular value decomposition
+        print '   Doing singular value decomposition xxxxxx ...'
+        U, s, V = linalg.svd(np.asarray(C))
+        print 'Done!'
+        return U, s, V
+
+    def _svd_truncated(self, x, y, nmodes):
+        """
+        singular value decomposition of the cross-covariance
+        matrix C = x.T y without constructing C
+
+        As C has at most rank nt, it can be written as
+        C = Qx (Rx Ry.T) Qy.T using the economic QR decompositions
+        x.T = Qx Rx and y.T = Qy Ry. Only the small [nt,nt] matrix
+        M = Rx Ry.T needs then to be decomposed. The singular values
+        are the same as for C and the singular vectors are obtained by
+        U = Qx Um and V = Qy Vm.
+
+        Parameters
+        ----------
+        x : ndarray
+            data array [time,nvalid_x]
+        y : ndarray
+            data array [time,nvalid_y]
+        nmodes : int
+            number of leading modes to return
+
+        Returns
+        -------
+        U, s, V, s_all where V are the right singular vectors as rows
+        and s_all are all (also not returned) singular values
+        """
+        if nmodes < 1:
+            raise ValueError('Number of modes needs to be > 0')
+
+        print 'Doing truncated singular value decomposition ...'
+        Qx, Rx = linalg.qr(np.asarray(x).T, mode='economic')
+        Qy, Ry = linalg.qr(np.asarray(y).T, mode='economic')
+        Um, s_all, Vm = linalg.svd(dot(Rx, Ry.T))
+        print 'Done!'
+
+        k = min(nmodes, len(s_all))
+        U = dot(Qx, Um[:, 0:k])
+        V = dot(Vm[0:k, :], Qy.T)
+        return U, s_all[0:k], V, s_all
+
 #-----------------------------------------------------------------------
 
     def __get_mode_correlation(self):
@@ -1095,7 +1245,7 @@ class SVD(object):
         #mskx is the corresponding mask that maps x_used to the original geometry (both are estimated with
         # _get_valid_timeseries()  )
         u = self.U[:, mode]
-        v = self.V[:, mode]  # get singular vectors
+        v = self.V[mode, :]  # get singular vectors; V contains these as rows
 
         #map singular vectors to 2D
         udat = self._map_valid2org(u, self.mskx, self.X.data[0, :, :].shape)
@@ -1675,9 +1825,9 @@ class Diagnostic(object):
         else:
             weights = weights.copy()
 
-        x = self.x.data.copy()
-        y = self.y.data.copy()
-        std_x = self.x.std.copy()
+        x = self.x.data
+        y = self.y.data
+        std_x = self.x.std
 
         if np.shape(x) != np.shape(y):
             print np.shape(x), np.shape(y)
@@ -1687,25 +1837,22 @@ class Diagnostic(object):
             e2 = sum(weights * (x - y) ** 2. / std_x)
         else:
             n = len(x)
-            x.shape = (n, -1)  # [time,index]
-            y.shape = (n, -1)
-            std_x.shape = (n, -1)
-            weights.shape = (n, -1)
+            x = x.reshape((n, -1))  # [time,index]
+            y = y.reshape((n, -1))
+            std_x = std_x.reshape((n, -1))
+            weights = weights.reshape((n, -1))
             if np.shape(x) != np.shape(weights):
                 print x.shape, weights.shape
                 raise ValueError('Invalid shape for weights!')
 
-            # calculate weighted average for all timesteps
-            e2 = np.ones(n) * np.nan
-            for i in xrange(n):
-                d = weights[i, :] * ((x[i, :] - y[i, :]) ** 2.) / std_x[i, :]
-                e2[i] = np.sum(d)  # sum at end to avoid nan's   #it is important to use np.sum() !!
-                # TODO apply proper temporal weighting here as well!
+            # calculate weighted average for all timesteps at once
+            # masked values do not contribute to the sum; timesteps
+            # without any valid data result in NaN
+            d = weights * ((x - y) ** 2.) / std_x
+            e2 = np.asarray(np.ma.filled(np.ma.sum(d, axis=1), np.nan), dtype='float')
+            # TODO apply proper temporal weighting here as well!
 
         if np.any(np.isnan(e2)):
-            print 'd: ', d
-            for i in xrange(n):
-                print 'std_x', i, std_x[i, :]
             print('Reichler: e2 contains NAN, this happens most likely if STDV == 0')
             return None
         else:
@@ -1804,7 +1951,7 @@ class Diagnostic(object):
 
 #-----------------------------------------------------------------------
 
-    def slice_corr(self, timmean=True, spearman=False, partial=False, z=None):
+    def slice_corr(self, timmean=True, spearman=False, partial=False, z=None, nproc=1):
         """
         perform correlation analysis for
         different starting times and length
@@ -1817,6 +1964,8 @@ class Diagnostic(object):
 
         partial: do partial correlation
         z: condition in case of partial correlation
+        nproc: number of processors to be used in parallel for the
+               different starting times (only for timmean=True)
         """
 
         if partial:
@@ -1829,6 +1978,31 @@ class Diagnostic(object):
                 print z.data.shape
                 raise ValueError('Invalid geometries for partial correlation!')
 
+        x, y = self._get_slice_data()
+
+        if partial:
+            z = z.data.copy()
+            z.shape = (len(x), -1)
+
+        # perform correlation analysis
+        print('   Doing slice correlation analysis ...')
+        if spearman or partial:
+            R, P, L, S = self._slice_corr_direct(x, y, timmean=timmean, spearman=spearman, partial=partial, z=z)
+        elif timmean:
+            R, P, L, S = self._slice_corr_timmean(x, y, nproc=nproc)
+        else:
+            R, P, L, S = self._slice_corr_all(x, y)
+
+        self.slice_r = R
+        self.slice_p = P
+        self.slice_length = L
+        self.slice_slope = S
+
+    def _get_slice_data(self):
+        """
+        get x and y data for slice correlation analysis
+        as masked arrays of geometry [time,ngridcells]
+        """
         x = self.x.data.copy()
 
         if not hasattr(self, 'y'):
@@ -1850,17 +2024,117 @@ class Diagnostic(object):
         x.shape = (n, -1)  # size [time,ngridcells]
         y.shape = (n, -1)
 
-        if partial:
-            z = z.data.copy()
-            z.shape = (n, -1)
+        return x, y
+
+    def _get_slice_sums(self, x, y):
+        """
+        calculate sufficient statistics for linear regression for
+        each timestep, using all grid cells where both x and y are
+        valid. Data is centered by its overall mean beforehand to
+        avoid numerical cancellation.
+
+        Returns
+        -------
+        array [6,time] with n, sum(x), sum(y), sum(x*x), sum(y*y), sum(x*y)
+        """
+        msk = np.ma.getmaskarray(x) | np.ma.getmaskarray(y)
+        v = ~msk
+        xd = np.where(v, x.data, 0.)
+        yd = np.where(v, y.data, 0.)
+        nv = v.sum()
+        if nv > 0:
+            xd = np.where(v, xd - xd.sum() / nv, 0.)
+            yd = np.where(v, yd - yd.sum() / nv, 0.)
+        return np.asarray([v.sum(axis=1), xd.sum(axis=1), yd.sum(axis=1),
+                           (xd * xd).sum(axis=1), (yd * yd).sum(axis=1),
+                           (xd * yd).sum(axis=1)], dtype='float')
 
+    def _slice_corr_timmean(self, x, y, nproc=1):
+        """
+        slice correlation of temporal mean fields. The temporal mean
+        of each period is obtained from cumulative sums along time
+        """
+        global THE_SLICE_SUMS
+
+        n = len(x)
+        R = np.ones((n, n)) * np.nan
+        P = np.ones((n, n)) * np.nan
+        L = np.ones((n, n)) * np.nan
+        S = np.ones((n, n)) * np.nan
+
+        def _cumsum(a):
+            r = np.zeros((a.shape[0] + 1, a.shape[1]))
+            r[1:, :] = np.cumsum(a, axis=0)
+            return r
+
+        vx = ~np.ma.getmaskarray(x)
+        vy = ~np.ma.getmaskarray(y)
+        THE_SLICE_SUMS = (_cumsum(np.where(vx, x.data, 0.)), _cumsum(np.where(vy, y.data, 0.)),
+                          _cumsum(vx.astype('float')), _cumsum(vy.astype('float')))
+
+        if nproc > 1:
+            pool = multiprocessing.Pool(processes=nproc)
+            res = pool.map(_slice_corr_timmean_row, xrange(n - 1))
+            pool.close()
+            pool.join()
+        else:
+            res = [_slice_corr_timmean_row(i1) for i1 in xrange(n - 1)]
+        THE_SLICE_SUMS = None
+
+        for i1, length, r, p, slope in res:
+            if len(length) == 0:
+                continue
+            R[length, i1] = r
+            P[length, i1] = p
+            L[length, i1] = length
+            S[length, i1] = slope
+
+        return R, P, L, S
+
+    def _slice_corr_all(self, x, y):
+        """
+        slice correlation using all grid cells at all times of a
+        period. The statistics of each period are obtained from
+        cumulative sums of the statistics of the individual timesteps
+        """
+        n = len(x)
+        R = np.ones((n, n)) * np.nan
+        P = np.ones((n, n)) * np.nan
+        L = np.ones((n, n)) * np.nan
+        S = np.ones((n, n)) * np.nan
+
+        c = np.zeros((6, n + 1))
+        c[:, 1:] = np.cumsum(self._get_slice_sums(x, y), axis=1)
+
+        # all periods [i1,i2) with i1 < n-1 and i1+2 <= i2 < n-1
+        i1, i2 = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+        m = (i2 >= i1 + 2) & (i2 < n - 1)
+        i1 = i1[m]
+        i2 = i2[m]
+        if len(i1) == 0:
+            return R, P, L, S
+
+        w = c[:, i2] - c[:, i1]
+        r, p, slope = _regression_from_sums(w[0], w[1], w[2], w[3], w[4], w[5])
+        length = i2 - i1
+        R[length, i1] = r
+        P[length, i1] = p
+        L[length, i1] = length
+        S[length, i1] = slope
+
+        return R, P, L, S
+
+    def _slice_corr_direct(self, x, y, timmean=True, spearman=False, partial=False, z=None):
+        """
+        slice correlation calculated individually for each period.
+        This is required for spearman and partial correlation
+        """
+        n = len(x)
         R = np.ones((n, n)) * np.nan
         P = np.ones((n, n)) * np.nan
         L = np.ones((n, n)) * np.nan
         S = np.ones((n, n)) * np.nan
 
-        # perform correlation analysis
-        print('   Doing slice correlation analysis ...')
         i1 = 0
         while i1 < n - 1:  # loop over starting year
             i2 = i1 + 2
@@ -1921,10 +2195,7 @@ class Diagnostic(object):
                 i2 += 1
             i1 += 1
 
-        self.slice_r = R
-        self.slice_p = P
-        self.slice_length = L
-        self.slice_slope = S
+        return R, P, L, S
 
 #-----------------------------------------------------------------------
 
@@ -1952,16 +2223,17 @@ class Diagnostic(object):
         if np.shape(x) != np.shape(y):
             raise ValueError('slice_corr: shapes not matching!')
 
+        if timmean:
+            # temporal mean -> all grid cells only (temporal mean)
+            raise ValueError('TIMMEAN not supported yet for gap analysis')
+
         #--- reshape data
         n = len(x)  # timesteps
 
-        gaps = np.arange(n)
-
         x.shape = (n, -1)  # size [time,ngridcells]
         y.shape = (n, -1)
         maxgap = n
 
-        #~ print 'maxgap: ', maxgap
         R = np.ones((maxgap, n)) * np.nan
         P = np.ones((maxgap, n)) * np.nan
         L = np.ones((maxgap, n)) * np.nan
@@ -1969,6 +2241,43 @@ class Diagnostic(object):
 
         #--- perform correlation analysis
         print '   Doing slice correlation analysis ...'
+        if spearman:
+            self._slice_corr_gap_direct(x, y, R, P, L, S)
+        else:
+            # the statistics of the whole period minus those of the gap
+            t = self._get_slice_sums(x, y)
+            c = np.zeros((6, n + 1))
+            c[:, 1:] = np.cumsum(t, axis=1)
+
+            # all gaps [i1,i1+gap) with i1 < n-1 and gap < n-i1
+            i1, gap = np.meshgrid(np.arange(n), np.arange(maxgap), indexing='ij')
+            m = (i1 < n - 1) & (gap < n - i1)
+            i1 = i1[m]
+            gap = gap[m]
+
+            w = c[:, n][:, np.newaxis] - (c[:, i1 + gap] - c[:, i1])
+            r, p, slope = _regression_from_sums(w[0], w[1], w[2], w[3], w[4], w[5])
+            R[gap, i1] = r
+            P[gap, i1] = p
+            L[gap, i1] = gap - 1
+            S[gap, i1] = slope
+
+        if pthres is not None:  # mask all insignificant values
+            R = np.ma.array(R, mask=P > pthres)
+            S = np.ma.array(S, mask=P > pthres)
+
+        self.slice_r_gap = R
+        self.slice_p_gap = P
+        self.slice_length_gap = L
+        self.slice_slope_gap = S
+
+    def _slice_corr_gap_direct(self, x, y, R, P, L, S):
+        """
+        gap correlation calculated individually for each gap.
+        This is required for spearman correlation
+        """
+        n = len(x)
+        gaps = np.arange(n)
         i1 = 0
         while i1 < n - 1:  # loop over starting year
             i2 = n  # always entire time period
@@ -1977,36 +2286,27 @@ class Diagnostic(object):
 
                 if gap >= i2 - i1:
                     continue
-                if timmean:
-                    # temporal mean -> all grid cells only (temporal mean)
-                    raise ValueError('TIMMEAN not supported yet for gap analysis')
-                    xdata = x[i1:i2, :].mean(axis=0)
-                    ydata = y[i1:i2, :].mean(axis=0)
-                    xmsk = xdata.mask
-                    ymsk = ydata.mask
-                    msk = xmsk | ymsk
-                else:
-                    # all grid cells at all times
-                    xdata = x.data.copy()
-                    ydata = y.data.copy()
-                    xmsk = x.mask.copy()  # [i1:i2,:]
-                    ymsk = y.mask.copy()  # [i1:i2,:]
 
-                    # mask data which has gaps and use whole period elsewhere
-                    xmsk[i1:i1 + gap, :] = True
-                    ymsk[i1:i1 + gap, :] = True
+                # all grid cells at all times
+                xdata = x.data.copy()
+                ydata = y.data.copy()
+                xmsk = x.mask.copy()  # [i1:i2,:]
+                ymsk = y.mask.copy()  # [i1:i2,:]
 
-                    msk = xmsk | ymsk
+                # mask data which has gaps and use whole period elsewhere
+                xmsk[i1:i1 + gap, :] = True
+                ymsk[i1:i1 + gap, :] = True
+
+                msk = xmsk | ymsk
 
                 xdata = xdata[~msk].flatten()
                 ydata = ydata[~msk].flatten()
 
                 #use spearman correlation
-                if spearman:
-                    tmpx = xdata.argsort()
-                    tmpy = ydata.argsort()
-                    xdata = tmpx
-                    ydata = tmpy
+                tmpx = xdata.argsort()
+                tmpy = ydata.argsort()
+                xdata = tmpx
+                ydata = tmpy
 
                 slope, intercept, r, p, stderr = stats.linregress(xdata, ydata)
                 R[gap, i1] = r
@@ -2016,15 +2316,6 @@ class Diagnostic(object):
 
             i1 += 1
 
-        if pthres is not None:  # mask all insignificant values
-            R = np.ma.array(R, mask=P > pthres)
-            S = np.ma.array(S, mask=P > pthres)
-
-        self.slice_r_gap = R
-        self.slice_p_gap = P
-        self.slice_length_gap = L
-        self.slice_slope_gap = S
-
 #-----------------------------------------------------------------------
     def _set_year_ticks(self, years, ax, axis='x', size=10, rotation=0.):
         """
@@ -2147,6 +2438,462 @@ class Diagnostic(object):
         ax2.clabel(CP2, inline=1, fontsize=10)
         ax3.clabel(CP3, inline=1, fontsize=10)
         ax4.clabel(CP4, inline=1, fontsize=10)
+
+#-----------------------------------------------------------------------
+#-----------------------------------------------------------------------
+
+
+class ReichlerIndex(object):
+    """
+    calculate the model performance index after Reichler & Kim (2008)
+    for an arbitrary number of models against a single reference dataset
+
+    The reference data, its standard deviation, the spatial weights
+    and the temporal weights are prepared only once. The models are
+    then scored in vectorized steps of a few models at once, thus
+    only the data of these models is kept in memory in addition.
+
+    Example
+    -------
+    R = ReichlerIndex(obs)
+    e2 = R.calc_e2([model1, model2])  # E**2 [model,time]
+    r = R.calc_index([model1, model2])  # sqrt(sum(e2*wt)) [model]
+
+    REFERENCES
+    ==========
+    Reichler, T. & Kim, J., 2008. How Well Do Coupled Models Simulate
+    Today's Climate? Bulletin of the American Meteorological Society,
+    89(3), p.303-311.
+    """
+
+    def __init__(self, x, weights=None, time_weighting=True, chunksize=4):
+        """
+        Parameters
+        ----------
+        x : Data
+            reference dataset (observation). Needs to have an attribute
+            'std' with the standard deviation of the data and monthly
+            timesteps
+        weights : ndarray
+            spatial weights for each timestep [time,ny,nx]. If None, then
+            these are calculated from the cell area of x.
+        time_weighting : bool
+            weight timesteps by the number of days per month. Otherwise
+            all timesteps have the same weight
+        chunksize : int
+            number of models which are processed at once
+        """
+        if chunksize < 1:
+            raise ValueError('Invalid chunksize: %s' % chunksize)
+        if not hasattr(x, 'std'):
+            raise ValueError('Can not calculate Reichler & Kim index without STD information!')
+        if x.data.ndim != 3:
+            raise ValueError('Reference data needs to have geometry [time,ny,nx]')
+        if not x._is_monthly():
+            raise ValueError('Variable X has no monthly stepping!')
+
+        # spatial weights
+        if weights is None:
+            if x.cell_area is not None:
+                weights = x._get_weighting_matrix()
+            else:
+                print('WARNING: no weights when calculating performance index')
+                weights = np.ones(x.data.shape)
+        else:  # weights are given
+            if x.cell_area is not None:
+                print('WARNING: cell weights are given, while cell_area available from data!!')
+
+        if np.shape(weights) != x.data.shape:
+            raise ValueError('Invalid shape for weights!')
+        if np.shape(x.std) != x.data.shape:
+            raise ValueError('Invalid shape for STD!')
+
+        self.x = x
+        self.nt = len(x.data)
+        self.shape = x.data.shape
+        self.chunksize = chunksize
+
+        # reference data and combined weighting factor [time,index]
+        self._ref = x.data.reshape((self.nt, -1))
+        self._fac = weights.reshape((self.nt, -1)) / x.std.reshape((self.nt, -1))
+
+        # temporal weights
+        if time_weighting:
+            days = np.asarray(x._days_per_month())  # number of days for each month
+            self.wt = days / float(days.sum())
+        else:
+            self.wt = np.ones(self.nt) / float(self.nt)
+
+    def _iter_models(self, Y):
+        """
+        generator of stacks of at most self.chunksize model fields
+        [model,time,index]
+
+        Parameters
+        ----------
+        Y : Data, list or ndarray
+            model data. Either a single Data object, a list of Data
+            objects or an array of geometry [model,time,ny,nx]
+        """
+        if isinstance(Y, Data):
+            Y = [Y]
+
+        if isinstance(Y, list):
+            for y in Y:
+                if not y._is_monthly():
+                    raise ValueError('Variable Y has no monthly stepping!')
+                if y.data.shape != self.shape:
+                    print y.data.shape, self.shape
+                    raise ValueError('Invalid shapes of arrays!')
+        else:
+            if np.shape(Y)[1:] != self.shape:
+                print np.shape(Y), self.shape
+                raise ValueError('Invalid shapes of arrays!')
+
+        for i in xrange(0, len(Y), self.chunksize):
+            if isinstance(Y, list):
+                y = np.ma.concatenate([np.ma.array(v.data[np.newaxis, ...]) for v in Y[i:i + self.chunksize]], axis=0)
+            else:
+                y = np.ma.asarray(Y[i:i + self.chunksize])
+            yield y.reshape((len(y), self.nt, -1))
+
+    def calc_e2(self, Y):
+        """
+        calculate E**2 for each model and timestep
+
+        Parameters
+        ----------
+        Y : Data, list or ndarray
+            model data. Either a single Data object, a list of Data
+            objects or an array of geometry [model,time,ny,nx]
+
+        Returns
+        -------
+        e2 : ndarray
+            masked array [model,time]. Timesteps without any valid data
+            or with NaN (most likely if STDV == 0) are masked.
+        """
+        res = []
+        for y in self._iter_models(Y):
+            d = ((y - self._ref[np.newaxis, ...]) ** 2.) * self._fac[np.newaxis, ...]
+            res.append(np.asarray(np.ma.filled(np.ma.sum(d, axis=2), np.nan), dtype='float'))
+            del d
+        if len(res) == 0:
+            e2 = np.zeros((0, self.nt))
+        else:
+            e2 = np.concatenate(res, axis=0)
+        return np.ma.array(e2, mask=np.isnan(e2))
+
+    def calc_index(self, Y):
+        """
+        calculate performance index sqrt(sum(e2*wt)) for each model
+
+        Parameters
+        ----------
+        Y : Data, list or ndarray
+            model data. Either a single Data object, a list of Data
+            objects or an array of geometry [model,time,ny,nx]
+
+        Returns
+        -------
+        r : ndarray
+            masked array [model]. The index of a model is masked,
+            if its E**2 contains invalid timesteps.
+        """
+        e2 = self.calc_e2(Y)
+        invalid = np.any(np.ma.getmaskarray(e2), axis=1)
+        r = np.sqrt(np.sum(e2.filled(0.) * self.wt[np.newaxis, :], axis=1))
+        return np.ma.array(r, mask=invalid)
+
+
+class SkillStatistics(object):
+    """
+    area weighted skill statistics (Taylor et al., 2001) for an
+    arbitrary number of models against a single reference dataset
+
+    The statistics (standard deviation ratio, correlation, bias, RMS
+    and centered RMS difference) are calculated from all valid pairs of
+    grid cells and timesteps, optionally separately for regions and
+    seasons or months. All regions and periods are processed at once;
+    the models are processed one after another in chunks of timesteps,
+    thus only weighted sums are kept in memory.
+
+    Example
+    -------
+    S = SkillStatistics(obs, regions=region_ids, freq='season')
+    res = S.calc([model1, model2])
+    tay = S.plot_taylor(res, period=2, region=0, labels=['m1', 'm2'])  # JJA
+
+    REFERENCES
+    ==========
+    Taylor, K.E., 2001. Summarizing multiple aspects of model performance
+    in a single diagram. Journal of Geophysical Research, 106(D7),
+    p.7183-7192.
+    """
+
+    def __init__(self, x, weights=None, regions=None, freq=None, chunksize=12):
+        """
+        Parameters
+        ----------
+        x : Data
+            reference dataset (observation) [time,ny,nx] or [ny,nx]
+        weights : ndarray
+            spatial weights [ny,nx]. If None, then the cell area of x
+            is used
+        regions : Data or ndarray
+            region ID for each grid cell [ny,nx]. Statistics are
+            calculated for each region; masked cells are not used.
+            If None, then the statistics are calculated for the
+            entire field
+        freq : str
+            calculate statistics separately for each season ('season';
+            DJF, MAM, JJA, SON) or month ('month') of the year. If None,
+            then all timesteps are used together
+        chunksize : int
+            number of timesteps of a model which are processed at once
+        """
+        if chunksize < 1:
+            raise ValueError('Invalid chunksize: %s' % chunksize)
+        self.chunksize = int(chunksize)
+        if x.data.ndim == 2:
+            ref = np.ma.array(x.data)[np.newaxis, ...]
+        elif x.data.ndim == 3:
+            ref = np.ma.array(x.data)
+        else:
+            raise ValueError('Reference data needs to have geometry [time,ny,nx] or [ny,nx]')
+        self.x = x
+        self.shape = x.data.shape
+        self.nt = len(ref)
+        self._ref = ref.reshape((self.nt, -1))
+        ncell = self._ref.shape[1]
+
+        # spatial weights
+        if weights is None:
+            if x.cell_area is not None:
+                weights = x.cell_area
+            else:
+                print('WARNING: no weights when calculating skill statistics')
+                weights = np.ones(ref.shape[1:])
+        if np.shape(weights) != ref.shape[1:]:
+            raise ValueError('Invalid shape for weights!')
+        self._w = np.asarray(weights, dtype='float').reshape(-1)
+
+        # index of region for each cell; -1 if not used
+        if regions is None:
+            self.region_ids = np.asarray(['global'])
+            reg = np.zeros(ncell, dtype='int')
+        else:
+            if isinstance(regions, Data):
+                regions = regions.data
+            if np.shape(regions) != ref.shape[1:]:
+                raise ValueError('Invalid shape for regions!')
+            regions = np.ma.masked_invalid(np.ma.asarray(regions)).reshape(-1)
+            self.region_ids = np.unique(regions.compressed())
+            if len(self.region_ids) == 0:
+                raise ValueError('No valid regions given!')
+            reg = np.searchsorted(self.region_ids, regions.filled(self.region_ids[0]))
+            reg[np.ma.getmaskarray(regions)] = -1
+
+        # index of period for each timestep
+        if freq is None:
+            self.periods = ['all']
+            per = np.zeros(self.nt, dtype='int')
+        elif freq in ['season', 'month']:
+            if x.data.ndim != 3:
+                raise ValueError('Statistics for seasons or months need data with time dimension')
+            month = x._get_time_components()['month']
+            if freq == 'season':
+                self.periods = ['DJF', 'MAM', 'JJA', 'SON']
+                per = (month % 12) // 3
+            else:
+                self.periods = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+                per = month - 1
+        else:
+            raise ValueError('Invalid frequency for skill statistics: %s' % freq)
+
+        # group of each sample [time,ncell]
+        nreg = len(self.region_ids)
+        self._ngroups = len(self.periods) * nreg
+        self._group = per[:, np.newaxis] * nreg + reg[np.newaxis, :]
+        self._group[:, reg < 0] = -1
+
+        # sums are accumulated relative to the mean of the reference
+        # of each group to avoid a loss of precision
+        self._offset = np.zeros(self._ngroups + 1)
+        s = self._accumulate(self._ref)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._offset[:-1] = np.where(s['w'] > 0., s['wx'] / s['w'], 0.)
+
+    def _iter_models(self, Y):
+        """
+        iterate over the model fields; each is returned as [time,index]
+
+        Parameters
+        ----------
+        Y : Data, list or ndarray
+            model data. Either a single Data object, a list of Data
+            objects or an array of geometry [model,...] where the
+            trailing dimensions are the same as for the reference
+        """
+        if isinstance(Y, Data):
+            Y = [Y]
+        if isinstance(Y, list):
+            for y in Y:
+                if y.data.shape != self.shape:
+                    raise ValueError('Invalid shapes of arrays! %s != %s' % (str(y.data.shape), str(self.shape)))
+            for y in Y:
+                yield np.ma.asarray(y.data).reshape((self.nt, -1))
+        else:
+            if np.shape(Y)[1:] != self.shape:
+                raise ValueError('Invalid shapes of arrays! %s != %s' % (str(np.shape(Y)[1:]), str(self.shape)))
+            for i in xrange(len(Y)):
+                yield np.ma.asarray(Y[i]).reshape((self.nt, -1))
+
+    def _accumulate(self, y):
+        """
+        weighted sums of a single model for each group (period and
+        region). The timesteps are processed in chunks.
+
+        Parameters
+        ----------
+        y : ndarray
+            model data [time,index]
+
+        Returns
+        -------
+        res : dict
+            sums [ngroups] of the weights ('w'), of the weighted
+            values relative to self._offset ('wx', 'wy', 'wxx', 'wyy',
+            'wxy', 'wdd' for (y-x)**2) and the number of valid pairs ('n')
+        """
+        K = self._ngroups
+        keys = ['w', 'wx', 'wy', 'wxx', 'wyy', 'wxy', 'wdd', 'n']
+        res = dict([(k, np.zeros(K)) for k in keys])
+        for i1 in xrange(0, self.nt, self.chunksize):
+            i2 = min(i1 + self.chunksize, self.nt)
+            x = self._ref[i1:i2]
+            yc = y[i1:i2]
+            xd = np.ma.getdata(x)
+            yd = np.ma.getdata(yc)
+            valid = ~(np.ma.getmaskarray(yc) | np.ma.getmaskarray(x))
+            valid &= (self._group[i1:i2] >= 0) & (self._w > 0.)[np.newaxis, :]
+            valid &= np.isfinite(yd) & np.isfinite(xd)
+
+            # invalid samples are assigned to an additional group
+            g = np.where(valid, self._group[i1:i2], K).ravel()
+            w = np.where(valid, self._w[np.newaxis, :], 0.).ravel()
+            xv = np.where(valid, xd, 0.).ravel() - self._offset[g]
+            yv = np.where(valid, yd, 0.).ravel() - self._offset[g]
+
+            def _sum(v):
+                return np.bincount(g, weights=v, minlength=K + 1)[:K]
+            res['w'] += _sum(w)
+            res['wx'] += _sum(w * xv)
+            res['wy'] += _sum(w * yv)
+            res['wxx'] += _sum(w * xv * xv)
+            res['wyy'] += _sum(w * yv * yv)
+            res['wxy'] += _sum(w * xv * yv)
+            res['wdd'] += _sum(w * (yv - xv) ** 2)
+            res['n'] += np.bincount(g, minlength=K + 1)[:K]
+        return res
+
+    def calc(self, Y):
+        """
+        calculate skill statistics for each model
+
+        Parameters
+        ----------
+        Y : Data, list or ndarray
+            model data. Either a single Data object, a list of Data
+            objects or an array of geometry [model,...]
+
+        Returns
+        -------
+        res : dict
+            masked arrays [model,period,region] (see self.periods and
+            self.region_ids) with
+            'r' : correlation
+            'std_ratio' : standard deviation of model / reference
+            'bias' : mean of model - mean of reference
+            'rms' : RMS difference
+            'crms' : centered RMS difference
+            'mean_ref', 'mean_model' : weighted means
+            'std_ref', 'std_model' : weighted standard deviations
+            'n' : number of valid pairs
+            Only pairs where both, reference and model, are valid are used.
+        """
+        # sums of each model [model,group]
+        s = [self._accumulate(y) for y in self._iter_models(Y)]
+        if len(s) == 0:
+            raise ValueError('No model data given!')
+        nm = len(s)
+        s = dict([(k, np.concatenate([v[k] for v in s])) for k in s[0].keys()])
+
+        sw = s['w']
+        offset = np.tile(self._offset[:-1], nm)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mx = s['wx'] / sw
+            my = s['wy'] / sw
+            vx = np.maximum(s['wxx'] / sw - mx * mx, 0.)
+            vy = np.maximum(s['wyy'] / sw - my * my, 0.)
+            cxy = s['wxy'] / sw - mx * my
+            d2 = s['wdd'] / sw
+            r = np.clip(cxy / np.sqrt(vx * vy), -1., 1.)
+            ratio = np.sqrt(vy / vx)
+        mx += offset
+        my += offset
+        n = s['n'].astype('int')
+
+        shp = (nm, len(self.periods), len(self.region_ids))
+        msk = (sw <= 0.).reshape(shp)
+
+        def _res(v):
+            v = v.reshape(shp)
+            return np.ma.array(v, mask=msk | ~np.isfinite(v))
+
+        return {'r': _res(r), 'std_ratio': _res(ratio), 'bias': _res(my - mx),
+                'rms': _res(np.sqrt(d2)), 'crms': _res(np.sqrt(np.maximum(vx + vy - 2. * cxy, 0.))),
+                'mean_ref': _res(mx), 'mean_model': _res(my),
+                'std_ref': _res(np.sqrt(vx)), 'std_model': _res(np.sqrt(vy)),
+                'n': n.reshape(shp)}
+
+    def plot_taylor(self, res, period=0, region=0, dia=None, labels=None, color='red', **kwargs):
+        """
+        Taylor diagram of the statistics of all models
+
+        Parameters
+        ----------
+        res : dict
+            results of calc()
+        period : int
+            index of period (see self.periods)
+        region : int
+            index of region (see self.region_ids)
+        dia : Taylor
+            Taylor plot instance; a new one is generated if None
+        labels : list
+            labels for the models
+        color : str
+            color for the current plot
+        kwargs : dict
+            further arguments for Taylor.plot()
+        """
+        r = np.ma.filled(res['r'][:, period, region], np.nan)
+        ratio = np.ma.filled(res['std_ratio'][:, period, region], np.nan)
+        stdmax = max(np.nanmax(ratio) * 1.2, 2.) if np.any(np.isfinite(ratio)) else 2.
+
+        if dia is None:
+            tay = Taylor(stdmax=stdmax)
+        else:
+            if not isinstance(dia, Taylor):
+                print type(dia)
+                raise ValueError('Provided argument is no taylor class! ')
+            tay = dia
+            tay.stdmax = max(stdmax, dia.stdmax)  # preserve stdmax information when possible
+        tay.plot(r, ratio, labels=labels, color=color, **kwargs)
+        return tay
+
+
 #===========================================================================================
 #
 #
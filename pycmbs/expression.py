@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of pyCMBS. (c) 2012-2014
+For COPYING and LICENSE details, please refer to the file
+COPYRIGHT.md
+"""
+
+"""
+MODULE for deferred elementwise arithmetic on (masked) arrays
+"""
+
+import numpy as np
+
+
+class Expression(object):
+    """
+    node of a deferred arithmetic expression
+
+    An expression is a tree of elementwise operations. Its leaves are
+    (masked) arrays or scalars. Nothing is calculated when the
+    expression is built. When it is evaluated, the whole tree is
+    calculated in a single pass over chunks of the first dimension
+    (time), thus only temporary arrays of the size of a chunk are
+    needed, independent of the number of operations.
+
+    Operands are broadcasted like in numpy; e.g. a field [ny,nx] is
+    applied to each timestep of data [nt,ny,nx]. The masks of all
+    operands are combined. For divisions, elements with a zero
+    divisor are masked in addition.
+
+    Note that the leaf arrays are referenced, not copied. They must
+    therefore not be modified in place before the expression has been
+    evaluated.
+
+    Example
+    -------
+    e = Expression('mul', [Expression('sub', [x, 273.15]), 2.])
+    r = e.evaluate()  # (x - 273.15) * 2.
+    """
+
+    _ufuncs = {'add': np.add, 'sub': np.subtract, 'mul': np.multiply,
+               'div': np.divide, 'truediv': np.true_divide,
+               'neg': np.negative}
+
+    def __init__(self, op, args):
+        """
+        Parameters
+        ----------
+        op : str
+            operation ['add','sub','mul','div','truediv','neg']
+        args : list
+            operands; arrays, scalars or Expression objects
+        """
+        if op not in self._ufuncs.keys():
+            raise ValueError('Invalid operation for expression: %s' % op)
+        if op == 'neg':
+            if len(args) != 1:
+                raise ValueError('Operation %s needs a single operand' % op)
+        elif len(args) != 2:
+            raise ValueError('Operation %s needs two operands' % op)
+        self.op = op
+        self.args = list(args)
+        try:
+            # broadcasting of dummy arrays without memory
+            self.shape = np.broadcast(*[np.broadcast_to(0., self._get_shape(a)) for a in self.args]).shape
+        except ValueError:
+            raise ValueError('Operands of expression can not be broadcasted: %s' %
+                             str([self._get_shape(a) for a in self.args]))
+
+    def _get_shape(self, a):
+        if isinstance(a, Expression):
+            return a.shape
+        return np.shape(a)
+
+    def _get_chunk(self, a, i1, i2, nd):
+        """
+        get data and mask of an operand for the timesteps i1...i2;
+        operands with less than nd dimensions or a single timestep are
+        broadcasted and thus used completely
+        """
+        s = self._get_shape(a)
+        sliced = (i1 is not None) and (len(s) == nd) and (nd > 0) and (s[0] > 1)
+        if isinstance(a, Expression):
+            if sliced:
+                return a._evaluate_chunk(i1, i2, nd)
+            else:
+                return a._evaluate_chunk(None, None, nd)
+        if sliced:
+            a = a[i1:i2]
+        return np.ma.getdata(a), np.ma.getmask(a)
+
+    def _evaluate_chunk(self, i1, i2, nd):
+        """
+        evaluate the expression for the timesteps i1...i2 of an
+        expression with nd dimensions (all timesteps if i1 is None)
+
+        Returns
+        -------
+        d : ndarray
+            data
+        m : ndarray or np.ma.nomask
+            mask
+        """
+        f = self._ufuncs[self.op]
+        if self.op == 'neg':
+            d, m = self._get_chunk(self.args[0], i1, i2, nd)
+            return f(d), m
+
+        da, ma = self._get_chunk(self.args[0], i1, i2, nd)
+        db, mb = self._get_chunk(self.args[1], i1, i2, nd)
+        if self.op in ['div', 'truediv']:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                d = f(da, db)
+            dom = np.asarray(db) == 0
+            if np.any(dom):
+                mb = np.logical_or(mb, dom) if mb is not np.ma.nomask else dom
+        else:
+            d = f(da, db)
+
+        if ma is np.ma.nomask:
+            m = mb
+        elif mb is np.ma.nomask:
+            m = ma
+        else:
+            m = np.logical_or(ma, mb)
+        if (m is not np.ma.nomask) and np.ndim(d) > 0 and np.any(m):
+            # like numpy.ma: invalid elements keep the value of the first operand
+            m = np.broadcast_to(m, np.shape(d))
+            np.copyto(d, np.broadcast_to(da, np.shape(d)), where=m, casting='unsafe')
+        return d, m
+
+    def leaves(self):
+        """ list of all arrays and scalars of the expression """
+        r = []
+        for a in self.args:
+            if isinstance(a, Expression):
+                r += a.leaves()
+            else:
+                r.append(a)
+        return r
+
+    def _get_chunksize(self, chunksize):
+        if chunksize is not None:
+            return max(int(chunksize), 1)
+        # about 2**20 elements per chunk
+        n = int(np.prod(self.shape[1:])) if len(self.shape) > 1 else 1
+        return max(2 ** 20 // max(n, 1), 1)
+
+    def evaluate(self, chunksize=None, out=None):
+        """
+        evaluate the expression
+
+        Parameters
+        ----------
+        chunksize : int
+            number of timesteps (first dimension) calculated at once;
+            if None, then this is chosen automatically
+        out : MaskedArray
+            array to write the result to. This is only used if it has
+            the geometry and data type of the result and does not
+            overlap in memory with one of the other operands
+
+        Returns
+        -------
+        res : MaskedArray
+            result with a full mask array
+        """
+        nd = len(self.shape)
+        if nd == 0:
+            d, m = self._evaluate_chunk(None, None, nd)
+            return np.ma.array(d, mask=m)
+
+        nt = self.shape[0]
+        n = self._get_chunksize(chunksize)
+        res = None
+        for i1 in xrange(0, max(nt, 1), n):
+            i2 = min(i1 + n, nt)
+            d, m = self._evaluate_chunk(i1, i2, nd)
+            if res is None:
+                res = self._get_output(np.asarray(d).dtype, out)
+            res.data[i1:i2] = d
+            if m is np.ma.nomask:
+                res.mask[i1:i2] = False
+            else:
+                res.mask[i1:i2] = m
+        return res
+
+    def _get_output(self, dtype, out):
+        """ allocate the array for the results or check if out can be used """
+        if isinstance(out, np.ma.MaskedArray) and (out.shape == self.shape) and (out.dtype == dtype):
+            ok = True
+            for a in self.leaves():
+                if a is out:
+                    continue  # same array; each chunk is read before it is written
+                if isinstance(a, np.ndarray) and np.may_share_memory(a, out):
+                    ok = False
+                    break
+            if ok:
+                if out.mask is np.ma.nomask:
+                    out.mask = np.zeros(self.shape, dtype='bool')
+                else:
+                    out.unshare_mask()
+                return out
+        return np.ma.array(np.empty(self.shape, dtype=dtype), mask=np.zeros(self.shape, dtype='bool'))
@@ -9,6 +9,8 @@ COPYRIGHT.md
 MODULE for spatial grid manipulations
 """
 
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import matplotlib.delaunay as triang
 from matplotlib import pylab as pl
@@ -203,3 +205,470 @@ class Grid(object):
         im = ax.add_collection(self._collection)
         ax.set_xlim(lon.min(), lon.max())
         ax.set_ylim(lat.min(), lat.max())
+
+
+def _lonlat2xyz(lon, lat):
+    """
+    convert geographical coordinates [deg] to cartesian
+    coordinates on the unit sphere
+
+    Returns
+    -------
+    xyz : ndarray
+        coordinates [npoints,3]
+    """
+    lon = np.radians(np.asarray(lon, dtype='float').flatten())
+    lat = np.radians(np.asarray(lat, dtype='float').flatten())
+    return np.vstack([np.cos(lat) * np.cos(lon),
+                      np.cos(lat) * np.sin(lon),
+                      np.sin(lat)]).T
+
+
+class Resampler(object):
+    """
+    resampling of data from a source geometry (e.g. stations, swath
+    data or another grid) to a target grid using a KD-tree on
+    unit sphere coordinates
+
+    The neighbour tables are calculated only once and are then used
+    for all timesteps and all variables on the same pair of
+    geometries. Use get_resampler() to reuse resamplers.
+
+    Two methods are supported:
+
+    nearest : each source point is assigned to the closest target
+        cell, if the distance is smaller than the radius. If several
+        source points fall into the same target cell, then the closest
+        one is used.
+    idw : inverse distance weighting of the k nearest source points
+        within the radius around each target cell
+    """
+
+    def __init__(self, src_lon, src_lat, tgt_lon, tgt_lat, radius, method='nearest', k=4, power=2.):
+        """
+        Parameters
+        ----------
+        src_lon : ndarray
+            longitudes of source points [deg]
+        src_lat : ndarray
+            latitudes of source points [deg]
+        tgt_lon : ndarray
+            longitudes of target grid [deg]
+        tgt_lat : ndarray
+            latitudes of target grid [deg]
+        radius : float
+            search radius as great circle distance [deg]
+        method : str
+            resampling method ['nearest','idw']
+        k : int
+            number of neighbours for 'idw'
+        power : float
+            power of inverse distance weighting
+        """
+        from scipy.spatial import cKDTree
+
+        if np.shape(src_lon) != np.shape(src_lat):
+            raise ValueError('Inconsistent geometry of source coordinates!')
+        if np.shape(tgt_lon) != np.shape(tgt_lat):
+            raise ValueError('Inconsistent geometry of target coordinates!')
+        if method not in ['nearest', 'idw']:
+            raise ValueError('Invalid resampling method: %s' % method)
+        if radius is None:
+            raise ValueError('Search radius obligatory')
+
+        self.method = method
+        self.k = k
+        self.power = power
+        self.radius = radius
+        self.shape = np.shape(tgt_lon)
+        self.src_shape = np.shape(src_lon)
+        self.nsrc = np.size(src_lon)
+        self.ntgt = np.size(tgt_lon)
+
+        # chord length corresponding to the great circle distance
+        dmax = 2. * np.sin(0.5 * np.radians(radius))
+
+        if method == 'nearest':
+            tree = cKDTree(_lonlat2xyz(tgt_lon, tgt_lat))
+            dist, idx = tree.query(_lonlat2xyz(src_lon, src_lat), k=1)
+            valid = np.where(dist <= dmax)[0]
+            # closest source point last, as it takes precedence
+            o = np.argsort(dist[valid])[::-1]
+            self.src_index = valid[o]
+            self.tgt_index = idx[valid[o]]
+        else:
+            tree = cKDTree(_lonlat2xyz(src_lon, src_lat))
+            kk = min(k, self.nsrc)
+            dist, idx = tree.query(_lonlat2xyz(tgt_lon, tgt_lat), k=kk, distance_upper_bound=dmax * (1. + 1.E-12))
+            dist = dist.reshape((self.ntgt, kk))
+            idx = idx.reshape((self.ntgt, kk))
+            invalid = idx == self.nsrc  # no neighbour within radius
+            idx[invalid] = 0
+            w = 1. / np.maximum(dist, 1.E-12) ** power
+            w[invalid] = 0.
+            # exact matches get all the weight
+            exact = dist <= 1.E-12
+            hit = np.any(exact, axis=1)
+            w[hit, :] = exact[hit, :].astype('float')
+            self.index = idx
+            self.weights = w
+
+    def resample(self, data):
+        """
+        resample data to the target grid
+
+        Parameters
+        ----------
+        data : ndarray
+            data at source points; either of the same geometry as the
+            source coordinates or [time,...] with the geometry of the
+            source coordinates for the remaining dimensions
+
+        Returns
+        -------
+        res : ndarray
+            masked array with the geometry of the target grid; for
+            data with a time dimension [time,ny,nx] (also for a
+            single timestep)
+        """
+        if np.ndim(data) == len(self.src_shape):
+            nt = None
+            if np.shape(data) != self.src_shape:
+                raise ValueError('Geometry of data does not match the source coordinates!')
+            x = np.ma.masked_invalid(np.ma.array(data, dtype='float')).reshape((1, self.nsrc))
+        elif np.ndim(data) == len(self.src_shape) + 1:
+            nt = len(data)
+            if np.shape(data)[1:] != self.src_shape:
+                raise ValueError('Geometry of data does not match the source coordinates!')
+            x = np.ma.masked_invalid(np.ma.array(data, dtype='float')).reshape((nt, self.nsrc))
+        else:
+            raise ValueError('Geometry of data does not match the source coordinates!')
+        msk = np.ma.getmaskarray(x)
+        x = np.ma.filled(x, 0.)
+        n = len(x)
+
+        if self.method == 'nearest':
+            res = np.ones((n, self.ntgt)) * np.nan
+            tmp = x[:, self.src_index]
+            tmp[msk[:, self.src_index]] = np.nan
+            res[:, self.tgt_index] = tmp
+        else:
+            # weights of masked source values are set to zero
+            w = self.weights[np.newaxis, :, :] * (~msk[:, self.index])
+            wsum = w.sum(axis=2)
+            res = (w * x[:, self.index]).sum(axis=2) / np.where(wsum > 0., wsum, 1.)
+            res[wsum == 0.] = np.nan
+
+        if nt is None:
+            res = res.reshape(self.shape)
+        else:
+            res = res.reshape((nt,) + self.shape)
+        return np.ma.array(res, mask=np.isnan(res))
+
+
+class _LRUCache(object):
+    """
+    small cache which keeps only the most recently used entries
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, builder):
+        """
+        get an entry of the cache; builder() is called to generate
+        the entry if it is not cached
+        """
+        if key in self._entries:
+            self.hits += 1
+            v = self._entries.pop(key)
+        else:
+            self.misses += 1
+            v = builder()
+        self._entries[key] = v  # most recently used at the end
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return v
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# neighbour tables can be large; keep only a few
+_RESAMPLERS = _LRUCache(maxsize=8)
+
+
+def _coordinate_hash(*args):
+    h = hashlib.md5()
+    for a in args:
+        a = np.ascontiguousarray(a, dtype='float')
+        h.update(str(a.shape))
+        h.update(a.tostring())
+    return h.hexdigest()
+
+
+def get_resampler(src_lon, src_lat, tgt_lon, tgt_lat, radius, method='nearest', k=4, power=2.):
+    """
+    get a Resampler for a pair of geometries. Resamplers are cached,
+    thus the neighbour tables are only calculated once per pair of
+    geometries and set of parameters. Only the most recently used
+    resamplers are kept (see clear_resampler_cache()).
+
+    Parameters are the same as for Resampler
+    """
+    key = (_coordinate_hash(src_lon, src_lat, tgt_lon, tgt_lat), radius, method, k, power)
+
+    def _builder():
+        return Resampler(src_lon, src_lat, tgt_lon, tgt_lat, radius, method=method, k=k, power=power)
+    return _RESAMPLERS.get(key, _builder)
+
+
+_LATITUDE_BANDS = _LRUCache(maxsize=16)
+
+
+def get_latitude_bands(lat, edges):
+    """
+    get the index of the latitude band for each grid cell. This allows
+    zonal statistics for arbitrary (e.g. curvilinear or unstructured)
+    grids. The indices of the most recently used pairs of latitudes
+    and band edges are cached.
+
+    Parameters
+    ----------
+    lat : ndarray
+        latitudes of grid cells [deg]
+    edges : ndarray
+        monotonically increasing edges of latitude bands [deg]; the
+        bands are [edges[i],edges[i+1]), the last band is closed
+
+    Returns
+    -------
+    idx : ndarray
+        flattened array with band index for each cell; -1 for cells
+        outside of the bands
+    """
+    edges = np.asarray(edges, dtype='float')
+    if edges.ndim != 1 or len(edges) < 2:
+        raise ValueError('At least two band edges need to be given!')
+    if np.any(np.diff(edges) <= 0.):
+        raise ValueError('Edges of latitude bands need to be increasing!')
+
+    def _builder():
+        nb = len(edges) - 1
+        x = np.asarray(lat, dtype='float').flatten()
+        idx = np.digitize(x, edges) - 1
+        idx[x == edges[-1]] = nb - 1
+        idx[(idx < 0) | (idx >= nb) | ~np.isfinite(x)] = -1
+        return idx
+    return _LATITUDE_BANDS.get(_coordinate_hash(lat, edges), _builder)
+
+
+# polygons of large grids need a lot of memory; keep only a few
+_CELL_POLYGONS = _LRUCache(maxsize=4)
+
+
+def _clip_polygons(x, y, c, below=True):
+    """
+    clip polygons at the meridian x=c using the Sutherland-Hodgman
+    algorithm for all polygons at once
+
+    Parameters
+    ----------
+    x, y : ndarray
+        vertex coordinates [npolygons,nvertices]
+    c : float
+        coordinate of the clipping line
+    below : bool
+        keep the part of the polygons with x <= c if True, otherwise
+        the part with x >= c
+
+    Returns
+    -------
+    x, y : ndarray
+        vertices of the clipped polygons. Polygons with less vertices
+        than the maximum are padded by repeating their last vertex
+    """
+    n, nv = x.shape
+    sgn = 1. if below else -1.
+    inside = sgn * (x - c) <= 0.
+    # edges are from the previous vertex (s) to the current one
+    xs = np.roll(x, 1, axis=1)
+    ys = np.roll(y, 1, axis=1)
+    inside_s = np.roll(inside, 1, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (c - xs) / (x - xs)
+
+    # each edge results in up to two vertices: the intersection
+    # with the clipping line and the end point of the edge
+    ox = np.empty((n, nv, 2))
+    oy = np.empty((n, nv, 2))
+    valid = np.empty((n, nv, 2), dtype='bool')
+    ox[:, :, 0] = c
+    with np.errstate(invalid='ignore'):  # edges parallel to the clipping line are not used
+        oy[:, :, 0] = ys + t * (y - ys)
+    valid[:, :, 0] = inside != inside_s
+    ox[:, :, 1] = x
+    oy[:, :, 1] = y
+    valid[:, :, 1] = inside
+    ox = ox.reshape((n, 2 * nv))
+    oy = oy.reshape((n, 2 * nv))
+    valid = valid.reshape((n, 2 * nv))
+
+    # move valid vertices to the front, keeping their order
+    rows = np.arange(n)[:, np.newaxis]
+    order = np.argsort(~valid, axis=1, kind='mergesort')
+    cnt = valid.sum(axis=1)
+    nmax = max(cnt.max(), 1) if n > 0 else 1
+    j = np.minimum(np.arange(nmax)[np.newaxis, :], np.maximum(cnt[:, np.newaxis] - 1, 0))
+    idx = order[rows, j]
+    return ox[rows, idx], oy[rows, idx]
+
+
+def _pad_vertices(x, nv):
+    """ pad polygons to nv vertices by repeating the last vertex """
+    if x.shape[1] >= nv:
+        return x
+    return np.hstack([x, np.repeat(x[:, -1:], nv - x.shape[1], axis=1)])
+
+
+def _expand_pole_vertices(x, y, pole):
+    """
+    a vertex at a pole has no defined longitude; it is replaced by
+    two vertices at the pole with the longitudes of the neighbouring
+    vertices. Other vertices are repeated, thus all polygons get
+    twice the number of vertices
+    """
+    n, nv = x.shape
+    xp = np.where(pole, np.roll(x, 1, axis=1), x)
+    xn = np.where(pole, np.roll(x, -1, axis=1), x)
+    return np.dstack([xp, xn]).reshape((n, 2 * nv)), np.dstack([y, y]).reshape((n, 2 * nv))
+
+
+def _polar_polygons(x, y):
+    """
+    polygons of cells which contain a pole. The vertices are sorted
+    by longitude and the polygon is closed along the dateline and
+    the pole
+
+    Returns
+    -------
+    x, y : ndarray
+        vertices of the polygons [npolygons,nvertices+4]
+    """
+    n = len(x)
+    rows = np.arange(n)[:, np.newaxis]
+    order = np.argsort(x, axis=1)
+    x = x[rows, order]
+    y = y[rows, order]
+    # latitude at the dateline, between the vertices with the
+    # largest and the smallest longitude
+    dx = x[:, 0] + 360. - x[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(dx > 0., (180. - x[:, -1]) / dx, 0.)
+    yd = (y[:, -1] + t * (y[:, 0] - y[:, -1]))[:, np.newaxis]
+    yp = np.where(y.mean(axis=1) > 0., 90., -90.)[:, np.newaxis]
+    c = np.ones((n, 1)) * 180.
+    return np.hstack([-c, x, c, c, -c]), np.hstack([yd, y, yd, yp, yp])
+
+
+def get_cell_polygons(vlon, vlat):
+    """
+    get the polygons of the cells of an unstructured grid (e.g. ICON)
+    for plotting. Cells which cross the dateline are split into an
+    eastern and a western part. Cells which contain a pole are closed
+    along the dateline and the pole instead. The polygons of the most
+    recently used grids are cached.
+
+    Parameters
+    ----------
+    vlon : ndarray
+        longitudes of the vertices of the cells [ncell,nvertices] [deg]
+    vlat : ndarray
+        latitudes of the vertices of the cells [ncell,nvertices] [deg]
+
+    Returns
+    -------
+    verts : ndarray
+        vertices of the polygons [npolygons,nv,2] (lon,lat) with
+        longitudes within -180 ... 180
+    cells : ndarray
+        index of the cell for each polygon [npolygons]
+    """
+    key = _coordinate_hash(vlon, vlat)
+    return _CELL_POLYGONS.get(key, lambda: _cell_polygons(vlon, vlat))
+
+
+def _cell_polygons(vlon, vlat):
+    """ calculate the polygons of the cells (see get_cell_polygons()) """
+    vlon = np.asarray(vlon, dtype='float')
+    vlat = np.asarray(vlat, dtype='float')
+    if vlon.ndim != 2 or vlon.shape != vlat.shape:
+        raise ValueError('Vertices need to be given as [ncell,nvertices] arrays!')
+    vlon = np.mod(vlon + 180., 360.) - 180.
+
+    # cells with a vertex at a pole are handled separately, as
+    # these get additional vertices
+    pole = np.abs(vlat) >= 90. - 1.E-6
+    haspole = pole.any(axis=1)
+    groups = [(vlon[~haspole], vlat[~haspole], np.where(~haspole)[0])]
+    if haspole.any():
+        idx = np.where(haspole)[0]
+        x, y = _expand_pole_vertices(vlon[idx], vlat[idx], pole[idx])
+        groups.append((x, y, idx))
+
+    xs = []
+    ys = []
+    cells = []
+    for x, y, idx in groups:
+        # the longitudes of a cell containing a pole wind once
+        # around the globe
+        d = np.mod(np.roll(x, -1, axis=1) - x + 180., 360.) - 180.
+        polar = np.abs(d.sum(axis=1)) > 180.
+        cross = ((x.max(axis=1) - x.min(axis=1)) > 180.) & ~polar
+        regular = ~(cross | polar)
+        xs.append(x[regular])
+        ys.append(y[regular])
+        cells.append(idx[regular])
+        c = np.where(cross)[0]
+        if len(c) > 0:
+            # eastern part of the cells
+            e = x[c].copy()
+            e[e < 0.] += 360.
+            xe, ye = _clip_polygons(e, y[c], 180., below=True)
+            # western part of the cells
+            w = x[c].copy()
+            w[w > 0.] -= 360.
+            xw, yw = _clip_polygons(w, y[c], -180., below=False)
+            xs += [xe, xw]
+            ys += [ye, yw]
+            cells += [idx[c], idx[c]]
+        p = np.where(polar)[0]
+        if len(p) > 0:
+            xp, yp = _polar_polygons(x[p], y[p])
+            xs.append(xp)
+            ys.append(yp)
+            cells.append(idx[p])
+
+    nv = max([a.shape[1] for a in xs])
+    x = np.vstack([_pad_vertices(a, nv) for a in xs])
+    y = np.vstack([_pad_vertices(a, nv) for a in ys])
+    verts = np.dstack([x, y])
+    cells = np.concatenate(cells)
+    verts.flags.writeable = False
+    cells.flags.writeable = False
+    return verts, cells
+
+
+def clear_resampler_cache():
+    """ remove all cached resamplers, latitude bands and cell polygons """
+    _RESAMPLERS.clear()
+    _LATITUDE_BANDS.clear()
+    _CELL_POLYGONS.clear()
@@ -8,9 +8,82 @@ COPYRIGHT.md
 from pycmbs.data import Data
 import os
 from pycmbs.netcdf import *
+from pycmbs.grid import get_cell_polygons, _LRUCache
 import numpy as np
 
 
+class IconGrid(object):
+
+    """
+    geometry of an ICON grid
+
+    The coordinates are read once from the grid file. Use
+    get_icon_grid() to obtain grids, as these are cached for each
+    grid file. The arrays are read-only, as they are shared.
+    """
+
+    def __init__(self, gridfile):
+        """
+        Parameters
+        ----------
+        gridfile : str
+            filename of grid definition file
+        """
+        if not os.path.exists(gridfile):
+            raise ValueError('File not existing: %s' % gridfile)
+        self.gridfile = gridfile
+
+        File = NetCDFHandler()
+        File.open_file(gridfile, 'r')
+        # grid cell center coordinates
+        self.lon = np.asarray(File.get_variable('clon')) * 180. / np.pi
+        self.lat = np.asarray(File.get_variable('clat')) * 180. / np.pi
+        # coordinates of the vertices [ncell,nvertices]
+        self.vlon = np.asarray(File.get_variable('clon_vertices')) * 180. / np.pi
+        self.vlat = np.asarray(File.get_variable('clat_vertices')) * 180. / np.pi
+        File.close()
+        self.ncell = len(self.lon)
+
+        for a in [self.lon, self.lat, self.vlon, self.vlat]:
+            a.flags.writeable = False
+
+    def get_polygons(self):
+        """
+        get the polygons of all cells for plotting; cells crossing
+        the dateline are split and cells at the poles are closed
+        along the pole (see pycmbs.grid.get_cell_polygons())
+
+        Returns
+        -------
+        verts : ndarray
+            vertices of the polygons [npolygons,nv,2]
+        cells : ndarray
+            index of the cell for each polygon [npolygons]
+        """
+        return get_cell_polygons(self.vlon, self.vlat)
+
+
+# only the most recently used grids are kept
+_ICON_GRIDS = _LRUCache(maxsize=4)
+
+
+def get_icon_grid(gridfile):
+    """
+    get the ICON grid of a grid file. Grids are cached, thus the
+    coordinates are only read once, unless the file is modified.
+
+    Parameters
+    ----------
+    gridfile : str
+        filename of grid definition file
+    """
+    if not os.path.exists(gridfile):
+        raise ValueError('File not existing: %s' % gridfile)
+    st = os.stat(gridfile)
+    key = (os.path.abspath(gridfile), st.st_mtime, st.st_size)
+    return _ICON_GRIDS.get(key, lambda: IconGrid(gridfile))
+
+
 class Icon(Data):
 
     """
@@ -40,6 +113,7 @@ class Icon(Data):
 
 #---
 
+    @netcdf_session
     def read(self, time_var='time'):
         """
         This is a special routine for reading data from ICON structure
@@ -76,18 +150,16 @@ class Icon(Data):
 
         self.data *= self.scale_factor
 
-        #--- read lat/lon
-        File = NetCDFHandler()
-        File.open_file(self.gridfile, 'r')
+        #--- read lat/lon; the grid is cached for all files
+        self.grid = get_icon_grid(self.gridfile)
         # grid cell center coordinates
-        self.lon = File.get_variable('clon') * 180. / np.pi
-        self.lat = File.get_variable('clat') * 180. / np.pi
-        self.ncell = len(self.lon)
+        self.lon = self.grid.lon.copy()
+        self.lat = self.grid.lat.copy()
+        self.ncell = self.grid.ncell
 
-        self.vlon = File.get_variable('clon_vertices') * 180. / np.pi
-        self.vlat = File.get_variable('clat_vertices') * 180. / np.pi
-
-        File.close()
+        # vertices are shared with the grid and are read-only
+        self.vlon = self.grid.vlon
+        self.vlat = self.grid.vlat
 
         #--- read time variable
         if self.time_var is not None:
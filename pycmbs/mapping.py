@@ -46,7 +46,27 @@ from matplotlib.collections import PatchCollection
 
 from pycmbs.data import Data
 from pycmbs.plots import ZonalPlot
+from pycmbs.plots import get_unstructured_collection
 from pycmbs.polygon_utils import Polygon
+from pycmbs.grid import _LRUCache, _coordinate_hash
+from pycmbs.utils import hashable
+
+
+def _freeze(x):
+    """ make arrays read-only, as these are shared via the cache """
+    if isinstance(x, tuple):
+        for v in x:
+            _freeze(v)
+    elif isinstance(x, np.ndarray):
+        x.flags.writeable = False
+    return x
+
+
+# map projections and projected coordinates are cached, as setting
+# these up is expensive and usually the same grids are drawn in the
+# same projection many times. The cache is shared between all maps
+# (e.g. SingleMap, map_plot() and map_difference())
+PROJECTION_CACHE = _LRUCache(maxsize=50)
 
 
 class MapPlotGeneric(object):
@@ -230,15 +250,24 @@ class MapPlotGeneric(object):
             raise ValueError(
                 'No projection properties are given! Please modify or choose a different backend!')
 
-        the_map = Basemap(ax=self.pax, **proj_prop)
-        xm = self.x.timmean()
+        # map and projected coordinates are cached; the map is
+        # therefore assigned to the current axis
+        proj_key = hashable(proj_prop)
+        the_map = PROJECTION_CACHE.get(('basemap', proj_key), lambda: Basemap(**proj_prop))
+        the_map.ax = self.pax
+        xm = self.x.get_derived('timmean')
 
         Z = xm
         lon = self.x.lon
         lat = self.x.lat
 
-        X, Y = the_map(lon, lat)
-        self.im = the_map.pcolormesh(X, Y, Z, **kwargs)
+        if self._is_unstructured():
+            self.im = self._get_unstructured_collection(project=the_map, **kwargs)
+            self.pax.add_collection(self.im)
+        else:
+            X, Y = PROJECTION_CACHE.get(('basemap_mesh', proj_key, _coordinate_hash(lon, lat)),
+                                        lambda: _freeze(the_map(lon, lat)))
+            self.im = the_map.pcolormesh(X, Y, Z, **kwargs)
 
         self.__basemap_ancillary(the_map, drawparallels=drawparallels)
 
@@ -321,7 +350,7 @@ class MapPlotGeneric(object):
             plot_data_field = False
 
         if plot_data_field:
-            xm = self.x.timmean()
+            xm = self.x.get_derived('timmean')
             Z = xm
             lon = self.x.lon
             lat = self.x.lat
@@ -330,39 +359,18 @@ class MapPlotGeneric(object):
                 print 'ERROR: invalid shape for plotting!'
                 return
 
-        if proj_prop['projection'] == 'robin':
-            act_ccrs = ccrs.Robinson()
-        elif proj_prop['projection'] == 'stereo':
-            act_ccrs = ccrs.Stereographic(central_longitude=proj_prop.pop(
-                'central_longitude', 0.), central_latitude=proj_prop.pop('central_latitude', 0.))
-        elif proj_prop['projection'] == 'TransverseMercator':
-            act_ccrs = ccrs.TransverseMercator(central_longitude=proj_prop.pop(
-                'central_longitude', 0.), central_latitude=proj_prop.pop('central_latitude', 0.))
-        elif proj_prop['projection'] == 'mercator':
-            if 'extent' in proj_prop.keys():
-                ymin = proj_prop['extent']['ymin']
-                ymax = proj_prop['extent']['ymax']
-            else:
-                raise ValueError('Need to specify extent!')
-            act_ccrs = ccrs.Mercator(central_longitude=proj_prop.pop(
-                'central_longitude', 0.), min_latitude=ymin, max_latitude=ymax)
-        else:
-            raise ValueError('Unsupported projection')
+        act_ccrs = PROJECTION_CACHE.get(('cartopy', hashable(proj_prop)), lambda: self._get_ccrs(proj_prop))
 
         self.pax = self._ax2geoax(self.pax, act_ccrs)
 
-        # add cyclic coordinates if possible
-        if plot_data_field:
-            if self.x._equal_lon():
-                try:
-                    lon1, lat1, Z1 = self._add_cyclic_to_field(
-                        self.x._get_unique_lon(), lat, Z)
-                except:
-                    lon1 = None
-                if lon1 is not None:
-                    lon = lon1
-                    lat = lat1
-                    Z = Z1
+        if plot_data_field and not self._is_unstructured():
+            # add cyclic coordinates if possible
+            cyclic_lon, cyclic_lat = PROJECTION_CACHE.get(('cyclic', _coordinate_hash(lon, lat)),
+                                                          lambda: _freeze(self._get_cyclic_grid(lon, lat)))
+            if cyclic_lon is not None:
+                lon = cyclic_lon
+                lat = cyclic_lat
+                Z = np.ma.concatenate((Z, Z[:, 0:1]), axis=1)
 
         # plot and ancillary plots
         if 'extent' in proj_prop.keys():
@@ -394,7 +402,11 @@ class MapPlotGeneric(object):
             self.pax.set_global()  # ensure global plot
         self.pax.coastlines()
 
-        if plot_data_field:
+        if plot_data_field and self._is_unstructured():
+            self.im = self._get_unstructured_collection(
+                project=lambda lon, lat: self._project_grid(act_ccrs, lon, lat), **kwargs)
+            self.pax.add_collection(self.im)
+        elif plot_data_field:
             try:
                 self.im = self.pax.pcolormesh(
                     lon, lat, Z, transform=ccrs.PlateCarree(), **kwargs)
@@ -416,6 +428,68 @@ class MapPlotGeneric(object):
                     self._add_polygons_as_collection_cartopy(
                         act_ccrs, vmin=vmin_polygons, vmax=vmax_polygons)
 
+    def _get_ccrs(self, proj_prop):
+        """ cartopy projection for the projection properties """
+        if proj_prop['projection'] == 'robin':
+            return ccrs.Robinson()
+        elif proj_prop['projection'] == 'stereo':
+            return ccrs.Stereographic(central_longitude=proj_prop.get(
+                'central_longitude', 0.), central_latitude=proj_prop.get('central_latitude', 0.))
+        elif proj_prop['projection'] == 'TransverseMercator':
+            return ccrs.TransverseMercator(central_longitude=proj_prop.get(
+                'central_longitude', 0.), central_latitude=proj_prop.get('central_latitude', 0.))
+        elif proj_prop['projection'] == 'mercator':
+            if 'extent' in proj_prop.keys():
+                ymin = proj_prop['extent']['ymin']
+                ymax = proj_prop['extent']['ymax']
+            else:
+                raise ValueError('Need to specify extent!')
+            return ccrs.Mercator(central_longitude=proj_prop.get(
+                'central_longitude', 0.), min_latitude=ymin, max_latitude=ymax)
+        else:
+            raise ValueError('Unsupported projection')
+
+    def _get_cyclic_grid(self, lon, lat):
+        """
+        coordinates extended by a cyclic column; None if
+        this is not possible for the grid
+        """
+        if not self.x._equal_lon():
+            return None, None
+        try:
+            lon1, lat1, dummy = self._add_cyclic_to_field(
+                self.x._get_unique_lon(), lat, np.zeros(lat.shape))
+        except:
+            lon1 = None
+        if lon1 is None:
+            return None, None
+        return lon1, lat1
+
+    def _project_grid(self, act_ccrs, lon, lat):
+        """ transform geographical coordinates to the map projection """
+        pts = act_ccrs.transform_points(ccrs.PlateCarree(), np.asarray(lon), np.asarray(lat))
+        return pts[..., 0].copy(), pts[..., 1].copy()
+
+    def _is_unstructured(self):
+        """ data of an unstructured grid (e.g. ICON) """
+        return getattr(self.x, 'gridtype', None) == 'unstructured'
+
+    def _get_unstructured_collection(self, project=None, vmin=None, vmax=None, cmap='jet'):
+        """
+        collection with the cells of an unstructured grid
+
+        Parameters
+        ----------
+        project : callable
+            function to transform the vertices (lon, lat) to map
+            coordinates, e.g. a Basemap object; no transformation
+            if None
+        """
+        if not (hasattr(self.x, 'vlon') and hasattr(self.x, 'vlat')):
+            raise ValueError('Plotting for unstructured grid not possible, as vertices (VLON, VLAT) are missing!')
+        return get_unstructured_collection(self.x.vlon, self.x.vlat, self.x.get_derived('timmean'),
+                                           vmin=vmin, vmax=vmax, cmap=cmap, basemap_object=project)
+
     def _add_collection(self, collection):
         if self.backend == 'imshow':
             raise ValueError('Collections not tested yet with backend IMSHOW')
@@ -649,7 +723,15 @@ class MapPlotGeneric(object):
         if self.zax is not None:
             self._set_axis_invisible(self.zax, frame=True)
 
-        self.im = self.pax.imshow(self.x.timmean(),
+        if self._is_unstructured():
+            # cells are drawn as polygons in geographical coordinates
+            self.im = self._get_unstructured_collection(**kwargs)
+            self.pax.add_collection(self.im)
+            self.pax.set_xlim(-180., 180.)
+            self.pax.set_ylim(-90., 90.)
+            return
+
+        self.im = self.pax.imshow(self.x.get_derived('timmean'),
                                   interpolation='nearest', **kwargs)
 
     def _get_cticks(self):
@@ -738,11 +820,10 @@ class SingleMap(MapPlotGeneric):
 
     def _plot_zonal(self):
         if self.show_zonal:
-            if self.x._latitudecheckok:
-                self._draw_zonal_plot(self)
-            else:
+            if not self.x._latitudecheckok:
                 print(
-                    'WARNING: zonal plot not possible due to invalid latitude configurations')
+                    'WARNING: invalid latitude configuration; zonal plot is based on latitude bands')
+            self._draw_zonal_plot()
 
     def _set_cmap(self, nclasses):
         """
@@ -785,12 +866,13 @@ class SingleMap(MapPlotGeneric):
             self.pax.set_title(unit, loc='right', size=fontsize - 2)
 
     def _get_statistics_str(self):
-        tmp_xm = self.x.timmean(return_object=True)  # from temporal mean
+        # derived fields are cached, as they are used by several parts of the plot
+        tmp_xm = self.x.get_derived('timmean', return_object=True)  # from temporal mean
         s = ''
         if self.show_statistic:
             if self.stat_type == 'mean':
-                me = tmp_xm.fldmean()
-                st = tmp_xm.fldstd()
+                me = tmp_xm.get_derived('fldmean')
+                st = tmp_xm.get_derived('fldstd')
                 assert(len(me) == 1)
                 assert(len(st) == 1)
                 me = me[0]
@@ -798,7 +880,7 @@ class SingleMap(MapPlotGeneric):
                 s = 'mean: $' + str(round(me, 2)) + \
                     ' \pm ' + str(round(st, 2)) + '$'
             elif self.stat_type == 'sum':  # area sum
-                me = tmp_xm.areasum()
+                me = tmp_xm.get_derived('areasum')
                 assert(len(me) == 1)
                 me = me[0]
                 s = 'sum: $' + str(round(me, 2)) + '$'
@@ -808,7 +890,7 @@ class SingleMap(MapPlotGeneric):
         return s
 
     def _draw_zonal_plot(self, timmean=True, vmin=None, vmax=None,
-                         fontsize=8):
+                         fontsize=8, lat_bands=None):
         """
         calculate zonal statistics and add to zonal axis
 
@@ -820,16 +902,12 @@ class SingleMap(MapPlotGeneric):
             minimum value for zonal plot
         vmax : float
             maximum value for zonal plot
+        lat_bands : ndarray
+            edges of latitude bands for zonal statistics; see ZonalPlot
         """
 
         ZP = ZonalPlot(ax=self.zax, dir='y')
-
-        if self.x.ndim == 2:
-            pass
-        elif self.x.ndim == 3:
-            nt, ny, nx = self.x.shape
-
-        ZP.plot(self.x, timmean=timmean, show_ylabel=False)
+        ZP.plot(self.x, timmean=timmean, show_ylabel=False, lat_bands=lat_bands)
 
         # set limits
         if ((vmin is None) & (vmax is None)):
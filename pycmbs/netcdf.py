@@ -9,9 +9,24 @@ This module allows a flexible choice of the netCDF backend
 """
 
 import os
+import sys
+import threading
+import Queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
 
 valid_backends = ['netCDF4']
 
+# the netCDF/HDF5 libraries are not thread safe; all accesses from
+# background threads (and concurrent accesses of the main thread)
+# need to hold this lock. NetCDFHandler takes it when opening files,
+# reading variables with get_variable() and closing files. Code which
+# reads through get_variable_handler() needs to hold it itself.
+NETCDF_LOCK = threading.RLock()
+
 
 class NetCDFHandler(object):
 
@@ -45,7 +60,7 @@ class NetCDFHandler(object):
         filename : str
             name of file to read
         mode : str
-            specify read or write data access ['w','r']
+            specify read, write or append data access ['w','r','a']
         format : str
             output file format specifieralue
             ['NETCDF4', 'NETCDF4_CLASSIC', 'NETCDF3_64BIT', or 'NETCDF3_CLASSIC']
@@ -55,9 +70,12 @@ class NetCDFHandler(object):
         F : file handler
             returns a file handler
         """
-        if mode not in ['w', 'r']:
-            raise ValueError('ERROR: Invalid mode! [w,r], %s' % mode)
-        if mode == 'r':
+        if mode not in ['w', 'r', 'a']:
+            raise ValueError('ERROR: Invalid mode! [w,r,a], %s' % mode)
+        if mode in ['w', 'a']:
+            # file is modified; handles kept open for reading are not valid anymore
+            NETCDF_POOL.release(filename)
+        if mode in ['r', 'a']:
             if not os.path.exists(filename):
                 raise ValueError('ERROR: File not existing: %s' % filename)
         elif mode == 'w':
@@ -70,11 +88,12 @@ class NetCDFHandler(object):
                     not be generated!' % filename)
 
         if self.type.lower() == 'netcdf4':
-            if mode == 'r':
-                self.F = self.handler.Dataset(filename, mode=mode)
-            elif mode == 'w':
-                self.F = self.handler.Dataset(filename, mode=mode,
-                                              format=format)  # TODO check format
+            with NETCDF_LOCK:
+                if mode in ['r', 'a']:
+                    self.F = self.handler.Dataset(filename, mode=mode)
+                elif mode == 'w':
+                    self.F = self.handler.Dataset(filename, mode=mode,
+                                                  format=format)  # TODO check format
             self.create_dimension = self.F.createDimension
             self.create_variables = self.F.createVariable
         else:
@@ -138,10 +157,40 @@ class NetCDFHandler(object):
             returns data as a 2D,3D numpy array
         """
         if self.type.lower() == 'netcdf4':
-            return self.F.variables[varname][:].astype('float').copy()
+            with NETCDF_LOCK:
+                return self.F.variables[varname][:].astype('float').copy()
         else:
             raise ValueError('Something went wrong!')
 
+    def get_variable_info(self, varname):
+        """
+        get metadata of a variable
+
+        Parameters
+        ----------
+        varname : str
+            variable name
+
+        Returns
+        -------
+        info : dict
+            with keys ['dimensions', 'shape', 'units', 'calendar',
+            'fill_value', 'scale_factor', 'add_offset']. Attributes
+            which are not available are None
+        """
+        var = self.get_variable_handler(varname)
+        if self.type.lower() == 'netcdf4':
+            fill_value = None
+            if hasattr(var, '_FillValue'):
+                fill_value = float(var._FillValue)
+            # netCDF4 library already applies scale_factor and add_offset!
+            return {'dimensions': tuple(var.dimensions), 'shape': tuple(var.shape),
+                    'units': getattr(var, 'units', None),
+                    'calendar': getattr(var, 'calendar', None),
+                    'fill_value': fill_value, 'scale_factor': 1., 'add_offset': 0.}
+        else:
+            raise ValueError('Invalid backend!')
+
     def set_attribute(self, varname, key, value):
         """
         set attributes for a field
@@ -238,7 +287,7 @@ class NetCDFHandler(object):
         else:
             raise ValueError('Something went wrong!')
 
-    def create_variable(self, varname, dtype, dim, complevel=6, zlib=True, fill_value=None):
+    def create_variable(self, varname, dtype, dim, complevel=6, zlib=True, fill_value=None, chunksizes=None, shuffle=True):
         """
         create a new variable in a netCDF file
 
@@ -254,17 +303,407 @@ class NetCDFHandler(object):
             compression level
         fill_value : float
             fill value for data
+        chunksizes : tuple
+            chunk shape of the variable (one value per dimension); if
+            None, then the default of the library is used
+        shuffle : bool
+            apply shuffle filter before compression
         """
 
         if self.type.lower() == 'netcdf4':
             if fill_value is not None:
                 self.F.createVariable(varname, dtype, dimensions=dim,
-                                      fill_value=fill_value, zlib=zlib, complevel=complevel)
+                                      fill_value=fill_value, zlib=zlib, complevel=complevel,
+                                      chunksizes=chunksizes, shuffle=shuffle)
             else:
                 self.F.createVariable(
-                    varname, dtype, dimensions=dim, zlib=zlib, complevel=complevel)
+                    varname, dtype, dimensions=dim, zlib=zlib, complevel=complevel,
+                    chunksizes=chunksizes, shuffle=shuffle)
         else:
             raise ValueError('Something went wrong!')
 
     def close(self):
-        self.F.close()
+        with NETCDF_LOCK:
+            self.F.close()
+
+
+class PooledNetCDFHandler(NetCDFHandler):
+    """
+    read-only handler of a file which is kept open in a NetCDFFilePool
+
+    The variable names and the metadata of the variables are read only
+    once. close() does not close the file, as this is done by the pool.
+    """
+
+    def __init__(self, filename, netcdf_backend='netCDF4'):
+        super(PooledNetCDFHandler, self).__init__(netcdf_backend=netcdf_backend)
+        self.filename = filename
+        NetCDFHandler.open_file(self, filename, 'r')
+        self._keys = None
+        self._info = {}
+
+    def open_file(self, filename, mode, format='NETCDF4'):
+        raise ValueError('Files of a pooled handler can not be opened explicitly!')
+
+    def get_variable_keys(self):
+        if self._keys is None:
+            self._keys = super(PooledNetCDFHandler, self).get_variable_keys()
+        return list(self._keys)
+
+    def get_variable_info(self, varname):
+        if varname not in self._info.keys():
+            self._info.update({varname: super(PooledNetCDFHandler, self).get_variable_info(varname)})
+        return dict(self._info[varname])
+
+    def _get_unit(self, varname):
+        return self.get_variable_info(varname)['units']
+
+    def _get_fill_value(self, varname):
+        return self.get_variable_info(varname)['fill_value']
+
+    def close(self):
+        pass  # the file is kept open by the pool
+
+    def _close(self):
+        super(PooledNetCDFHandler, self).close()
+
+
+class NetCDFFilePool(object):
+    """
+    pool of netCDF files which are kept open for reading
+
+    Opening files (and reading their metadata) is expensive, in
+    particular on parallel filesystems. Within a session, the pool
+    keeps the most recently used files open (LRU) and shares the
+    handlers (together with the cached metadata) between all callers.
+    A file is opened again if it was modified in the meantime. Files
+    opened for writing using NetCDFHandler are removed from the pool
+    automatically. All files are closed at the end of the (outermost)
+    session, as open files can not be overwritten by other tools.
+    Outside of a session, each request opens the file again.
+
+    The handlers are only supposed to be used for immediate reading,
+    as the files might be closed when other files are requested.
+
+    Example
+    -------
+    with NETCDF_POOL.session():
+        File = NETCDF_POOL.get(filename)
+        x = File.get_variable('tas')
+        File.close()  # does not close the file
+        File = NETCDF_POOL.get(filename)  # no new file access
+    """
+
+    def __init__(self, maxsize=32):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            maximum number of open files. If 0, then files are not
+            kept open
+        """
+        self.maxsize = maxsize
+        self._files = OrderedDict()
+        self._sessions = 0
+        self.hits = 0  # number of requests served by an open file
+        self.misses = 0  # number of files opened
+
+    def _get_token(self, filename):
+        """ identify the state of a file """
+        st = os.stat(filename)
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def get(self, filename, netcdf_backend='netCDF4'):
+        """
+        get a read-only handler of a file
+
+        Parameters
+        ----------
+        filename : str
+            name of netCDF file
+        netcdf_backend : str
+            netCDF backend (see NetCDFHandler)
+        """
+        if not os.path.exists(filename):
+            raise ValueError('ERROR: File not existing: %s' % filename)
+        if (self.maxsize < 1) or (self._sessions == 0):
+            File = NetCDFHandler(netcdf_backend=netcdf_backend)
+            File.open_file(filename, 'r')
+            return File
+
+        key = (os.path.abspath(filename), netcdf_backend)
+        token = self._get_token(filename)
+        with NETCDF_LOCK:
+            if key in self._files.keys():
+                File, tok = self._files.pop(key)
+                if tok == token:
+                    self._files[key] = (File, tok)  # most recently used
+                    self.hits += 1
+                    return File
+                File._close()  # file has changed
+            File = PooledNetCDFHandler(filename, netcdf_backend=netcdf_backend)
+            self.misses += 1
+            self._files[key] = (File, token)
+            while len(self._files) > self.maxsize:
+                k, v = self._files.popitem(last=False)
+                v[0]._close()
+            return File
+
+    @contextmanager
+    def session(self):
+        """
+        context in which files are kept open; sessions can be nested
+        """
+        with NETCDF_LOCK:
+            self._sessions += 1
+        try:
+            yield self
+        finally:
+            with NETCDF_LOCK:
+                self._sessions -= 1
+                if self._sessions == 0:
+                    self._close_all()
+
+    def _close_all(self):
+        with NETCDF_LOCK:
+            while len(self._files) > 0:
+                self._files.popitem()[1][0]._close()
+
+    def release(self, filename):
+        """
+        close a file and remove it from the pool
+
+        Parameters
+        ----------
+        filename : str
+            name of netCDF file
+        """
+        f = os.path.abspath(filename)
+        with NETCDF_LOCK:
+            for k in [k for k in self._files.keys() if k[0] == f]:
+                self._files.pop(k)[0]._close()
+
+    def clear(self):
+        """ close all files of the pool """
+        self._close_all()
+        self.hits = 0
+        self.misses = 0
+
+
+NETCDF_POOL = NetCDFFilePool()
+
+
+def netcdf_session(func):
+    """
+    decorator to run a function within a session of NETCDF_POOL,
+    thus all files read by the function are opened only once
+    """
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        with NETCDF_POOL.session():
+            return func(*args, **kwargs)
+    return _wrapper
+
+
+def prefetch(iterable, size=2):
+    """
+    iterate over the items of an iterable, which are generated in
+    advance on a background thread
+
+    This allows to overlap the generation of the items (e.g. reading
+    data from disk) with their processing. At most 'size' items are
+    buffered. Exceptions of the background thread are raised when
+    the corresponding item is requested.
+
+    Parameters
+    ----------
+    iterable : iterable
+        e.g. a generator reading chunks of data
+    size : int
+        maximum number of items to be read ahead
+    """
+    if size < 1:
+        raise ValueError('Prefetching needs a buffer size of at least 1')
+
+    q = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _producer():
+        try:
+            for item in iterable:
+                if not _put((True, item)):
+                    return
+            _put((True, done))
+        except Exception:
+            _put((False, sys.exc_info()))
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()  # e.g. closes files of a generator stopped early
+
+    t = threading.Thread(target=_producer)
+    t.daemon = True
+    t.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if not ok:
+                raise item[0], item[1], item[2]
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()  # also stops the producer if the iteration is stopped early
+        t.join()
+
+
+class MultiFileReader(object):
+    """
+    read a variable from a list of netCDF files as a single timeseries
+
+    The files are ordered by time and their time axes are converted to
+    the units and calendar of the first file. The data is provided in
+    chunks of timesteps by iterating over the reader. The next chunk
+    is read on a background thread while the current one is processed
+    (see prefetch()).
+
+    Example
+    -------
+    R = MultiFileReader(glob.glob('tas_Amon_*.nc'), 'tas', chunksize=12)
+    for t, x in R:
+        ...  # t: time [nt], x: masked array [nt,...]
+    """
+
+    def __init__(self, files, varname, chunksize=None, prefetch=2,
+                 time_var='time', netcdf_backend='netCDF4'):
+        """
+        Parameters
+        ----------
+        files : list
+            list of netCDF files; not necessarily ordered by time
+        varname : str
+            name of variable to read
+        chunksize : int
+            maximum number of timesteps per chunk. Chunks do not span
+            over different files. If None, then each file is a
+            single chunk
+        prefetch : int
+            number of chunks which are read ahead on a background
+            thread. If 0, then all data is read in the current thread
+        time_var : str
+            name of the time variable
+        netcdf_backend : str
+            netCDF backend (see NetCDFHandler)
+        """
+        if len(files) == 0:
+            raise ValueError('No files given!')
+        if (chunksize is not None) and (chunksize < 1):
+            raise ValueError('Invalid chunksize: %s' % chunksize)
+        self.varname = varname
+        self.chunksize = chunksize
+        self.prefetch = prefetch
+        self.time_var = time_var
+        self.netcdf_backend = netcdf_backend
+        self._read_index(files)
+
+    def _open(self, filename):
+        File = NetCDFHandler(netcdf_backend=self.netcdf_backend)
+        File.open_file(filename, 'r')
+        return File
+
+    def _read_index(self, files):
+        """
+        read time axes of all files and order files by time
+        """
+        tmp = []
+        with NETCDF_LOCK:
+            for f in files:
+                File = self._open(f)
+                if self.time_var not in File.get_variable_keys():
+                    File.close()
+                    raise ValueError('Time variable %s not found in file %s' % (self.time_var, f))
+                if self.varname not in File.get_variable_keys():
+                    File.close()
+                    raise ValueError('Variable %s not found in file %s' % (self.varname, f))
+                tv = File.get_variable_handler(self.time_var)
+                t = np.atleast_1d(tv[:]).astype('float')
+                units = getattr(tv, 'units', None)
+                calendar = getattr(tv, 'calendar', 'standard')
+                shape = File.get_variable_handler(self.varname).shape
+                File.close()
+                tmp.append((f, t, units, calendar, shape))
+
+        # convert time to the units of the first file
+        self.time_units = tmp[0][2]
+        self.calendar = tmp[0][3]
+        handler = NetCDFHandler(netcdf_backend=self.netcdf_backend).handler
+        self.shape = tmp[0][4][1:]
+        for i, (f, t, units, calendar, shape) in enumerate(tmp):
+            if shape[1:] != self.shape:
+                print shape, self.shape
+                raise ValueError('Inconsistent geometry of variable in file %s' % f)
+            if len(t) != shape[0]:
+                raise ValueError('Time is not the first dimension of the variable in file %s' % f)
+            if (units != self.time_units) or (calendar != self.calendar):
+                if (units is None) or (self.time_units is None):
+                    raise ValueError('Time units are missing in file %s' % f)
+                t = handler.date2num(handler.num2date(t, units, calendar=calendar),
+                                     self.time_units, calendar=self.calendar)
+                tmp[i] = (f, np.asarray(t, dtype='float'), units, calendar, shape)
+
+        tmp.sort(key=lambda x: x[1][0] if len(x[1]) > 0 else np.inf)
+        self.files = [x[0] for x in tmp]
+        self._times = [x[1] for x in tmp]
+        self.time = np.concatenate(self._times)
+        self.nt = len(self.time)
+
+    def _chunks(self):
+        """
+        generator reading the data chunk by chunk; each file is opened
+        only once
+        """
+        for f, t in zip(self.files, self._times):
+            nt = len(t)
+            n = nt if self.chunksize is None else self.chunksize
+            File = self._open(f)
+            try:
+                for i1 in xrange(0, nt, n):
+                    i2 = min(i1 + n, nt)
+                    with NETCDF_LOCK:
+                        x = File.get_variable_handler(self.varname)[i1:i2]
+                    yield t[i1:i2], np.ma.masked_invalid(np.ma.array(x, dtype='float'))
+            finally:
+                File.close()
+
+    def __iter__(self):
+        if self.prefetch > 0:
+            return prefetch(self._chunks(), size=self.prefetch)
+        else:
+            return self._chunks()
+
+    def read(self):
+        """
+        read the entire timeseries
+
+        Returns
+        -------
+        time : ndarray
+            time [nt]
+        data : MaskedArray
+            data [nt,...]
+        """
+        t = []
+        x = []
+        for tc, xc in self:
+            t.append(tc)
+            x.append(xc)
+        return np.concatenate(t), np.ma.concatenate(x, axis=0)
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of pyCMBS. (c) 2012-2014
+For COPYING and LICENSE details, please refer to the file
+COPYRIGHT.md
+"""
+
+"""
+MODULE for performance tests of the hot paths of the Data class
+
+The data is generated synthetically with Data._init_sample_object,
+thus no data files or network access are needed. Each case is run
+for different grids, numbers of timesteps and fractions of masked
+grid cells. The runtime and the peak memory are recorded and can be
+compared against the results of an earlier run (baseline).
+
+Usage
+-----
+python -m pycmbs.performance --grids t63,1deg --ntimes 120,1200 -o perf.json
+python -m pycmbs.performance -b perf.json --threshold 0.25
+"""
+
+import os
+import sys
+import json
+import platform
+import resource
+import timeit
+import optparse
+import multiprocessing
+import Queue
+
+import numpy as np
+
+from pycmbs.data import Data
+from pycmbs.diagnostic import EOF
+from pycmbs.polygon import Raster
+from pycmbs.polygon import Polygon as pycmbsPolygon
+
+
+# spatial grids (ny, nx)
+GRIDS = {'t63': (96, 192), '1deg': (180, 360), '05deg': (360, 720)}
+NTIMES = [120, 1200, 10000]
+MASK_FRACTIONS = [0., 0.3]
+
+
+def _get_version():
+    try:
+        from pycmbs import __version__
+        return str(__version__)
+    except:
+        return 'unknown'
+
+
+def _get_maxrss():
+    """ peak resident memory of the current process [MB] (Linux) """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _sample_object(nt, ny, nx, mask_fraction, seed=42):
+    """
+    generate a synthetic Data object with monthly timesteps and a
+    fraction of masked grid cells (same for all timesteps)
+    """
+    np.random.seed(seed)
+    x = Data(None, None)
+    x._init_sample_object(nt=nt, ny=ny, nx=nx)
+    x.time_cycle = 12
+    if mask_fraction > 0.:
+        msk = np.random.random((ny, nx)) < mask_fraction
+        x.data.mask = np.ones(x.data.shape, dtype='bool') * msk[np.newaxis, :, :]
+    return x
+
+
+#-----------------------------------------------------------------------
+# cases; each case has a setup routine which returns the arguments
+# and a routine which is timed
+#-----------------------------------------------------------------------
+
+def _setup_default(x):
+    return (x,)
+
+
+def _setup_pair(x):
+    y = x.copy()
+    y.data = y.data + np.random.random(y.data.shape) * 0.1
+    return (x, y)
+
+
+def _setup_mask(x):
+    return (x, np.random.random(x.data.shape[1:]) > 0.5)
+
+
+def _setup_condstat(x):
+    return (x, np.random.randint(1, 11, size=x.data.shape[1:]))
+
+
+def _setup_polygons(x):
+    polys = []
+    for i in xrange(10):
+        lon0 = -170. + 30. * i
+        polys.append(pycmbsPolygon(i + 1, [(lon0, -40.), (lon0 + 25., -40.), (lon0 + 25., 40.), (lon0, 40.)]))
+    return (Raster(x.lon, x.lat), polys)
+
+
+def _run_correlate(x, y):
+    x.correlate(y)
+
+
+def _run_fldmean(x):
+    x.fldmean()
+
+
+def _run_climatology(x):
+    x.get_climatology(return_object=False)
+
+
+def _run_temporal_smooth(x):
+    x.temporal_smooth(5, return_object=True)
+
+
+def _run_apply_mask(x, msk):
+    x._apply_mask(msk)
+
+
+def _run_condstat(x, M):
+    x.condstat(M)
+
+
+def _run_eof(x):
+    EOF(x, area_weighting=False)
+
+
+def _run_rasterize(R, polys):
+    R.rasterize_polygons(polys)
+
+
+# name: (setup, run, max_elements, temporal)
+#   max_elements : largest size (nt*ny*nx) for which the case is run
+#   temporal : if False, then the case does not depend on the number
+#              of timesteps and is only run for the smallest one
+CASES = {'correlate': (_setup_pair, _run_correlate, 2.E7, True),
+         'fldmean': (_setup_default, _run_fldmean, None, True),
+         'get_climatology': (_setup_default, _run_climatology, None, True),
+         'temporal_smooth': (_setup_default, _run_temporal_smooth, None, True),
+         '_apply_mask': (_setup_mask, _run_apply_mask, None, True),
+         'condstat': (_setup_condstat, _run_condstat, None, True),
+         'EOF': (_setup_default, _run_eof, 5.E6, True),
+         'rasterize_polygons': (_setup_polygons, _run_rasterize, None, False)}
+
+
+def _run_single(case, nt, ny, nx, mask_fraction, repeat):
+    """
+    run a single configuration of a case
+
+    Returns
+    -------
+    res : dict
+        runtimes [s] and additional peak memory during the run [MB]
+    """
+    setup, run, maxel, temporal = CASES[case]
+    x = _sample_object(nt, ny, nx, mask_fraction)
+    times = []
+    mem0 = _get_maxrss()
+    for i in xrange(repeat):
+        args = setup(x.copy())  # fresh data, as some routines change it
+        t = timeit.default_timer()
+        run(*args)
+        times.append(timeit.default_timer() - t)
+        del args
+    return {'time_min': min(times), 'time_median': float(np.median(times)),
+            'memory_peak': max(_get_maxrss() - mem0, 0.)}
+
+
+def _run_isolated(q, case, nt, ny, nx, mask_fraction, repeat):
+    try:
+        q.put(_run_single(case, nt, ny, nx, mask_fraction, repeat))
+    except Exception as e:
+        q.put({'error': '%s: %s' % (e.__class__.__name__, str(e))})
+
+
+class PerformanceSuite(object):
+    """
+    performance tests of the hot paths of the Data class
+
+    Example
+    -------
+    S = PerformanceSuite(grids=['t63'], ntimes=[120])
+    res = S.run(outfile='perf.json')
+    regressions = S.compare(res, S.read('baseline.json'), threshold=0.2)
+    """
+
+    def __init__(self, grids=None, ntimes=None, mask_fractions=None,
+                 cases=None, repeat=3, max_elements=5.E7, isolate=True,
+                 timeout=3600.):
+        """
+        Parameters
+        ----------
+        grids : list
+            names of grids (see GRIDS) or tuples (ny, nx)
+        ntimes : list
+            numbers of timesteps
+        mask_fractions : list
+            fractions of masked grid cells [0...1]
+        cases : list
+            names of cases to run (see CASES); all if None
+        repeat : int
+            number of repetitions of each run; the minimum and median
+            runtime are reported
+        max_elements : float
+            configurations with more than max_elements data values
+            (nt*ny*nx) are skipped to limit the memory needed
+        isolate : bool
+            run each configuration in a separate process. This is
+            needed to measure the peak memory of each run
+        timeout : float
+            maximum runtime [s] of a configuration when run in a
+            separate process; the process is terminated afterwards
+            and the configuration is recorded as failed. No limit
+            if None
+        """
+        self.grids = grids if grids is not None else ['t63', '1deg', '05deg']
+        self.ntimes = ntimes if ntimes is not None else NTIMES
+        self.mask_fractions = mask_fractions if mask_fractions is not None else MASK_FRACTIONS
+        self.cases = cases if cases is not None else sorted(CASES.keys())
+        for c in self.cases:
+            if c not in CASES.keys():
+                raise ValueError('Invalid performance case: %s' % c)
+        self.repeat = repeat
+        self.max_elements = max_elements
+        self.isolate = isolate
+        self.timeout = timeout
+
+    def _get_grid(self, g):
+        if isinstance(g, tuple) or isinstance(g, list):
+            return 'x'.join([str(v) for v in g]), tuple(g)
+        if g not in GRIDS.keys():
+            raise ValueError('Invalid grid: %s' % g)
+        return g, GRIDS[g]
+
+    def configurations(self):
+        """
+        list of all configurations (case, grid, nt, mask_fraction)
+        which are run
+        """
+        r = []
+        for case in self.cases:
+            maxel = CASES[case][2]
+            temporal = CASES[case][3]
+            ntimes = sorted(self.ntimes)
+            if not temporal:
+                ntimes = ntimes[0:1]
+            for g in self.grids:
+                gname, (ny, nx) = self._get_grid(g)
+                for nt in ntimes:
+                    n = nt * ny * nx
+                    if (self.max_elements is not None) and (n > self.max_elements):
+                        continue
+                    if (maxel is not None) and (n > maxel):
+                        continue
+                    for f in self.mask_fractions:
+                        r.append((case, g, nt, f))
+        return r
+
+    def run_configuration(self, case, grid, nt, mask_fraction):
+        """
+        run a single configuration
+
+        Returns
+        -------
+        res : dict
+            result with the keys 'case', 'grid', 'nt', 'mask_fraction',
+            'time_min', 'time_median' [s] and 'memory_peak' [MB]. If
+            the separate process failed, was killed or exceeded the
+            timeout, the key 'error' is given instead of the timings
+        """
+        gname, (ny, nx) = self._get_grid(grid)
+        if self.isolate:
+            r = self._run_process(case, nt, ny, nx, mask_fraction)
+        else:
+            r = _run_single(case, nt, ny, nx, mask_fraction, self.repeat)
+        r.update({'case': case, 'grid': gname, 'nt': nt, 'mask_fraction': mask_fraction})
+        return r
+
+    def _run_process(self, case, nt, ny, nx, mask_fraction):
+        """
+        run a single configuration in a separate process
+
+        The queue is polled, so that a process which died without
+        sending a result (e.g. killed because out of memory) does not
+        block the suite.
+        """
+        q = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_run_isolated,
+                                    args=(q, case, nt, ny, nx, mask_fraction, self.repeat))
+        p.start()
+        t0 = timeit.default_timer()
+        r = None
+        while r is None:
+            try:
+                r = q.get(timeout=1.)
+            except Queue.Empty:
+                if not p.is_alive():
+                    try:  # result might have been sent just before exit
+                        r = q.get(timeout=1.)
+                    except Queue.Empty:
+                        break
+                elif (self.timeout is not None) and (timeit.default_timer() - t0 > self.timeout):
+                    p.terminate()
+                    p.join()
+                    return {'error': 'Timeout after %.1f s' % self.timeout}
+        p.join()
+        if r is None:
+            return {'error': 'Process exited with code %s without result' % p.exitcode}
+        if p.exitcode != 0:
+            return {'error': 'Process exited with code %s' % p.exitcode}
+        return r
+
+    def run(self, outfile=None, verbose=True):
+        """
+        run all configurations
+
+        Parameters
+        ----------
+        outfile : str
+            name of JSON file to write the results to
+        verbose : bool
+            print progress
+
+        Returns
+        -------
+        res : dict
+            dictionary with information on the environment ('info')
+            and a list of the results of all runs ('results'); failed
+            runs have the key 'error' (see run_configuration())
+        """
+        res = {'info': {'pycmbs': _get_version(), 'numpy': np.__version__,
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'repeat': self.repeat},
+               'results': []}
+        for case, grid, nt, f in self.configurations():
+            r = self.run_configuration(case, grid, nt, f)
+            if verbose:
+                if 'error' in r.keys():
+                    print('%-20s %-8s nt=%-6i mask=%4.2f  FAILED: %s' %
+                          (case, r['grid'], nt, f, r['error']))
+                else:
+                    print('%-20s %-8s nt=%-6i mask=%4.2f  %9.4f s  %8.1f MB' %
+                          (case, r['grid'], nt, f, r['time_min'], r['memory_peak']))
+            res['results'].append(r)
+        if outfile is not None:
+            self.write(res, outfile)
+        return res
+
+    def write(self, res, outfile):
+        """ write results to JSON file """
+        o = open(outfile, 'w')
+        json.dump(res, o, indent=1, sort_keys=True)
+        o.close()
+
+    def read(self, filename):
+        """ read results from JSON file """
+        if not os.path.exists(filename):
+            raise ValueError('File with performance results not existing: %s' % filename)
+        f = open(filename, 'r')
+        res = json.load(f)
+        f.close()
+        return res
+
+    def compare(self, res, baseline, threshold=0.2, memory_threshold=None, min_time=0.01):
+        """
+        compare results against a baseline
+
+        Parameters
+        ----------
+        res : dict
+            results of run()
+        baseline : dict
+            results of an earlier run()
+        threshold : float
+            relative increase of the runtime which is considered a
+            regression, e.g. 0.2 for 20%
+        memory_threshold : float
+            relative increase of the peak memory which is considered
+            a regression; the same as threshold if None
+        min_time : float
+            runtimes [s] below this value are not compared, as these
+            are dominated by noise
+
+        Returns
+        -------
+        regressions : list
+            list of dictionaries with the configuration, the quantity
+            ('time' or 'memory'), the baseline and the actual value.
+            Failed runs are not compared
+        """
+        if memory_threshold is None:
+            memory_threshold = threshold
+
+        def _key(r):
+            return (r['case'], r['grid'], r['nt'], r['mask_fraction'])
+
+        ref = dict([(_key(r), r) for r in baseline['results']])
+        regressions = []
+        for r in res['results']:
+            k = _key(r)
+            if k not in ref.keys():
+                continue
+            b = ref[k]
+            if ('error' in r.keys()) or ('error' in b.keys()):
+                continue
+            if max(r['time_min'], b['time_min']) >= min_time:
+                if r['time_min'] > b['time_min'] * (1. + threshold):
+                    regressions.append({'case': k[0], 'grid': k[1], 'nt': k[2], 'mask_fraction': k[3],
+                                        'quantity': 'time', 'baseline': b['time_min'], 'actual': r['time_min']})
+            if (b['memory_peak'] > 1.) and (r['memory_peak'] > b['memory_peak'] * (1. + memory_threshold)):
+                regressions.append({'case': k[0], 'grid': k[1], 'nt': k[2], 'mask_fraction': k[3],
+                                    'quantity': 'memory', 'baseline': b['memory_peak'], 'actual': r['memory_peak']})
+        return regressions
+
+
+def _split(s, dtype=str):
+    if s is None:
+        return None
+    return [dtype(v) for v in s.split(',') if v.strip() != '']
+
+
+def main(argv=None):
+    """
+    command line interface; returns 1 if runs failed or regressions
+    were found
+    """
+    parser = optparse.OptionParser(usage='python -m pycmbs.performance [options]')
+    parser.add_option('-g', '--grids', default='t63', help='grids, comma separated [%s]' % ','.join(sorted(GRIDS.keys())))
+    parser.add_option('-n', '--ntimes', default='120,1200', help='numbers of timesteps, comma separated')
+    parser.add_option('-m', '--mask-fractions', default='0.,0.3', help='fractions of masked grid cells, comma separated')
+    parser.add_option('-c', '--cases', default=None, help='cases, comma separated [%s]' % ','.join(sorted(CASES.keys())))
+    parser.add_option('-r', '--repeat', default=3, type='int', help='number of repetitions')
+    parser.add_option('--max-elements', default=5.E7, type='float', help='skip configurations with more data values')
+    parser.add_option('-o', '--output', default=None, help='JSON file for results')
+    parser.add_option('-b', '--baseline', default=None, help='JSON file with baseline results to compare against')
+    parser.add_option('-t', '--threshold', default=0.2, type='float', help='relative increase considered as regression')
+    parser.add_option('--timeout', default=3600., type='float', help='maximum runtime of a configuration [s]')
+    (opts, args) = parser.parse_args(argv)
+
+    S = PerformanceSuite(grids=_split(opts.grids), ntimes=_split(opts.ntimes, int),
+                         mask_fractions=_split(opts.mask_fractions, float),
+                         cases=_split(opts.cases), repeat=opts.repeat,
+                         max_elements=opts.max_elements, timeout=opts.timeout)
+    res = S.run(outfile=opts.output)
+    failed = [r for r in res['results'] if 'error' in r.keys()]
+
+    if opts.baseline is not None:
+        regressions = S.compare(res, S.read(opts.baseline), threshold=opts.threshold)
+        for r in regressions:
+            print('REGRESSION %-20s %-8s nt=%-6i mask=%4.2f %-6s %10.4f -> %10.4f' %
+                  (r['case'], r['grid'], r['nt'], r['mask_fraction'], r['quantity'], r['baseline'], r['actual']))
+        if len(regressions) > 0:
+            return 1
+        print('No performance regressions found.')
+    if len(failed) > 0:
+        print('%i configurations failed.' % len(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
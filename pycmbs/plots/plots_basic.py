@@ -21,7 +21,7 @@ from matplotlib import pylab
 
 from matplotlib.patches import Polygon
 import matplotlib.path as mpath
-from matplotlib.collections import PatchCollection, LineCollection
+from matplotlib.collections import PatchCollection, LineCollection, PolyCollection
 import matplotlib.pylab as pl
 
 from mpl_toolkits.basemap import Basemap, shiftgrid
@@ -613,7 +613,8 @@ class ScatterPlot(object):
         """
         return (x - x.mean()) / x.std()
 
-    def plot(self, y, regress=True, fldmean=True, hexbin=False, **kwargs):
+    def plot(self, y, regress=True, fldmean=True, hexbin=False, density=False,
+             bins=200, chunksize=None, **kwargs):
         """
         add a dataset to the scatterplot and plot
         it. It also allows to perform a regression analysis
@@ -628,6 +629,18 @@ class ScatterPlot(object):
             show in scatterplot fldmean() values, else datapairs are copnstructed for each grid cell
         hexbin : bool
             generate a HEXBIN plot instead of a standard scatterplot
+        density : bool
+            plot the number of datapairs in bins (2D histogram) instead
+            of individual points. The data is processed in chunks of
+            timesteps and the statistics are calculated in a single
+            pass, thus this is suitable for millions of datapairs
+            (e.g. for each grid cell and day). kwargs are passed to
+            imshow()
+        bins : int or tuple
+            number of bins for the density plot (nx,ny)
+        chunksize : int
+            number of timesteps processed at once for the density plot;
+            chosen automatically if None
         """
 
         if y.label is None:
@@ -635,6 +648,10 @@ class ScatterPlot(object):
         else:
             label = y.label + ''
 
+        if density:
+            return self._plot_density(y, label, regress=regress, fldmean=fldmean,
+                                      bins=bins, chunksize=chunksize, **kwargs)
+
         if fldmean:
             xdat = self.x.fldmean()
             ydat = y.fldmean()
@@ -712,6 +729,106 @@ class ScatterPlot(object):
         else:
             return None
 
+    def _get_chunks(self, y, fldmean, chunksize):
+        """ generator of chunks of datapairs """
+        if fldmean:
+            yield self.x.fldmean(), y.fldmean()
+            return
+        if self.x.shape != y.shape:
+            print self.x.shape
+            print y.shape
+            raise ValueError('Invalid geometry between X and Y. fldmean=True option therefore not possible!')
+        xd = self.x.data
+        yd = y.data
+        if xd.ndim < 3:
+            yield xd, yd
+            return
+        if chunksize is None:
+            chunksize = max(2 ** 20 // int(np.prod(xd.shape[1:])), 1)
+        for i in xrange(0, len(xd), chunksize):
+            yield xd[i:i + chunksize], yd[i:i + chunksize]
+
+    def _plot_density(self, y, label, regress=True, fldmean=True, bins=200,
+                      chunksize=None, **kwargs):
+        """
+        plot datapairs as 2D histogram; see plot() for details
+        """
+        from pycmbs.statistic import PairStatistics
+
+        # first pass: statistics and range of data
+        S = PairStatistics()
+        for xc, yc in self._get_chunks(y, fldmean, chunksize):
+            S.update(xc, yc)
+        if S.count() == 0:
+            raise ValueError('No valid datapairs for scatterplot!')
+
+        ox, oy, sx, sy = 0., 0., 1., 1.
+        if self.normalize:
+            ox, oy = S.mean_x[0], S.mean_y[0]
+            sx, sy = S.std()
+        x0, x1 = (S.min_x[0] - ox) / sx, (S.max_x[0] - ox) / sx
+        y0, y1 = (S.min_y[0] - oy) / sy, (S.max_y[0] - oy) / sy
+        if self.normalize:
+            S = PairStatistics()  # statistics of normalized data
+        if x1 <= x0:
+            x1 = x0 + 1.
+        if y1 <= y0:
+            y1 = y0 + 1.
+
+        # second pass: frequency distribution of datapairs
+        H = None
+        for xc, yc in self._get_chunks(y, fldmean, chunksize):
+            xc = np.ma.masked_invalid(np.ma.asarray(xc, dtype='float'))
+            yc = np.ma.masked_invalid(np.ma.asarray(yc, dtype='float'))
+            valid = ~(np.ma.getmaskarray(xc) | np.ma.getmaskarray(yc))
+            xv = (xc.data[valid] - ox) / sx
+            yv = (yc.data[valid] - oy) / sy
+            if self.normalize:
+                S.update(xv, yv)
+            h, ex, ey = np.histogram2d(xv, yv, bins=bins, range=[[x0, x1], [y0, y1]])
+            if H is None:
+                H = h
+            else:
+                H += h
+
+        if 'cmap' not in kwargs.keys():
+            kwargs.update({'cmap': 'Greys'})
+        im = self.ax.imshow(np.ma.masked_equal(H.T, 0.), origin='lower', extent=[x0, x1, y0, y1],
+                            aspect='auto', interpolation='nearest', **kwargs)
+
+        nval = S.count()
+        r_value = S.correlation()
+        p_value = S.pvalue()
+        slope, intercept = S.regression()
+        rms_error = S.rms()
+        bias, c_rms = S.centered_rms()
+        std_error = c_rms  # standard deviation of the differences
+        std_x, std_y = S.std()
+
+        if regress:
+            if p_value < 0.01:
+                spvalue = 'p < 0.01'
+            else:
+                spvalue = 'p=' + str(round(p_value, 2))
+            if r_value is not np.ma.masked:
+                label = '\n' + label + '\nr=' + str(round(r_value, 2)) + ', ' + spvalue + ', ' + 'rmsd: ' + str(rms_error) + ', N=' + str(int(nval)) + '\n' + 'y=' + str(slope) + 'x+' + str(intercept) + ''
+                l = self.ax.plot([x0, x1], [x0 * slope + intercept, x1 * slope + intercept], '--')[0]
+                self.lines.append(l)
+                self.labels.append(label)
+        self.ax.set_xlim(x0, x1)
+        self.ax.set_ylim(y0, y1)
+
+        if self.show_xlabel:
+            self.ax.set_xlabel(self.x._get_label(), size=self.ticksize)
+        self.ax.set_ylabel(y._get_unit(), size=self.ticksize)
+
+        self._change_ticklabels()
+
+        if regress:
+            return r_value, p_value, rms_error, c_rms, std_error, nval, std_x, std_y
+        else:
+            return None
+
     def _change_ticklabels(self):
         for tick in self.ax.xaxis.get_major_ticks():
             tick.label.set_fontsize(self.ticksize)
@@ -1282,30 +1399,28 @@ class HistogrammPlot(object):
             arguments for np.histogram function
         """
 
-        # check if Data object
-        if isinstance(X, Data):
-            x = X.data
-        else:
-            x = X
-
-        if isinstance(x, np.ma.masked_array):
-            x = x.data[~x.mask]
-
-        x = x[~np.isnan(x)]
-
         # REMOVE BINS ARGUMENT IF in kwargs, as global argument of class is used
         if 'bins' in kwargs.keys():
             bb = kwargs.pop('bins')
 
+        # calculate frequency distribution
+        if isinstance(X, Data):
+            # cached for the Data object
+            f, b, n = X.get_derived('_get_histogram', bins=self.bins, **kwargs)
+        else:
+            x = X
+            if isinstance(x, np.ma.masked_array):
+                x = x.data[~x.mask]
+            x = x[~np.isnan(x)]
+            n = len(x)
+            f, b = np.histogram(x, bins=self.bins, **kwargs)
+
         if shown or self.showN:
             show_legend = True
             if label == '':
-                label = 'n=' + str(sum(~np.isnan(x)))
+                label = 'n=' + str(n)
             else:
-                label = label + '(n=' + str(sum(~np.isnan(x))) + ')'
-
-        # calculate frequency distribution
-        f, b = np.histogram(x, bins=self.bins, **kwargs)
+                label = label + '(n=' + str(n) + ')'
         if self.normalize:
             f = f / float(sum(f))
             if self.percent:
@@ -1345,7 +1460,7 @@ class ZonalPlot(object):
         else:
             self.ax = ax
 
-    def plot(self, x, xlim=None, timmean=False, show_ylabel=True, label=''):
+    def plot(self, x, xlim=None, timmean=False, show_ylabel=True, label='', lat_bands=None):
         """
         plot zonal plot
 
@@ -1357,49 +1472,48 @@ class ZonalPlot(object):
             limits for the x-axis (e.g. values)
         timmean : bool
             temporal mean calculation
-        """
-
-        if not x._latitudecheckok:
-            print('WARNING: can not do zonal plot as not regular latitudes!')
-            return
-
-        # check if all latitudes are the same
-        lu = x.lat.mean(axis=1)
-        if any(abs(lu - x.lat[:, 0]) > 1.E-5):
-            print 'WARNING: latitudes are not unique!!!'
-            print lu.shape, x.lat.shape
-            print lu
-
-            print x.lat[:, 0]
-            print x.lat[:, 0] - lu
-            raise ValueError('Cannot work with NOT unique latitude values!')
+        lat_bands : ndarray
+            edges of latitude bands [deg]. If given, or if the latitudes
+            are not constant along the rows of the data (e.g. for
+            curvilinear grids), then the zonal statistics are calculated
+            for latitude bands (default: 2 degree bands)
+        """
+
+        if lat_bands is None:
+            # check if all latitudes are the same
+            regular = x._latitudecheckok and (x.lat.ndim == 2)
+            if regular:
+                lu = x.lat.mean(axis=1)
+                regular = not any(abs(lu - x.lat[:, 0]) > 1.E-5)
+            if not regular:
+                print('WARNING: latitudes are not unique! Zonal statistics are calculated for latitude bands')
+                lat_bands = np.arange(-90., 90.1, 2.)
 
         if timmean:
-            thex = x.timmean(return_object=True)
+            thex = x.get_derived('timmean', return_object=True)
         else:
             thex = x
 
         if self.dir == 'y':
-            dat = thex.get_zonal_mean()
+            dat = thex.get_derived('get_zonal_mean', lat_bands=lat_bands)
         else:
             raise ValueError('Invalid option')
 
-        # return dat
-        if timmean:
-            pass
+        if lat_bands is None:
+            zlat = x.lat[:, 0]
         else:
-            if dat.shape[x.data.ndim - 2] != x.lat.shape[0]:
-                print 'Inconsistent shapes!'
-                print dat.shape
-                print x.lat.shape
-                sys.exit()
+            zlat = 0.5 * (lat_bands[1:] + lat_bands[:-1])
+
+        if dat.shape[-1] != len(zlat):
+            print dat.shape, len(zlat)
+            raise ValueError('Inconsistent shapes!')
 
         # plot zonal statistics
         if dat.ndim == 1:
-            self.ax.plot(dat, x.lat[:, 0], label=label)
+            self.ax.plot(dat, zlat, label=label)
         elif dat.ndim == 2:
             for i in range(len(dat)):
-                self.ax.plot(dat[i, :], x.lat[:, 0], label='time=' + str(i))
+                self.ax.plot(dat[i, :], zlat, label='time=' + str(i))
                 self.ax.grid(b='on')
 
         self.ax.set_ylim(-90., 90.)
@@ -2288,38 +2402,69 @@ class GlecklerPlot(object):
         (NOTE: this is still E**2 !!!)
         """
 
-        if weights is None:
-            # set weights according to cell area
-            if x.cell_area is not None:
-                weights = x._get_weighting_matrix()
-            else:
-                print('WARNING: no weights when calculating performance index')
-                weights = np.ones(x.data.shape)
-        else:  # weights are given
-            if x.cell_area is not None:
-                print('WARNING: cell weights are given, while cell_area available from data!!')
+        from pycmbs.diagnostic import ReichlerIndex
+        R = ReichlerIndex(x, weights=weights, time_weighting=time_weighting)
 
-        from pycmbs.diagnostic import Diagnostic
-        D = Diagnostic(x, y=y)
-        # reichler performance index
-        # (might return a list if multiple times analyzed)
-        e2 = D.calc_reichler_index(weights)  # returns [time, index]
-        if e2 is not None:
-            e2 = np.ma.masked_where(np.isnan(e2), e2)
-
-        # Note that the returned value is E**2 for each timestep!
-        # When doing the normalization, one needs to take the sqrt(E++2)
-        # to obtain the actual RMSE
-        if e2 is None:
+        # Note that the E**2 for each timestep is aggregated
+        # as sqrt(E**2) to obtain the actual RMSE
+        r = R.calc_index(y)[0]
+        if r is np.ma.masked:
             return None
         else:
-            if time_weighting:
-                days = np.asarray(x._days_per_month())  # number of days for each month
-                wt = days / float(days.sum())  # weights for time
-            else:
-                wt = np.ones(len(e2)) / float(len(e2))
+            return r
 
-            return np.sqrt((e2 * wt).sum())
+    def calc_indices(self, x, Y, models, variable, weights=None, time_weighting=True, pos=1, index=None):
+        """
+        calculate model performance index for multiple models against
+        the same reference data in a single pass and add the results
+        for plotting. The models and the variable need to have been
+        registered already using add_model and add_variable
+
+        Parameters
+        ----------
+        x : Data
+            reference data (observation)
+        Y : list
+            list of Data objects to benchmark (e.g. models)
+        models : list
+            list with model names; same order as Y
+        variable : str
+            variable name
+        weights : ndarray
+            weights to be applied to the data before index
+            calculation; dedicated for spatial area weights
+        time_weighting : bool
+            weight timesteps by the number of days per month
+        pos : int
+            position where to plot data 1=top triangle, 2=lower triangle
+        index : ReichlerIndex
+            index which was already prepared for the reference data x;
+            allows to score models one after another without preparing
+            the reference again. If given, weights and time_weighting
+            are not used
+
+        Returns
+        -------
+        returns masked array with performance index for each model
+        """
+        if len(Y) != len(models):
+            raise ValueError('Number of models and model names differ!')
+        if len(Y) == 0:
+            return np.ma.array([])
+
+        from pycmbs.diagnostic import ReichlerIndex
+        if index is None:
+            R = ReichlerIndex(x, weights=weights, time_weighting=time_weighting)
+        else:
+            if index.x is not x:
+                raise ValueError('Index was prepared for different reference data!')
+            R = index
+        r = R.calc_index(Y)
+        for m, v in zip(models, r):
+            if v is np.ma.masked:
+                continue
+            self.add_data(variable, m, v, pos=pos)
+        return r
 
 #-----------------------------------------------------------------------
 
@@ -2608,7 +2753,7 @@ def map_season(x, figsize=(8, 6), **kwargs):
             else:
                 show_colorbar = True
 
-        d = x.copy()
+        d = x._copy_attributes(skip=['_data'])  # avoid copying all timesteps
         d.data = x.data[i, :, :]
         d.label = labels[i]
 
@@ -2632,6 +2777,58 @@ def map_season(x, figsize=(8, 6), **kwargs):
 #-----------------------------------------------------------------------
 
 
+def get_unstructured_collection(vlon, vlat, data, vmin=None, vmax=None, cmap='jet',
+                                basemap_object=None, edgecolors='grey'):
+    """
+    get a collection of polygons for plotting data of an unstructured
+    grid (e.g. ICON). All cells are contained in a single collection
+    which is generated from the vertex arrays without a loop over
+    the cells. Cells crossing the dateline are split.
+
+    Parameters
+    ----------
+    vlon : ndarray
+        longitudes of the vertices of the cells [ncell,nvertices]
+    vlat : ndarray
+        latitudes of the vertices of the cells [ncell,nvertices]
+    data : ndarray
+        data of each cell [ncell]; masked cells are not filled
+    vmin : float
+        minimum value for colorbar; data minimum if None
+    vmax : float
+        maximum value for colorbar; data maximum if None
+    cmap : str or colormap
+        colormap
+    basemap_object : Basemap
+        map to project the vertices with; the vertices are used
+        directly if None
+    edgecolors : str
+        color of the cell boundaries
+
+    Returns
+    -------
+    collection : PolyCollection
+    """
+    from pycmbs.grid import get_cell_polygons
+
+    verts, cells = get_cell_polygons(vlon, vlat)
+    if basemap_object is not None:
+        # all vertices are projected at once
+        xv, yv = basemap_object(verts[:, :, 0].ravel(), verts[:, :, 1].ravel())
+        verts = np.dstack([np.reshape(xv, verts.shape[0:2]), np.reshape(yv, verts.shape[0:2])])
+
+    pdata = np.ma.array(data, copy=False).ravel()
+    if vmin is None:
+        vmin = pdata.min()
+    if vmax is None:
+        vmax = pdata.max()
+
+    norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+    collection = PolyCollection(verts, cmap=cmap, norm=norm, alpha=1., edgecolors=edgecolors)
+    collection.set_array(pdata[cells])  # assign data values here
+    return collection
+
+
 def xx_map_plot(x, use_basemap=False, ax=None, cticks=None, region=None,
                 nclasses=10, cmap_data='jet',
                 title=None, regions_to_plot=None, logplot=False,
@@ -2764,57 +2961,6 @@ def xx_map_plot(x, use_basemap=False, ax=None, cticks=None, region=None,
 
     """
 
-    def _get_unstructured_collection(vlon, vlat, xm, vmin, vmax, basemap_object=None):
-        """
-        get collection of patches for plotting of unstructured grid
-
-        vlon,vlat : vertex lon/lat [ncells,npoints]
-        xm: mean field, generated by timmean function
-        """
-
-        #init
-        Path = mpath.Path
-        patches = []
-        pdata = xm[0, :] * 1.  # full list of data
-        vmsk = np.ones_like(pdata).astype('bool')  # mask to indicate which cells contain valid data
-
-        for i in xrange(x.ncell):
-            if np.any(vlon[i, :]) > 180.:  # todo fix this properly !!!
-                vmsk[i] = False
-                continue
-            if basemap_object is None:
-                xv = vlon[i, :]
-                yv = vlat[i, :]
-            else:
-                xv, yv = basemap_object(vlon[i, :], vlat[i, :])  # todo: how to properly deal with boundary problem ????
-            if (vlon[i, :].min() < -100.) & (vlon[i, :].max() > 100.):  # todo
-                #... triangles across the boundaries of the projection are a problem
-                # ... solution: generate two triangles ! TODO
-                vmsk[i] = False
-                continue
-
-            verts = np.asarray([xv, yv]).T
-
-            #--- specify how vertices are interconnected (here simple connection by lines)
-            codes = [Path.MOVETO, Path.LINETO, Path.LINETO]
-
-            #--- construct object and append to library of objects ---
-            path = mpath.Path(verts, codes, closed=True)
-            patches.append(mpatches.PathPatch(path))
-
-        pdata = np.asarray(pdata)
-
-        if vmin is None:
-            vmin = pdata.min()
-        if vmax is None:
-            vmax = pdata.max()
-
-        norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
-        collection = PatchCollection(patches, cmap=cmap, norm=norm, alpha=1., match_original=False, edgecolors='grey')  # construct library of all objects
-        collection.set_array(pdata[vmsk])  # assign data values here
-
-        return collection
-
     if savegraphicfile is not None:
         savegraphicfile = savegraphicfile.replace(' ', '_')
 
@@ -2963,7 +3109,8 @@ def xx_map_plot(x, use_basemap=False, ax=None, cticks=None, region=None,
                 raise ValueError('Plotting for unstructured grid not possible, as VLAT attribute missing!')
 
             #--- generate collection of patches for Basemap plot
-            collection = _get_unstructured_collection(x.vlon, x.vlat, xm, vmin, vmax, basemap_object=m1)
+            collection = get_unstructured_collection(x.vlon, x.vlat, xm[0, :], vmin=vmin, vmax=vmax,
+                                                     cmap=cmap, basemap_object=m1)
 
         else:  # unstructured gridtype
 
@@ -3093,7 +3240,8 @@ def xx_map_plot(x, use_basemap=False, ax=None, cticks=None, region=None,
 
         if x.gridtype == 'unstructured':
             #--- generate collection of patches for Basemap plot
-            collection = _get_unstructured_collection(x.vlon, x.vlat, xm, vmin, vmax, basemap_object=None)
+            collection = get_unstructured_collection(x.vlon, x.vlat, xm[0, :], vmin=vmin, vmax=vmax,
+                                                     cmap=cmap, basemap_object=None)
             im1 = ax.add_collection(collection)
             ax.set_xlim(max(x.vlon.min(), -180.), min(x.vlon.max(), 180.))
             ax.set_ylim(max(x.vlat.min(), -90.), min(x.vlat.max(), 90.))
@@ -3592,10 +3740,6 @@ def map_difference(x, y, dmin=None, dmax=None, use_basemap=False,
     #--- get colormap
     cmap = plt.cm.get_cmap(cmap_data, nclasses)
 
-    #- temporal mean fields
-    xm = x.timmean()
-    ym = y.timmean()
-
     #proj='robin'; lon_0=0.; lat_0=0.
 
     #- plot first dataset
@@ -3648,7 +3792,9 @@ def map_difference(x, y, dmin=None, dmax=None, use_basemap=False,
 
     # first minus second dataset (absolute difference)
     # the temporal mean is calculated here as this allows to use also datasets with different numbers of timesteps
-    adif = x.timmean(return_object=True).sub(y.timmean(return_object=True))
+    # the temporal means are cached and thus only calculated once for all panels
+    xm = x.get_derived('timmean', return_object=True)
+    adif = xm.sub(y.get_derived('timmean', return_object=True))
 
     if savefile is None:
         tmpoutname = None
@@ -3674,10 +3820,10 @@ def map_difference(x, y, dmin=None, dmax=None, use_basemap=False,
                  drawparallels=drawparallels, savegraphicfile=graphic_name)
 
     # relative error
-    rdat = adif.div(x.timmean(return_object=True))
+    rdat = adif.div(xm)
     rdat.unit = '-'
     if absthres is not None:
-        mask = abs(x.timmean()) < absthres
+        mask = abs(xm.data) < absthres
         rdat._apply_mask(~mask)
 
     if savefile is None:
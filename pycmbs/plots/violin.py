@@ -8,11 +8,18 @@ COPYRIGHT.md
 import matplotlib.pyplot as plt
 import numpy as np
 
+from pycmbs.statistic import binned_kde
+
 
 class ViolinPlot(object):
     """
     generate ViolinPlot
 
+    The densities are estimated using a binned gaussian kernel density
+    estimate (see statistic.binned_kde), thus the costs of plotting are
+    (nearly) independent of the size of the samples. Optionally weights
+    (e.g. cell areas) can be provided for the samples.
+
     References
     ----------
     inspired by
@@ -23,7 +30,7 @@ class ViolinPlot(object):
     """
 
     def __init__(self, data, data2=None, labels=None, ax=None,
-                 boxplot=True, figsize=(10, 6)):
+                 boxplot=True, figsize=(10, 6), weights=None, weights2=None):
         """
         Parameters
         ----------
@@ -42,9 +49,17 @@ class ViolinPlot(object):
             plot boxplot
         figsize : tuple
             figure size
+        weights : ndarray/dict
+            weights for data (e.g. cell areas). Same structure and
+            geometry as data. If None, then all samples have the same
+            weight
+        weights2 : ndarray/dict
+            weights for data2
         """
         self.data = data
         self.data2 = data2
+        self.weights = weights
+        self.weights2 = weights2
         if labels is None:
             self.labels = range(len(self.data))
         else:
@@ -96,7 +111,20 @@ class ViolinPlot(object):
             self._plot_two_sided()
         self._set_xticks()
 
-    def _plot_half_violin(self, data, pos, left=False, **kwargs):
+    def _get_item(self, data, pos, key):
+        """
+        get data of a group from a list/array or dict
+        """
+        if data is None:
+            return None
+        if isinstance(data, dict):
+            if key in data.keys():
+                return data[key]
+            else:
+                return None
+        return data[pos]
+
+    def _plot_half_violin(self, data, pos, left=False, weights=None, **kwargs):
         """
         plot half violin
         inspired by [4]
@@ -109,15 +137,17 @@ class ViolinPlot(object):
             position
         left : bool
             specifies if the plot should be on the left side
+        weights : ndarray
+            weights for the data
         """
-        from scipy.stats import gaussian_kde
-
         if len(data) < 2:
             return None
+        if np.min(data) == np.max(data):  # no distribution to be estimated
+            return None
         amplitude = kwargs.pop('amplitude', 0.33)
-        x = np.linspace(min(data), max(data), 101)
+        x = np.linspace(np.min(data), np.max(data), 101)
 
-        v = gaussian_kde(data).evaluate(x)
+        x, v = binned_kde(data, x=x, weights=weights)
         v = v / v.max() * amplitude * (1 if left else -1)
         kwargs.setdefault('facecolor', 'r')
         kwargs.setdefault('alpha', 0.33)
@@ -137,6 +167,7 @@ class ViolinPlot(object):
         """
 
         data2 = self.data2 if self.data2 is not None else self.data
+        weights2 = self.weights2 if self.data2 is not None else self.weights
 
         if self.labels is not None:
             labels = self.labels
@@ -147,34 +178,19 @@ class ViolinPlot(object):
         self.labels = labels
 
         for pos, key in zip(positions, labels):
-            #~ print type(self.data)
-            #~ print type(data2)
-            #~ print data2.keys()
-
-            if isinstance(self.data, dict):
-                if key in self.data.keys():
-                    d1 = self.data[key]
-                else:
-                    d1 = None
-            else:
-                d1 = self.data[pos]
-            if isinstance(data2, dict):
-                # in case that data is a dict
-                if key in data2.keys():
-                    d2 = data2[key]
-                else:
-                    d2 = None
-            else:
-                d2 = data2[pos]
+            d1 = self._get_item(self.data, pos, key)
+            d2 = self._get_item(data2, pos, key)
+            w1 = self._get_item(self.weights, pos, key)
+            w2 = self._get_item(weights2, pos, key)
 
             if self.data is not data2:
                 color2 = 'r'
 
             # generate plot
             if d1 is not None:
-                self._plot_half_violin(d1, pos, left=False, facecolor=color1)
+                self._plot_half_violin(d1, pos, left=False, weights=w1, facecolor=color1)
             if d2 is not None:
-                self._plot_half_violin(d2, pos, left=True, facecolor=color2)
+                self._plot_half_violin(d2, pos, left=True, weights=w2, facecolor=color2)
 
             # division line between the two half
             if (d1 is not None) and (d2 is not None):
@@ -205,17 +221,15 @@ class ViolinPlot(object):
         alpha : float
             alpha value for area fill
         """
-        from scipy.stats import gaussian_kde
         pos = self._get_positions()
         dist = max(pos) - min(pos)
         w = min(0.15 * max(dist, 1.0), 0.5)
-        for d, p in zip(self.data, pos):
-            if not np.all(d == 0.):  # avoid singular matrices
-                k = gaussian_kde(d)  # calculates the kernel density
-                m = k.dataset.min()  # lower bound of violin
-                M = k.dataset.max()  # upper bound of violin
+        for i, (d, p) in enumerate(zip(self.data, pos)):
+            if len(d) > 1 and np.min(d) < np.max(d):  # avoid singular distributions
+                m = np.min(d)  # lower bound of violin
+                M = np.max(d)  # upper bound of violin
                 x = np.arange(m, M, (M - m) / 100.)  # support for violin
-                v = k.evaluate(x)  # violin profile (density curve)
+                x, v = binned_kde(d, x=x, weights=self._get_item(self.weights, i, None))  # violin profile (density curve)
                 v = v / v.max() * w  # scaling the violin to the available space
                 self.ax.fill_betweenx(x, p, v + p, facecolor='y', alpha=alpha)
                 self.ax.fill_betweenx(x, p, -v + p, facecolor='y', alpha=alpha)
@@ -230,7 +244,7 @@ class ViolinPlotBins(ViolinPlot):
     each group of data, this class allows to plot binned data
     """
 
-    def __init__(self, data, data2=None, bins=None, **kwargs):
+    def __init__(self, data, data2=None, bins=None, weights=None, weights2=None, **kwargs):
         """
         Parameters
         ----------
@@ -247,6 +261,10 @@ class ViolinPlotBins(ViolinPlot):
             -1 <= x < 2
             2 <= x < 5
             x > 5  TODO perhaps also with an upper limit to be provided by user?
+        weights : ndarray
+            weights for data (e.g. cell areas); same geometry as data
+        weights2 : ndarray
+            weights for data2
         """
         self.bins = bins
         self._check_bins()
@@ -254,6 +272,8 @@ class ViolinPlotBins(ViolinPlot):
             raise ValueError('ERROR: labels can not be provided for this class!')
         super(ViolinPlotBins, self).__init__(self._remap_data(data),
                                              self._remap_data(data2), labels=self._remap_labels(),
+                                             weights=self._remap_weights(data, weights),
+                                             weights2=self._remap_weights(data2, weights2),
                                              **kwargs)
 
     def _remap_labels(self):
@@ -262,7 +282,7 @@ class ViolinPlotBins(ViolinPlot):
         """
         return ['>=' + str(b) for b in self.bins]
 
-    def _remap_data(self, x, bins=None):
+    def _remap_data(self, x, bins=None, values=None):
         """
         Remap and bin data.
         Flattens the data and then stores
@@ -273,6 +293,10 @@ class ViolinPlotBins(ViolinPlot):
             data array (will be flattened)
         bins : ndarray
             see documentation of class
+        values : ndarray
+            if given, then these values (e.g. weights) are remapped
+            according to the bins of x instead of x itself.
+            Same geometry as x
 
         Returns
         -------
@@ -280,16 +304,34 @@ class ViolinPlotBins(ViolinPlot):
             of structure [nbins, data_per_bin]
         """
         self._check_bins()
+        if x is None:
+            return None
 
         x = x.flatten()
-        print x.min(), x.max()
-        data = []  # TODO this is slow how to do better?
-        for i in xrange(len(self.bins) - 1):
-            lb = self.bins[i]
-            ub = self.bins[i + 1]
-            data.append(x[(x >= lb) & (x < ub)])
-        data.append(x[(x >= ub)])
-        return data
+        if values is None:
+            v = x
+        else:
+            if np.size(values) != np.size(x):
+                raise ValueError('ERROR: invalid geometry of values!')
+            v = np.asarray(values).flatten()
+
+        # sort once by bin; values below the first bin are not used
+        xd = np.ma.getdata(x)
+        with np.errstate(invalid='ignore'):
+            idx = np.searchsorted(self.bins, xd, side='right') - 1
+            idx[~(xd >= self.bins[0]) | np.ma.getmaskarray(x)] = -1
+        o = np.argsort(idx, kind='mergesort')
+        bounds = np.searchsorted(idx[o], np.arange(len(self.bins) + 1))
+        v = v[o]
+        return [v[bounds[i]:bounds[i + 1]] for i in xrange(len(self.bins))]
+
+    def _remap_weights(self, x, weights):
+        """
+        remap weights according to the bins of the data x
+        """
+        if weights is None:
+            return None
+        return self._remap_data(x, values=weights)
 
     def _check_bins(self):
         if self.bins is None:
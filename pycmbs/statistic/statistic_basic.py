@@ -147,3 +147,563 @@ def welchs_approximate_ttest(n1, mean1, sem1, n2, mean2, sem2, alpha):
     t_alpha_prime = (t_alpha_df1 * sem1 ** 2 + t_alpha_df2 * sem2 ** 2) /\
                     (sem1 ** 2 + sem2 ** 2)
     return abs(t_s_prime) > t_alpha_prime, t_s_prime, t_alpha_prime
+
+
+def _search_columns(keys, q):
+    """
+    perform a searchsorted for each column of an array at once
+
+    Parameters
+    ----------
+    keys : ndarray
+        array [M,ncol] which is sorted in ascending order in each
+        column; all values need to be finite
+    q : ndarray
+        values to search for [P,ncol]
+
+    Returns
+    -------
+    cnt : ndarray
+        number of keys of a column which are <= q [P,ncol]
+    """
+    M, ncol = keys.shape
+    lo = np.minimum(keys.min(), q.min())
+    span = np.maximum(keys.max(), q.max()) - lo + 1.
+    off = np.arange(ncol) * span
+    k = (keys - lo + off[np.newaxis, :]).T.flatten()
+    s = (q - lo + off[np.newaxis, :]).T.flatten()
+    cnt = np.searchsorted(k, s, side='right').reshape((ncol, len(q))).T
+    return cnt - (np.arange(ncol) * M)[np.newaxis, :]
+
+
+def quantiles(x, prob, alphap=.4, betap=.4):
+    """
+    calculate multiple quantiles along the first axis of an array
+    using a single sort for all quantiles
+
+    The quantiles are defined like in scipy.stats.mstats.mquantiles
+    (Q(p) = (1-gamma)*x[j] + gamma*x[j+1], with plotting positions
+    defined by alphap and betap) and the results are identical.
+    Masked values and NaN are ignored.
+
+    Parameters
+    ----------
+    x : ndarray
+        data [n,...]
+    prob : list
+        list of quantiles to compute [0...1]
+    alphap : float
+        plotting positions parameter
+    betap : float
+        plotting positions parameter
+
+    Returns
+    -------
+    res : ndarray
+        masked array with quantiles [len(prob),...]; masked where
+        no valid data is available
+    """
+    p = np.asarray(prob, dtype='float').flatten()
+    if np.any(p < 0.) or np.any(p > 1.):
+        raise ValueError('Quantiles need to be within [0,1]')
+
+    x = np.ma.masked_invalid(np.ma.asarray(x, dtype='float'))
+    shape = x.shape[1:]
+    nt = len(x)
+    x = x.reshape((nt, -1))
+    n = x.count(axis=0)
+    v = np.sort(np.ma.filled(x, np.inf), axis=0)  # invalid data at the end
+
+    m = alphap + p * (1. - alphap - betap)
+    aleph = n[np.newaxis, :] * p[:, np.newaxis] + m[:, np.newaxis]
+    k = np.floor(np.clip(aleph, 1., np.maximum(n - 1, 1)[np.newaxis, :])).astype('int')
+    gamma = np.clip(aleph - k, 0., 1.)
+    gamma[:, n == 1] = 0.
+    k = np.minimum(k, np.maximum(nt - 1, 1))
+    cols = np.arange(x.shape[1])[np.newaxis, :]
+    if nt > 1:
+        res = (1. - gamma) * v[k - 1, cols] + gamma * np.where(gamma > 0., v[k, cols], 0.)
+    else:
+        res = v[np.zeros_like(k), cols]
+    res = np.ma.array(res, mask=(n == 0)[np.newaxis, :] * np.ones(len(p), dtype='bool')[:, np.newaxis])
+    return res.reshape((len(p),) + shape)
+
+
+def kde_bandwidth(n, std, bw_method='scott'):
+    """
+    bandwidth of a gaussian kernel density estimate of 1D data
+
+    The rules are the same as in scipy.stats.gaussian_kde
+
+    Parameters
+    ----------
+    n : float
+        (effective) number of samples
+    std : float
+        standard deviation of the samples
+    bw_method : str or float
+        'scott', 'silverman' or a scalar factor
+    """
+    if bw_method == 'scott':
+        factor = n ** (-1. / 5.)
+    elif bw_method == 'silverman':
+        factor = (n * 3. / 4.) ** (-1. / 5.)
+    elif np.isscalar(bw_method) and not isinstance(bw_method, str):
+        factor = float(bw_method)
+    else:
+        raise ValueError('Invalid bandwidth method: %s' % str(bw_method))
+    return factor * std
+
+
+def binned_kde(data, x=None, weights=None, bw_method='scott', gridsize=512):
+    """
+    gaussian kernel density estimate of 1D data using linear binning
+    and FFT convolution
+
+    The data is first binned linearly onto a regular grid, which is then
+    convolved with the gaussian kernel using FFT. The costs of the
+    convolution and of the evaluation of the density are therefore
+    independent of the number of samples. The bandwidth is the same as
+    for scipy.stats.gaussian_kde, for weighted data the effective number
+    of samples and the weighted (unbiased) standard deviation are used.
+
+    Parameters
+    ----------
+    data : ndarray
+        samples; masked and invalid values are ignored
+    x : ndarray
+        positions to evaluate the density at. If None, then 101 points
+        between the minimum and maximum of the data are used
+    weights : ndarray
+        weights of each sample, e.g. cell areas. Same geometry as data
+    bw_method : str or float
+        'scott', 'silverman' or a scalar factor for the bandwidth
+    gridsize : int
+        minimum number of grid points; the grid is refined if needed
+        to resolve the kernel
+
+    Returns
+    -------
+    x : ndarray
+        positions
+    density : ndarray
+        probability density at x
+    """
+    d = np.ma.masked_invalid(np.ma.asarray(data, dtype='float')).flatten()
+    if weights is None:
+        w = np.ones(d.shape)
+    else:
+        if np.shape(weights) != np.shape(data):
+            raise ValueError('Weights need to have the same geometry as the data')
+        w = np.ma.filled(np.ma.asarray(weights, dtype='float'), 0.).flatten()
+    valid = ~np.ma.getmaskarray(d) & np.isfinite(w) & (w > 0.)
+    d = d.data[valid]
+    w = w[valid]
+    if len(d) < 2:
+        raise ValueError('Kernel density estimate needs at least two samples')
+
+    sw = w.sum()
+    sw2 = np.sum(w * w)
+    mean = np.sum(w * d) / sw
+    var = np.sum(w * (d - mean) ** 2) / (sw - sw2 / sw)
+    if not var > 0.:
+        raise ValueError('Kernel density estimate not possible for data without variance')
+    h = kde_bandwidth(sw * sw / sw2, np.sqrt(var), bw_method=bw_method)
+
+    dmin = d.min()
+    dmax = d.max()
+    if x is None:
+        x = np.linspace(dmin, dmax, 101)
+    x = np.asarray(x, dtype='float')
+
+    # regular grid covering the data and the tails of the kernel
+    lo = dmin - 4. * h
+    hi = dmax + 4. * h
+    M = max(int(gridsize), min(int(np.ceil((hi - lo) / (h / 4.))) + 1, 2 ** 16))
+    dx = (hi - lo) / (M - 1)
+    grid = lo + np.arange(M) * dx
+
+    # linear binning
+    t = (d - lo) / dx
+    i = np.minimum(np.floor(t).astype('int'), M - 2)
+    f = t - i
+    c = np.bincount(i, weights=w * (1. - f), minlength=M)
+    c += np.bincount(i + 1, weights=w * f, minlength=M)
+
+    # convolution with the kernel (zero padded FFT)
+    L = min(int(np.ceil(5. * h / dx)), M - 1)
+    k = np.exp(-0.5 * (np.arange(-L, L + 1) * dx / h) ** 2)
+    k /= k.sum() * dx
+    P = 2 ** int(np.ceil(np.log2(M + 2 * L + 1)))
+    conv = np.fft.irfft(np.fft.rfft(c, P) * np.fft.rfft(k, P), P)[L:L + M]
+    density = np.maximum(conv, 0.) / sw
+
+    return x, np.interp(x, grid, density, left=0., right=0.)
+
+
+class QuantileSketch(object):
+    """
+    mergeable approximate quantile summary for each element (e.g. grid
+    cell) of a field
+
+    The sketch allows to estimate quantiles from data which is
+    processed chunk by chunk, e.g. timesteps of files which are too
+    large to be kept in memory. For each element a weighted summary of
+    at most 'size' points is kept. As long as less than 2*size values
+    were added, the results are exact and identical to quantiles().
+    Otherwise the summary is compressed to points of equal weight
+    (equi-depth summary) and the results are approximate. The
+    minimum and maximum are always exact.
+
+    Sketches of different chunks can be combined using merge().
+
+    Example
+    -------
+    S = QuantileSketch((ny, nx))
+    for f in files:
+        S.update(Data(f, 'tas', read=True).data)
+    p5, p50, p95 = S.quantiles([0.05, 0.5, 0.95])
+    """
+
+    def __init__(self, shape, size=200):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            geometry of a single field, e.g. (ny,nx)
+        size : int
+            number of points of the summary of each element. The
+            larger, the more accurate the results
+        """
+        self.shape = tuple(shape)
+        self.size = size
+        n = int(np.prod(self.shape))
+        self.values = np.zeros((0, n))
+        self.weights = np.zeros((0, n))
+        self.min = np.ones(n) * np.inf
+        self.max = np.ones(n) * -np.inf
+
+    def _add(self, values, weights):
+        """ add weighted values to the summary and compress if needed """
+        v = np.vstack([self.values, values])
+        w = np.vstack([self.weights, weights])
+        v[w == 0.] = np.inf  # entries without weight at the end
+        o = np.argsort(v, axis=0, kind='mergesort')
+        cols = np.arange(v.shape[1])[np.newaxis, :]
+        v = v[o, cols]
+        w = w[o, cols]
+
+        if len(v) > 2 * self.size:
+            v, w = self._compress(v, w)
+        else:
+            # remove entries which are not used by any element
+            nmax = (w > 0.).sum(axis=0).max()
+            v = v[0:nmax]
+            w = w[0:nmax]
+        self.values = v
+        self.weights = w
+
+    def _compress(self, v, w):
+        """ compress a sorted summary to self.size points of equal weight """
+        T = w.sum(axis=0)
+        W = np.cumsum(w, axis=0)
+        r = (np.arange(self.size) + 0.5)[:, np.newaxis] / float(self.size) * T[np.newaxis, :]
+        idx = np.minimum(_search_columns(W, r), len(v) - 1)
+        cols = np.arange(v.shape[1])[np.newaxis, :]
+        nv = v[idx, cols]
+        nw = np.ones(nv.shape) * (T / float(self.size))[np.newaxis, :]
+        nv[nw == 0.] = np.inf
+        return nv, nw
+
+    def update(self, x):
+        """
+        add data to the sketch
+
+        Parameters
+        ----------
+        x : ndarray
+            data [n,...] where the trailing dimensions correspond to
+            the geometry of the sketch; masked values and NaN are ignored
+        """
+        x = np.ma.masked_invalid(np.ma.asarray(x, dtype='float'))
+        if x.shape[1:] != self.shape:
+            if x.shape == self.shape:  # single field
+                x = x.reshape((1,) + self.shape)
+            else:
+                print x.shape, self.shape
+                raise ValueError('Geometry of data does not match the sketch!')
+        x = x.reshape((len(x), -1))
+        if len(x) == 0:
+            return
+        valid = ~np.ma.getmaskarray(x)
+        self.min = np.minimum(self.min, np.ma.filled(x.min(axis=0), np.inf))
+        self.max = np.maximum(self.max, np.ma.filled(x.max(axis=0), -np.inf))
+        self._add(np.ma.filled(x, np.inf), valid.astype('float'))
+
+    def merge(self, other):
+        """
+        merge another sketch of the same geometry into this sketch
+
+        Parameters
+        ----------
+        other : QuantileSketch
+            sketch to merge
+        """
+        if other.shape != self.shape:
+            raise ValueError('Geometry of sketches is different!')
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self._add(other.values, other.weights)
+
+    def count(self):
+        """ number of valid values for each element """
+        return self.weights.sum(axis=0).reshape(self.shape)
+
+    def quantiles(self, prob, alphap=.4, betap=.4):
+        """
+        estimate quantiles; see quantiles() for the definition
+
+        Parameters
+        ----------
+        prob : list
+            list of quantiles to compute [0...1]
+
+        Returns
+        -------
+        res : ndarray
+            masked array with quantiles [len(prob),...]
+        """
+        p = np.asarray(prob, dtype='float').flatten()
+        if np.any(p < 0.) or np.any(p > 1.):
+            raise ValueError('Quantiles need to be within [0,1]')
+        nc = self.values.shape[1]
+        T = self.weights.sum(axis=0)
+        if len(self.values) == 0:
+            return np.ma.array(np.zeros((len(p),) + self.shape), mask=True)
+
+        # plotting position of each point; a point of weight w covers
+        # the ranks W-w+1 ... W
+        W = np.cumsum(self.weights, axis=0)
+        valid = self.weights > 0.
+        pos = W - 0.5 * (self.weights - 1.)
+        nvalid = valid.sum(axis=0)
+        first = pos[0]
+        last = pos[np.maximum(nvalid - 1, 0), np.arange(nc)]
+        pos = np.where(valid, pos, last[np.newaxis, :] + 1.)  # keep columns ascending
+
+        m = alphap + p * (1. - alphap - betap)
+        aleph = np.clip(T[np.newaxis, :] * p[:, np.newaxis] + m[:, np.newaxis], 1., np.maximum(T, 1.)[np.newaxis, :])
+        q = np.clip(aleph, first[np.newaxis, :], last[np.newaxis, :])
+
+        j = np.clip(_search_columns(pos, q), 1, np.maximum(nvalid, 1)[np.newaxis, :])
+        lower = j - 1
+        upper = np.minimum(j, np.maximum(nvalid - 1, 0)[np.newaxis, :])
+        cols = np.arange(nc)[np.newaxis, :]
+        dp = pos[upper, cols] - pos[lower, cols]
+        g = np.where(dp > 0., (q - pos[lower, cols]) / np.where(dp > 0., dp, 1.), 0.)
+        vl = self.values[lower, cols]
+        vu = np.where(g > 0., self.values[upper, cols], 0.)
+        res = (1. - g) * vl + g * vu
+
+        # ranks outside of the summary points are interpolated towards
+        # the exact minimum (rank 1) and maximum (rank T)
+        v0 = self.values[0]
+        vn = self.values[np.maximum(nvalid - 1, 0), np.arange(nc)]
+        d0 = np.maximum(first - 1., 0.)[np.newaxis, :]
+        dn = np.maximum(T - last, 0.)[np.newaxis, :]
+        g0 = np.where(d0 > 0., (first[np.newaxis, :] - aleph) / np.where(d0 > 0., d0, 1.), 0.)
+        gn = np.where(dn > 0., (aleph - last[np.newaxis, :]) / np.where(dn > 0., dn, 1.), 0.)
+        res = np.where(aleph < first[np.newaxis, :], (1. - g0) * v0[np.newaxis, :] + g0 * np.where(g0 > 0., self.min, 0.)[np.newaxis, :], res)
+        res = np.where(aleph > last[np.newaxis, :], (1. - gn) * vn[np.newaxis, :] + gn * np.where(gn > 0., self.max, 0.)[np.newaxis, :], res)
+        res = np.clip(res, self.min[np.newaxis, :], self.max[np.newaxis, :])
+        res = np.ma.array(res, mask=(T == 0.)[np.newaxis, :] * np.ones(len(p), dtype='bool')[:, np.newaxis])
+        return res.reshape((len(p),) + self.shape)
+
+
+class PairStatistics(object):
+    """
+    mergeable one-pass statistics of pairs of values (x,y) for each
+    element (e.g. grid cell) of a field
+
+    The sufficient statistics (number of pairs, means, sums of squared
+    deviations and of cross products) are accumulated chunk by chunk
+    using the pairwise update of Chan et al. (1979), which is
+    numerically stable. This allows to calculate the correlation,
+    linear regression and RMS errors of data which is too large to be
+    kept in memory. The results are the same as if all pairs were
+    processed at once.
+
+    Example
+    -------
+    S = PairStatistics()
+    for i in xrange(0, nt, 10):
+        S.update(x.data[i:i + 10], y.data[i:i + 10])
+    r = S.correlation()
+    """
+
+    def __init__(self, shape=()):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            geometry of a single field, e.g. (ny,nx). If (), then
+            statistics of all pairs are calculated
+        """
+        self.shape = tuple(shape)
+        m = int(np.prod(self.shape))
+        self.n = np.zeros(m)
+        self.mean_x = np.zeros(m)
+        self.mean_y = np.zeros(m)
+        self.m2_x = np.zeros(m)  # sum of squared deviations from mean
+        self.m2_y = np.zeros(m)
+        self.c_xy = np.zeros(m)  # sum of cross products of deviations
+        self.d2 = np.zeros(m)  # sum of squared differences x-y
+        self.min_x = np.ones(m) * np.inf
+        self.max_x = np.ones(m) * -np.inf
+        self.min_y = np.ones(m) * np.inf
+        self.max_y = np.ones(m) * -np.inf
+
+    def _combine(self, n, mx, my, m2x, m2y, cxy, d2):
+        nt = self.n + n
+        f = n / np.maximum(nt, 1.)
+        g = self.n * f  # n_a * n_b / (n_a + n_b)
+        dx = mx - self.mean_x
+        dy = my - self.mean_y
+        self.m2_x += m2x + dx * dx * g
+        self.m2_y += m2y + dy * dy * g
+        self.c_xy += cxy + dx * dy * g
+        self.mean_x += dx * f
+        self.mean_y += dy * f
+        self.d2 += d2
+        self.n = nt
+
+    def update(self, x, y):
+        """
+        add pairs of data
+
+        Parameters
+        ----------
+        x : ndarray
+            data [n,...] where the trailing dimensions correspond to
+            the geometry of the statistics; for the geometry () the data
+            can have any shape. Masked values and NaN are ignored
+        y : ndarray
+            data with the same shape as x
+        """
+        x = np.ma.masked_invalid(np.ma.asarray(x, dtype='float'))
+        y = np.ma.masked_invalid(np.ma.asarray(y, dtype='float'))
+        if x.shape != y.shape:
+            raise ValueError('Pairs of data need to have the same geometry!')
+        if self.shape == ():
+            x = x.reshape((-1, 1))
+            y = y.reshape((-1, 1))
+        elif x.shape[1:] != self.shape:
+            if x.shape == self.shape:  # single field
+                x = x.reshape((1,) + self.shape)
+                y = y.reshape((1,) + self.shape)
+            else:
+                print x.shape, self.shape
+                raise ValueError('Geometry of data does not match the statistics!')
+        x = x.reshape((len(x), -1))
+        y = y.reshape((len(y), -1))
+        if len(x) == 0:
+            return
+
+        valid = ~(np.ma.getmaskarray(x) | np.ma.getmaskarray(y))
+        xd = np.where(valid, x.data, 0.)
+        yd = np.where(valid, y.data, 0.)
+        n = valid.sum(axis=0).astype('float')
+        mx = xd.sum(axis=0) / np.maximum(n, 1.)
+        my = yd.sum(axis=0) / np.maximum(n, 1.)
+        ax = np.where(valid, xd - mx, 0.)
+        ay = np.where(valid, yd - my, 0.)
+        d = xd - yd
+
+        self.min_x = np.minimum(self.min_x, np.where(valid, xd, np.inf).min(axis=0))
+        self.max_x = np.maximum(self.max_x, np.where(valid, xd, -np.inf).max(axis=0))
+        self.min_y = np.minimum(self.min_y, np.where(valid, yd, np.inf).min(axis=0))
+        self.max_y = np.maximum(self.max_y, np.where(valid, yd, -np.inf).max(axis=0))
+        self._combine(n, mx, my, (ax * ax).sum(axis=0), (ay * ay).sum(axis=0),
+                      (ax * ay).sum(axis=0), (d * d).sum(axis=0))
+
+    def merge(self, other):
+        """
+        merge the statistics of other pairs of the same geometry
+
+        Parameters
+        ----------
+        other : PairStatistics
+            statistics to merge
+        """
+        if other.shape != self.shape:
+            raise ValueError('Geometry of statistics is different!')
+        self.min_x = np.minimum(self.min_x, other.min_x)
+        self.max_x = np.maximum(self.max_x, other.max_x)
+        self.min_y = np.minimum(self.min_y, other.min_y)
+        self.max_y = np.maximum(self.max_y, other.max_y)
+        self._combine(other.n, other.mean_x, other.mean_y, other.m2_x,
+                      other.m2_y, other.c_xy, other.d2)
+
+    def _result(self, x, nmin=1):
+        """ reshape results; masked for elements with less than nmin pairs """
+        x = np.ma.array(x, mask=self.n < nmin)
+        if self.shape == ():
+            return x[0]
+        return x.reshape(self.shape)
+
+    def count(self):
+        """ number of valid pairs """
+        if self.shape == ():
+            return int(self.n[0])
+        return self.n.reshape(self.shape)
+
+    def std(self):
+        """ standard deviation of x and y (ddof=0) """
+        n = np.maximum(self.n, 1.)
+        return self._result(np.sqrt(self.m2_x / n)), self._result(np.sqrt(self.m2_y / n))
+
+    def correlation(self):
+        """ pearson correlation coefficient """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = self.c_xy / np.sqrt(self.m2_x * self.m2_y)
+        return self._result(np.clip(r, -1., 1.), nmin=2)
+
+    def pvalue(self):
+        """ two-sided p-value of the correlation """
+        r = np.ma.filled(np.ma.atleast_1d(self.correlation()).ravel(), 0.)
+        p = np.ones(len(r))
+        for i in xrange(len(r)):
+            if self.n[i] > 2:
+                p[i] = get_significance(r[i], self.n[i]).data
+        return self._result(p, nmin=3)
+
+    def regression(self):
+        """
+        linear regression y = slope * x + intercept
+
+        Returns
+        -------
+        slope, intercept
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = self.c_xy / self.m2_x
+        intercept = self.mean_y - slope * self.mean_x
+        return self._result(slope, nmin=2), self._result(intercept, nmin=2)
+
+    def rms(self):
+        """ root mean square difference between x and y """
+        return self._result(np.sqrt(self.d2 / np.maximum(self.n, 1.)))
+
+    def centered_rms(self):
+        """
+        bias and centered root mean square difference between x and y
+        (Taylor et al. 2001, eq. 2)
+
+        Returns
+        -------
+        bias : mean(x) - mean(y)
+        crms : centered RMS difference
+        """
+        n = np.maximum(self.n, 1.)
+        v = (self.m2_x + self.m2_y - 2. * self.c_xy) / n
+        return self._result(self.mean_x - self.mean_y), self._result(np.sqrt(np.maximum(v, 0.)))
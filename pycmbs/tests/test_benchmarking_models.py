@@ -9,6 +9,8 @@ import unittest
 import tempfile
 from pycmbs.benchmarking.models import CMIP5Data, CMIP5RAWData, CMIP3Data
 from pycmbs.benchmarking.models import JSBACH_BOT
+from pycmbs.benchmarking.models.mpi_esm import _get_new_stream_files, _write_stream_log, _merge_stream
+import os
 
 class TestBenchmarkingPlots(unittest.TestCase):
 
@@ -46,6 +48,21 @@ class TestBenchmarkingPlots(unittest.TestCase):
         M = JSBACH_BOT('test.nc', varmethods, 'hist orical', name='MPI- E S M', intervals='monthly')
         self.run_model_validation(M)
 
+    def test_stream_incremental_files(self):
+        d = tempfile.mkdtemp()
+        logfile = d + os.sep + 'stream.nc.files'
+        files = [d + os.sep + 'exp_jsbach_main_mm_19%02i.grb' % i for i in [3, 1, 2]]
+        self.assertEqual(_get_new_stream_files(files, logfile), sorted(files))
+        _write_stream_log(files[0:2], logfile)
+        self.assertEqual(_get_new_stream_files(files, logfile), [files[2]])
+        _write_stream_log(files, logfile)
+        self.assertEqual(_get_new_stream_files(files, logfile), [])
+
+        # no input files at all
+        outfile = d + os.sep + 'stream.nc'
+        r = _merge_stream(('jsbach', d + os.sep + 'nothing_*.grb', outfile, None, True))
+        self.assertEqual(r, ('jsbach', outfile))
+        self.assertFalse(os.path.exists(outfile))
 
 
 if __name__ == "__main__":
@@ -457,6 +457,25 @@ class TestData(unittest.TestCase):
             r = self.D.get_percentile(p, return_object = True)
             self.assertAlmostEqual(r.data[0,0], res)
 
+    def test_get_percentile_multiple(self):
+        P = [0.05, 0.5, 0.95]
+        r = self.D.get_percentile(P, return_object=False)
+        self.assertEqual(r.shape, (3, 1, 1))
+        R = self.D.get_percentile(P, return_object=True)
+        self.assertEqual(len(R), 3)
+        for i in xrange(3):
+            res = stats.mstats.scoreatpercentile(self.D.data[:,0,0], P[i] * 100.)
+            self.assertAlmostEqual(r[i, 0, 0], res)
+            self.assertAlmostEqual(R[i].data[0, 0], res)
+
+        # approximate percentiles; 1000 timesteps in chunks
+        r = self.D.get_percentile(P, return_object=False, method='sketch', chunksize=100, sketch_size=100)
+        d = np.abs(r - self.D.get_percentile(P, return_object=False))
+        self.assertTrue(np.all(d < 0.05 * (self.D.data.max() - self.D.data.min())))
+
+        with self.assertRaises(ValueError):
+            self.D.get_percentile(P, method='invalid')
+
     def test_timn(self):
         A = self.D.copy()
         B = self.D.copy()
@@ -633,15 +652,15 @@ class TestData(unittest.TestCase):
 
         self.assertEqual(years[0],2001)
         self.assertEqual(years[1],2005)
-        self.assertEqual(res[0,0,0],r1)
-        self.assertEqual(res[1,0,0],r2)
+        self.assertAlmostEqual(res[0,0,0],r1)
+        self.assertAlmostEqual(res[1,0,0],r2)
         self.assertEqual(res[2,0,0].mask,r3.mask)
 
         R = D.get_yearmean(return_data=True)
         self.assertEqual(R.date[0].year, 2001)
         self.assertEqual(R.date[1].year, 2005)
-        self.assertEqual(R.data[0,0,0], r1)
-        self.assertEqual(R.data[1,0,0], r2)
+        self.assertAlmostEqual(R.data[0,0,0], r1)
+        self.assertAlmostEqual(R.data[1,0,0], r2)
         self.assertEqual(R.data[2,0,0].mask, r3.mask)
 
 
@@ -667,12 +686,53 @@ class TestData(unittest.TestCase):
 
         self.assertEqual(years[1],2005)
         self.assertEqual(resobj.date[1].year,2005)
-        self.assertEqual(res[0,0,0],r1)
-        self.assertEqual(resobj.data[0,0,0],r1)
-        self.assertEqual(res[1,0,0],r2)
-        self.assertEqual(resobj.data[1,0,0],r2)
+        self.assertAlmostEqual(res[0,0,0],r1)
+        self.assertAlmostEqual(resobj.data[0,0,0],r1)
+        self.assertAlmostEqual(res[1,0,0],r2)
+        self.assertAlmostEqual(resobj.data[1,0,0],r2)
         #~ self.assertEqual(res[2,0,0].mask,r3)
 
+    def test_get_seasonmean_monthmean(self):
+        D = self.D.copy()
+        D._oldtime = True
+        t = pl.datestr2num('2001-11-01') + np.arange(120)  # Nov 2001 - Feb 2002
+        D.time = t
+        data = pl.rand(len(t), 1, 2)
+        data[0:5, 0, 1] = np.nan
+        D.data = np.ma.array(data, mask=np.isnan(data))
+        D.time_cycle = 365
+
+        c = D._get_time_components()
+        mon = c['month']
+
+        years, seasons, res = D.get_seasonmean()
+        self.assertEqual(list(years), [2001, 2002])
+        self.assertEqual(list(seasons), ['SON', 'DJF'])
+        m = mon == 11
+        self.assertAlmostEqual(res[0, 0, 0], D.data[m, 0, 0].mean(), 10)
+        self.assertAlmostEqual(res[0, 0, 1], D.data[m, 0, 1].mean(), 10)
+        m = mon != 11  # DECEMBER belongs to DJF of 2002
+        self.assertAlmostEqual(res[1, 0, 0], D.data[m, 0, 0].mean(), 10)
+
+        years, months, res = D.get_monthmean()
+        self.assertEqual(list(months), [11, 12, 1, 2])
+        self.assertEqual(list(years), [2001, 2001, 2002, 2002])
+        for i, mo in enumerate(months):
+            self.assertAlmostEqual(res[i, 0, 1], D.data[mon == mo, 0, 1].mean(), 10)
+
+        r = D.get_monthmean(return_data=True)
+        self.assertEqual(r.nt, 4)
+        self.assertEqual(r.date[2].year, 2002)
+        self.assertEqual(r.date[2].month, 1)
+
+        keys, res = D.resample_time('month', stats=['std', 'min', 'max', 'count'])
+        m = mon == 12
+        self.assertAlmostEqual(res['std'][1, 0, 0], D.data[m, 0, 0].std(), 10)
+        self.assertEqual(res['min'][1, 0, 0], D.data[m, 0, 0].min())
+        self.assertEqual(res['max'][1, 0, 0], D.data[m, 0, 0].max())
+        self.assertEqual(res['count'][0, 0, 1], 25)
+        self.assertRaises(ValueError, D.resample_time, 'decade')
+
 
 
 
@@ -979,6 +1039,90 @@ class TestData(unittest.TestCase):
 
         os.remove(testfile)
 
+    def test_save_netCDF_packed_append(self):
+        from netCDF4 import Dataset
+        D = Data(None, None)
+        D._init_sample_object(nt=30, ny=4, nx=5)
+        D.data[3, 1, 2] = np.ma.masked
+        testfile = self._tmpdir + os.sep + 'mytestfile_packed.nc'
+
+        # packed int16 output with explicit chunks
+        D.save(testfile, varname='testvar', delete=True, dtype='i2', chunksizes=(1, 4, 5), complevel=4)
+        F = Dataset(testfile, 'r')
+        V = F.variables['testvar']
+        self.assertEqual(V.dtype, np.dtype('int16'))
+        self.assertEqual(V.chunking(), [1, 4, 5])
+        x = V[:]
+        F.close()
+        tol = (D.data.max() - D.data.min()) / 65534.
+        self.assertTrue(np.all(np.abs(x - D.data) <= tol))
+        self.assertTrue(x.mask[3, 1, 2])
+        self.assertEqual(x.mask.sum(), 1)
+
+        # stream data chunk by chunk
+        testfile = self._tmpdir + os.sep + 'mytestfile_append.nc'
+        for i in xrange(0, 30, 7):
+            d = D.copy()
+            d.data = D.data[i:i + 7]
+            d.time = D.time[i:i + 7]
+            d.save(testfile, varname='testvar', dtype='f4', append=True)
+        F = Dataset(testfile, 'r')
+        self.assertEqual(F.variables['testvar'].dtype, np.dtype('float32'))
+        x = F.variables['testvar'][:]
+        t = F.variables['time'][:]
+        F.close()
+        self.assertEqual(x.shape, D.data.shape)
+        self.assertTrue(np.all(np.abs(x - D.data) < 1.E-5))
+        self.assertTrue(np.all(t == D.time))
+
+        # invalid geometry for appending
+        d = D.copy()
+        d.data = D.data[:, 0:2, :]
+        with self.assertRaises(ValueError):
+            d.save(testfile, varname='testvar', append=True)
+
+        # time is only unlimited for appendable files
+        F = Dataset(testfile, 'r')
+        self.assertTrue(F.dimensions['time'].isunlimited())
+        F.close()
+        F = Dataset(self._tmpdir + os.sep + 'mytestfile_packed.nc', 'r')
+        self.assertFalse(F.dimensions['time'].isunlimited())
+        F.close()
+        with self.assertRaises(ValueError):
+            D.save(self._tmpdir + os.sep + 'mytestfile_packed.nc', varname='testvar', append=True)
+
+        # packed output which is appended needs an explicit range
+        testfile = self._tmpdir + os.sep + 'mytestfile_packed_append.nc'
+        d = D.copy()
+        d.data = D.data[0:10]
+        d.time = D.time[0:10]
+        with self.assertRaises(ValueError):
+            d.save(testfile, varname='testvar', dtype='i2', append=True)
+        vmin = float(D.data.min())
+        vmax = float(D.data.max())
+        d.save(testfile, varname='testvar', dtype='i2', append=True, pack_range=(vmin, vmax))
+
+        # appended values outside of the range of the packing are not clipped
+        d = D.copy()
+        d.data = D.data[10:20] * 1.
+        d.data[2, 0, 0] = vmax + 10. * (vmax - vmin)
+        d.time = D.time[10:20]
+        with self.assertRaises(ValueError):
+            d.save(testfile, varname='testvar', dtype='i2', append=True)
+        F = Dataset(testfile, 'r')
+        self.assertEqual(len(F.variables['time']), 10)  # nothing written
+        F.close()
+
+        # values within the range are appended
+        d.data[2, 0, 0] = vmax
+        d.save(testfile, varname='testvar', dtype='i2', append=True)
+        F = Dataset(testfile, 'r')
+        x = F.variables['testvar'][:]
+        F.close()
+        tol = (vmax - vmin) / 65534.
+        self.assertEqual(len(x), 20)
+        self.assertTrue(np.all(np.abs(x[10:] - d.data) <= tol))
+
     def test_interp_time_InvalidMethod(self):
         tref = self.D.num2date(pl.datestr2num('2001-05-05') + np.arange(200)*0.5+0.25)
         with self.assertRaises(ValueError):
@@ -1191,6 +1335,85 @@ class TestData(unittest.TestCase):
         d = D.data[:,0,0] * 2.
         self.assertTrue(np.all(d-R.data[:,0,0]) == 0.)
 
+    def test_get_derived(self):
+        x = Data(None, None)
+        x._init_sample_object(nt=10, ny=3, nx=4)
+        tm = x.get_derived('timmean')
+        self.assertTrue(x.get_derived('timmean') is tm)
+        self.assertTrue(np.all(tm == x.timmean()))
+        with self.assertRaises(ValueError):
+            tm[0, 0] = 5.  # shared results are read-only
+        xm = x.get_derived('timmean', return_object=True)
+        self.assertTrue(np.all(xm.data == tm))
+        me = xm.get_derived('fldmean')
+        self.assertEqual(me[0], xm.fldmean()[0])
+
+        # objects are copies, which can be modified
+        xm._apply_mask(np.zeros((3, 4), dtype='bool'))
+        xm.mulc(2., copy=False)
+        xm2 = x.get_derived('timmean', return_object=True)
+        self.assertFalse(xm2 is xm)
+        self.assertFalse(np.any(xm2.data.mask))
+        self.assertTrue(np.all(xm2.data == tm))
+        self.assertEqual(xm2.fldmean()[0], x.timmean(return_object=True).fldmean()[0])
+
+        # new data invalidates the cache; in place modifications
+        # need clear_derived()
+        x.data = x.data.copy()
+        x.data[:, 0, 0] = 100.
+        self.assertFalse(x.get_derived('timmean') is tm)
+        self.assertEqual(x.get_derived('timmean')[0, 0], 100.)
+        x.data[:, 0, 0] = 50.
+        self.assertEqual(x.get_derived('timmean')[0, 0], 100.)
+        x.clear_derived()
+        self.assertEqual(x.get_derived('timmean')[0, 0], 50.)
+        msk = np.ma.getmaskarray(x.data).copy()
+        msk[3, 1, 1] = True
+        x.data = np.ma.array(x.data.data, mask=msk)
+        self.assertTrue(np.all(x.get_derived('timmean') == x.timmean()))
+
+        c, b, n = x.get_derived('_get_histogram', bins=[0., 1., 200.])
+        self.assertEqual(n, 10 * 3 * 4 - 1)
+        self.assertEqual(c.sum(), n)
+        self.assertFalse('_derived' in x.copy().__dict__)
+
+    def test_arithmetic_lazy(self):
+        x = Data(None, None)
+        x._init_sample_object(nt=10, ny=3, nx=4)
+        x.data[2, 1, 1] = np.ma.masked
+        f = np.random.random((3, 4)) + 1.
+        f[0, 0] = 0.
+        F = Data(None, None)
+        F.data = np.ma.array(f, mask=f > 1.9)
+        F.label = 'f'
+
+        ref = ((x.data - 273.15) * 2. - F.data) / F.data + 1.
+        R = x.subc(273.15).mulc(2.).sub(F).div(F).addc(1.)  # fields are applied to each timestep
+        self.assertTrue(np.all(R.data == ref))
+        self.assertTrue(np.all(R.data.mask == ref.mask))
+
+        x.lazy = True
+        L = ((x - 273.15) * 2. - F) / F + 1.
+        self.assertTrue(L.__dict__['_expr'] is not None)  # nothing calculated yet
+        self.assertEqual(L.shape, x.shape)
+        self.assertEqual(L.label, 'testlabel - f / f')
+        L.compute(chunksize=3)
+        self.assertTrue(L.__dict__['_expr'] is None)
+        self.assertTrue(np.all(L.data == ref))
+        self.assertTrue(np.all(L.data.mask == ref.mask))
+        self.assertTrue(L.data.mask[0, 0, 0])  # division by zero
+        self.assertTrue(L.data.mask[2, 1, 1])
+
+        # evaluation when data is accessed and in place operations
+        M = x.mulc(3.)
+        M.addc(1., copy=False)
+        self.assertTrue(np.all(M.data == x.data * 3. + 1.))
+        self.assertTrue(np.all((1. - x).data == 1. - x.data))
+        B = F.copy()
+        B.data = np.ma.array(np.ones((2, 3)))
+        with self.assertRaises(ValueError):
+            x.add(B)
+
     def test_ConvertMonthlyTimeSeries_RaisesValueErrorForInvalidCalendar(self):
         data_object= self.D
         data_object.calendar = 'nothing_calendar'
@@ -2211,9 +2434,41 @@ class TestData(unittest.TestCase):
             x.hp_filter(100, return_object=True)
 
     def test_hp_filter(self):
-        # TODO check also validity
         x = self.D.copy()
-        x.hp_filter(100, return_object=True)
+        x._temporal_subsetting(0, 99)
+        r = x.hp_filter(100, return_object=False)
+
+        # reference solution: (I + lam*K'K) t = y, with K the second difference operator
+        n = 100
+        K = np.zeros((n - 2, n))
+        for i in xrange(n - 2):
+            K[i, i:i + 3] = [1., -2., 1.]
+        dmin = x.data.min()
+        y = np.log(x.data.flatten() - dmin + 1.)
+        ref = np.exp(np.linalg.solve(np.eye(n) + 100. * np.dot(K.T, K), y)) + dmin - 1.
+        self.assertTrue(np.all(np.abs(r - ref) < 1.E-10))
+
+    def test_hp_filter3D(self):
+        x = self.D.copy()
+        x._init_sample_object(nt=50, ny=2, nx=3)
+        x.data.mask[10:15, 0, 1] = True
+        r = x.hp_filter(10.)
+        self.assertEqual(r.shape, x.shape)
+        self.assertTrue(np.all(r.data.mask == x.data.mask))
+
+        # all timeseries are filtered individually
+        for i in xrange(2):
+            for j in xrange(3):
+                y = x.copy()
+                y.data = x.data[:, i:i + 1, j:j + 1]
+                ref = y.hp_filter(10., return_object=False)
+                d = np.abs(ref - r.data[:, i, j].filled(np.nan))
+                self.assertTrue(np.nanmax(d) < 1.E-10)
+
+        # no smoothing for lambda=0, also with gaps
+        r = x.hp_filter(0.)
+        self.assertTrue(np.all(r.data.mask == x.data.mask))
+        self.assertTrue(np.ma.allclose(r.data, x.data, rtol=0., atol=1.E-12))
 
 
     def test_areasum_InvalidGeometry(self):
@@ -2429,6 +2684,41 @@ class TestData(unittest.TestCase):
         x._init_sample_object(ny=200, nx=100, nt=373)
         self.assertTrue(x.shape == (373, 200,100))
 
+    def test_zonal_statistics(self):
+        x = Data(None, None)
+        x._init_sample_object(nt=4, ny=8, nx=10)
+        x.cell_area = np.random.random((8, 10)) + 0.5
+        x.lat = np.repeat(np.arange(8)[:, np.newaxis] * 10. - 35., 10, axis=1)
+        x.data[1, 2, 0:4] = np.ma.masked
+
+        m, s, n = x.get_zonal_statistics()
+        self.assertEqual(m.shape, (4, 8))
+        d = x.data[1, 2, 4:]
+        w = x.cell_area[2, 4:]
+        mu = (d * w).sum() / w.sum()
+        self.assertAlmostEqual(m[1, 2], mu)
+        self.assertAlmostEqual(s[1, 2], np.sqrt((w * (d - mu) ** 2.).sum() / w.sum()))
+        self.assertEqual(n[1, 2], 6)
+        self.assertTrue(np.all(np.abs(m - x.get_zonal_mean()) < 1.E-10))
+
+        # latitude bands give the same result if each row is a band
+        m1, s1, n1 = x.get_zonal_statistics(lat_bands=np.arange(9) * 10. - 40.)
+        self.assertTrue(np.all(np.abs(m - m1) < 1.E-10))
+        self.assertTrue(np.all(np.abs(s - s1) < 1.E-10))
+        self.assertTrue(np.all(n == n1))
+
+        # two rows per band; curvilinear latitudes
+        x.lat[3, 5] += 6.  # -5 --> 1 degree
+        M, S, N = x.get_zonal_statistics(lat_bands=np.arange(5) * 20. - 40., return_object=True)
+        self.assertEqual(M.data.shape, (4, 4))  # [lat,time]
+        self.assertTrue(np.all(M.lat == np.arange(4) * 20. - 30.))
+        self.assertEqual(N.data[3, 2], 20)
+        self.assertEqual(N.data[1, 1], 15)
+        self.assertEqual(N.data[2, 1], 21)
+        d = x.data[1, 0:2, :]
+        w = np.ma.array(x.cell_area[0:2, :], mask=d.mask)
+        self.assertAlmostEqual(M.data[0, 1], (d * w).sum() / w.sum())
+
     def test_rasterize_init(self):
         x = Data(None, None)
         x._init_sample_object(ny=1, nx=272)
@@ -11,7 +11,7 @@ from unittest import TestCase
 
 
 from pycmbs.data import Data
-from pycmbs.diagnostic import PatternCorrelation, RegionalAnalysis, EOF, Koeppen
+from pycmbs.diagnostic import PatternCorrelation, RegionalAnalysis, EOF, Koeppen, SVD, Diagnostic, ReichlerIndex, SkillStatistics
 from pycmbs.plots import GlecklerPlot
 from pycmbs.region import RegionIndex
 import scipy as sc
@@ -205,6 +205,180 @@ class TestData(TestCase):
 
 
 
+    def test_reichler_index_batched(self):
+        x = self.D.copy()
+        x._temporal_subsetting(0, 11)
+        x.time = pl.datestr2num('2000-01-15') + np.arange(12) * 30.5
+        tmp = np.random.random((12, 3, 4))
+        x.data = np.ma.array(tmp, mask=tmp != tmp)
+        x.data.mask[:, 0, 0] = True
+        x.std = np.random.random(x.data.shape) + 0.5
+        x.cell_area = np.random.random((3, 4)) + 1.
+
+        models = []
+        for i in xrange(4):
+            y = x.copy()
+            tmp = np.random.random((12, 3, 4))
+            y.data = np.ma.array(tmp, mask=tmp != tmp)
+            models.append(y)
+
+        R = ReichlerIndex(x)
+        e2 = R.calc_e2(models)
+        r = R.calc_index(models)
+        self.assertEqual(e2.shape, (4, 12))
+        self.assertEqual(r.shape, (4,))
+
+        D = GlecklerPlot()
+        D.add_variable('v')
+        for i in xrange(4):
+            ref = Diagnostic(x, y=models[i]).calc_reichler_index()
+            self.assertTrue(np.all(np.abs(e2[i] - ref) < 1.E-10))
+            D.add_model('m%i' % i)
+            self.assertAlmostEqual(r[i], D.calc_index(x, models[i], 'm%i' % i, 'v'), 10)
+
+        r2 = D.calc_indices(x, models, ['m0', 'm1', 'm2', 'm3'], 'v', pos=2)
+        self.assertTrue(np.all(np.abs(r2 - r) < 1.E-10))
+        self.assertEqual(len(D.data), 4)
+
+        # models scored one after another or in chunks give the same results
+        for n in [1, 3]:
+            R1 = ReichlerIndex(x, chunksize=n)
+            self.assertTrue(np.all(np.abs(R1.calc_e2(models) - e2) < 1.E-10))
+            stack = np.ma.array([m.data for m in models])
+            self.assertTrue(np.all(np.abs(R1.calc_index(stack) - r) < 1.E-10))
+        for i in xrange(4):
+            r1 = D.calc_indices(x, [models[i]], ['m%i' % i], 'v', index=R)
+            self.assertAlmostEqual(r1[0], r[i], 10)
+        with self.assertRaises(ValueError):
+            D.calc_indices(models[0], [models[1]], ['m1'], 'v', index=R)
+
+        # invalid timesteps are masked
+        x.std[3, :, :] = 0.
+        R = ReichlerIndex(x, time_weighting=False)
+        self.assertTrue(np.all(R.calc_index(models).mask))
+        with self.assertRaises(ValueError):
+            D.calc_indices(x, models, ['m0'], 'v')
+
+    def test_skill_statistics(self):
+        x = self.D.copy()
+        x._temporal_subsetting(0, 23)
+        x.time = pl.datestr2num(['2001-%02i-15' % m for m in xrange(1, 13)] + ['2002-%02i-15' % m for m in xrange(1, 13)])
+        tmp = np.random.random((24, 3, 4))
+        x.data = np.ma.array(tmp, mask=np.random.random(tmp.shape) < 0.1)
+        x.cell_area = np.random.random((3, 4)) + 1.
+        models = []
+        for i in xrange(3):
+            y = x.copy()
+            tmp = x.data.data * (i + 1.) + np.random.random((24, 3, 4))
+            y.data = np.ma.array(tmp, mask=np.random.random(tmp.shape) < 0.1)
+            models.append(y)
+        regions = np.ones((3, 4))
+        regions[0, :] = 5.
+
+        S = SkillStatistics(x, regions=regions, freq='season')
+        res = S.calc(models)
+        self.assertEqual(res['r'].shape, (3, 4, 2))
+        self.assertEqual(list(S.region_ids), [1., 5.])
+
+        # reference for model 1, JJA, region 5
+        month = np.asarray([d.month for d in x.date])
+        t = (month >= 6) & (month <= 8)
+        xx = x.data[t, 0, :]
+        yy = models[1].data[t, 0, :]
+        w = np.ones(xx.shape) * x.cell_area[0, :][np.newaxis, :]
+        m = ~(xx.mask | yy.mask)
+        xv, yv, wv = xx.data[m], yy.data[m], w[m]
+        mx = np.sum(wv * xv) / wv.sum()
+        my = np.sum(wv * yv) / wv.sum()
+        sx = np.sqrt(np.sum(wv * (xv - mx) ** 2) / wv.sum())
+        sy = np.sqrt(np.sum(wv * (yv - my) ** 2) / wv.sum())
+        r = np.sum(wv * (xv - mx) * (yv - my)) / wv.sum() / (sx * sy)
+        self.assertEqual(res['n'][1, 2, 1], m.sum())
+        self.assertAlmostEqual(res['r'][1, 2, 1], r, 10)
+        self.assertAlmostEqual(res['std_ratio'][1, 2, 1], sy / sx, 10)
+        self.assertAlmostEqual(res['bias'][1, 2, 1], my - mx, 10)
+        self.assertAlmostEqual(res['rms'][1, 2, 1], np.sqrt(np.sum(wv * (yv - xv) ** 2) / wv.sum()), 10)
+        self.assertAlmostEqual(res['crms'][1, 2, 1], np.sqrt(np.sum(wv * ((yv - my) - (xv - mx)) ** 2) / wv.sum()), 10)
+
+        # entire field, stacked models
+        S = SkillStatistics(x)
+        res1 = S.calc(np.ma.array([y.data for y in models]))
+        self.assertEqual(res1['r'].shape, (3, 1, 1))
+        tay = S.plot_taylor(res1, labels=['a', 'b', 'c'])
+        with self.assertRaises(ValueError):
+            SkillStatistics(x, freq='day')
+
+        # models are processed one at a time in chunks of timesteps;
+        # results do not depend on the chunks or other models
+        res2 = SkillStatistics(x, chunksize=5).calc(models)
+        res3 = SkillStatistics(x, chunksize=24).calc(models[2])
+        for k in ['r', 'std_ratio', 'bias', 'rms', 'crms', 'mean_ref', 'mean_model', 'std_ref', 'std_model']:
+            self.assertTrue(np.allclose(res1[k], res2[k], rtol=1.E-10, atol=0.))
+            self.assertTrue(np.allclose(res1[k][2], res3[k][0], rtol=1.E-10, atol=0.))
+        self.assertEqual(res2['n'].tolist(), res1['n'].tolist())
+
+        # large offsets do not lead to a loss of precision
+        xo = x.copy()
+        xo.data += 1.E6
+        yo = models[1].copy()
+        yo.data += 1.E6
+        res4 = SkillStatistics(xo).calc(yo)
+        self.assertAlmostEqual(res4['r'][0, 0, 0], res1['r'][1, 0, 0], 8)
+        self.assertAlmostEqual(res4['std_ratio'][0, 0, 0], res1['std_ratio'][1, 0, 0], 8)
+        with self.assertRaises(ValueError):
+            SkillStatistics(x, chunksize=0)
+        with self.assertRaises(ValueError):
+            S.calc([])
+
+    def test_slice_corr(self):
+        n = 20
+        x = self.D.copy()
+        x._temporal_subsetting(0, n - 1)
+        tmp = np.random.random((n, 3, 4))
+        x.data = np.ma.array(tmp, mask=np.random.random(tmp.shape) < 0.2)
+        y = x.copy()
+        tmp = np.random.random((n, 3, 4)) + x.data.data
+        y.data = np.ma.array(tmp, mask=np.random.random(tmp.shape) < 0.2)
+
+        D = Diagnostic(x, y)
+        D.slice_corr(timmean=True)
+        R1 = D.slice_r.copy()
+        D.slice_corr(timmean=True, nproc=2)
+        self.assertTrue(np.all(np.isnan(R1) == np.isnan(D.slice_r)))
+        self.assertTrue(np.nanmax(np.abs(R1 - D.slice_r)) < 1.E-12)
+
+        # period [i1,i2) with mean over time
+        i1 = 3
+        i2 = 11
+        xm = x.data[i1:i2].mean(axis=0)
+        ym = y.data[i1:i2].mean(axis=0)
+        m = ~(np.ma.getmaskarray(xm) | np.ma.getmaskarray(ym))
+        slope, intercept, r, p, stderr = stats.linregress(xm.data[m], ym.data[m])
+        self.assertAlmostEqual(D.slice_r[i2 - i1, i1], r, 10)
+        self.assertAlmostEqual(D.slice_p[i2 - i1, i1], p, 10)
+        self.assertAlmostEqual(D.slice_slope[i2 - i1, i1], slope, 10)
+        self.assertEqual(D.slice_length[i2 - i1, i1], i2 - i1)
+        self.assertTrue(np.isnan(D.slice_r[1, 0]))
+
+        # all data of period
+        D.slice_corr(timmean=False)
+        m = ~(x.data.mask[i1:i2] | y.data.mask[i1:i2])
+        slope, intercept, r, p, stderr = stats.linregress(x.data.data[i1:i2][m], y.data.data[i1:i2][m])
+        self.assertAlmostEqual(D.slice_r[i2 - i1, i1], r, 10)
+        self.assertAlmostEqual(D.slice_p[i2 - i1, i1], p, 10)
+        self.assertAlmostEqual(D.slice_slope[i2 - i1, i1], slope, 10)
+
+        # gap analysis
+        gap = 4
+        D.slice_corr_gap(timmean=False)
+        m = ~(x.data.mask | y.data.mask)
+        m[i1:i1 + gap] = False
+        slope, intercept, r, p, stderr = stats.linregress(x.data.data[m], y.data.data[m])
+        self.assertAlmostEqual(D.slice_r_gap[gap, i1], r, 10)
+        self.assertAlmostEqual(D.slice_p_gap[gap, i1], p, 10)
+        self.assertAlmostEqual(D.slice_slope_gap[gap, i1], slope, 10)
+        self.assertEqual(D.slice_length_gap[gap, i1], gap - 1)
+
     def test_RegionalAnalysis_xNone(self):
         region = RegionIndex(55, 1, 1, 1, 1, label='test')
         R = RegionalAnalysis(None, self.D, region)
@@ -239,6 +413,39 @@ class TestData(TestCase):
         with self.assertRaises(ValueError):
             R = RegionalAnalysis(x, y, region)
 
+    def test_svd_truncated(self):
+        nt = 40
+        x = self.D.copy()
+        x._temporal_subsetting(0, nt - 1)
+        tmp = np.random.random((nt, 4, 5))
+        x.data = np.ma.array(tmp, mask=tmp != tmp)
+        y = x.copy()
+        tmp = np.random.random((nt, 3, 5)) + 0.5 * x.data[:, 0:3, :]
+        y.data = np.ma.array(tmp, mask=tmp != tmp)
+
+        S1 = SVD(x, y)
+        S1.svd_analysis()
+        S2 = SVD(x, y)
+        S2.svd_analysis(nmodes=5)
+
+        self.assertEqual(len(S2.scf), 5)
+        self.assertEqual(S2.U.shape, (20, 5))
+        self.assertEqual(S2.V.shape, (5, 15))
+        self.assertFalse(hasattr(S2, 'C'))
+        self.assertTrue(np.all(np.abs(S1.s[0:5] - S2.s) < 1.E-8))
+        self.assertTrue(np.all(np.abs(S1.scf[0:5] - S2.scf) < 1.E-8))
+        self.assertTrue(np.all(np.abs(np.abs(S1.mcorr[0:5]) - np.abs(S2.mcorr)) < 1.E-8))
+        # singular vectors are only unique except of their sign
+        self.assertTrue(np.all(np.abs(np.abs(S1.U[:, 0:5]) - np.abs(S2.U)) < 1.E-8))
+        self.assertTrue(np.all(np.abs(np.abs(S1.V[0:5, :]) - np.abs(S2.V)) < 1.E-8))
+
+        U, V = S2.get_singular_vectors(0)
+        self.assertEqual(U.data.shape, (4, 5))
+        self.assertEqual(V.data.shape, (3, 5))
+
+        with self.assertRaises(ValueError):
+            S2.svd_analysis(nmodes=0)
+
     @unittest.skip('wait for solving logplot proplem in map_plot')
     def test_EOF(self):
         x = np.random.random((self.D.nt, 20, 30))
@@ -44,6 +44,63 @@ class TestPycmbsGrid(unittest.TestCase):
     def test_grid_draw_edge(self):
         self.grid.draw_edges()
 
+    def test_get_cell_polygons(self):
+        vlon = np.array([[0., 10., 5.], [170., -170., 175.], [179., 181., 182.]])
+        vlat = np.array([[0., 0., 10.], [0., 0., 10.], [0., 0., 5.]])
+        verts, cells = grid.get_cell_polygons(vlon, vlat)
+        # cells crossing the dateline are split into two parts
+        self.assertEqual(list(cells), [0, 1, 2, 1, 2])
+        self.assertEqual(verts.shape, (5, 4, 2))
+        self.assertTrue(np.all(np.abs(verts[:, :, 0]) <= 180.))
+        self.assertEqual(verts[1, :, 0].tolist(), [170., 180., 180., 175.])
+        self.assertAlmostEqual(verts[1, 2, 1], 20. / 3.)
+        self.assertEqual(verts[3, :, 0].tolist(), [-180., -170., -180., -180.])
+        self.assertTrue(grid.get_cell_polygons(vlon, vlat)[0] is verts)
+
+        # only the polygons of a few grids are kept
+        grid.clear_resampler_cache()
+        for i in xrange(grid._CELL_POLYGONS.maxsize + 2):
+            grid.get_cell_polygons(vlon + i, vlat)
+        self.assertEqual(len(grid._CELL_POLYGONS), grid._CELL_POLYGONS.maxsize)
+
+    def test_get_latitude_bands(self):
+        lat = np.array([[-90., -45., 0.], [30., 90., np.nan]])
+        idx = grid.get_latitude_bands(lat, [-90., 0., 90.])
+        self.assertEqual(idx.tolist(), [0, 0, 1, 1, 1, -1])
+        self.assertTrue(grid.get_latitude_bands(lat.copy(), [-90., 0., 90.]) is idx)
+
+        # only the bands of a few grids are kept
+        grid.clear_resampler_cache()
+        for i in xrange(grid._LATITUDE_BANDS.maxsize + 2):
+            grid.get_latitude_bands(lat, [-90., float(i), 90.])
+        self.assertEqual(len(grid._LATITUDE_BANDS), grid._LATITUDE_BANDS.maxsize)
+
+    def test_get_cell_polygons_poles(self):
+        from matplotlib.path import Path
+        # cell containing the north pole, cell with a vertex at the
+        # south pole and a regular cell
+        vlon = np.array([[0., 120., -120.], [170., 0., -160.], [0., 10., 5.]])
+        vlat = np.array([[80., 80., 80.], [-80., -90., -80.], [0., 0., 10.]])
+        verts, cells = grid.get_cell_polygons(vlon, vlat)
+        # polar cells are not split at the dateline
+        self.assertEqual(sorted(cells.tolist()), [0, 1, 1, 2])
+        self.assertTrue(np.all(np.abs(verts[:, :, 0]) <= 180.))
+
+        P = Path(verts[cells.tolist().index(0)])
+        self.assertTrue(P.contains_point((0., 89.)))
+        self.assertTrue(P.contains_point((179., 85.)))
+        self.assertTrue(P.contains_point((-100., 81.)))
+        self.assertFalse(P.contains_point((0., 70.)))
+        self.assertEqual(verts[cells == 0][0, :, 1].max(), 90.)
+
+        # the cell touching the south pole is split at the dateline
+        # and reaches the pole only between its neighbouring vertices
+        P = [Path(v) for v in verts[cells == 1]]
+        self.assertTrue(any([q.contains_point((175., -85.)) for q in P]))
+        self.assertTrue(any([q.contains_point((-165., -85.)) for q in P]))
+        self.assertFalse(any([q.contains_point((0., -85.)) for q in P]))
+        self.assertEqual(verts[cells == 1][:, :, 1].min(), -90.)
+
 
 
 
@@ -5,8 +5,14 @@ For COPYING and LICENSE details, please refer to the file
 COPYRIGHT.md
 """
 
+import os
+import tempfile
 import unittest
-from pycmbs.icon import Icon
+import numpy as np
+from netCDF4 import Dataset
+import matplotlib.pyplot as plt
+from pycmbs.icon import Icon, get_icon_grid
+from pycmbs.plots import get_unstructured_collection
 
 class TestPycmbsIcon(unittest.TestCase):
 
@@ -31,6 +37,38 @@ class TestPycmbsIcon(unittest.TestCase):
         with self.assertRaises(ValueError):
             x.read()
 
+    def test_icon_grid(self):
+        gridfile = tempfile.mktemp(suffix='.nc')
+        F = Dataset(gridfile, 'w')
+        F.createDimension('cell', 3)
+        F.createDimension('nv', 3)
+        vlon = np.array([[0., 10., 5.], [170., -170., 175.], [-20., -10., -15.]])
+        vlat = np.array([[0., 0., 10.], [0., 0., 10.], [0., 0., -10.]])
+        for k, v in [('clon', vlon.mean(axis=1)), ('clat', vlat.mean(axis=1))]:
+            F.createVariable(k, 'd', ('cell',))[:] = np.deg2rad(v)
+        for k, v in [('clon_vertices', vlon), ('clat_vertices', vlat)]:
+            F.createVariable(k, 'd', ('cell', 'nv'))[:] = np.deg2rad(v)
+        F.close()
+
+        g = get_icon_grid(gridfile)
+        self.assertTrue(get_icon_grid(gridfile) is g)  # cached
+        from pycmbs import icon
+        self.assertTrue(len(icon._ICON_GRIDS) <= icon._ICON_GRIDS.maxsize)
+        self.assertEqual(g.ncell, 3)
+        self.assertTrue(np.allclose(g.vlon, vlon))
+        verts, cells = g.get_polygons()
+        self.assertEqual(list(cells), [0, 2, 1, 1])
+
+        data = np.ma.array([1., 2., 3.], mask=[False, False, True])
+        c = get_unstructured_collection(g.vlon, g.vlat, data)
+        self.assertEqual(len(c.get_paths()), 4)
+        self.assertEqual(c.get_array().tolist(), [1., None, 2., 2.])
+        f = plt.figure()
+        ax = f.add_subplot(111)
+        ax.add_collection(c)
+        f.canvas.draw()
+        plt.close(f)
+        os.remove(gridfile)
 
     #~ def test_IconReadOK(self):
         #~ x = Icon(self.datafile, self.datafile, 'rsns')
@@ -93,6 +93,68 @@ class TestMapPlotGeneric(unittest.TestCase):
         if os.path.exists(ofile):
             os.remove(ofile)
 
+    def test_projection_cache(self):
+        from pycmbs.grid import _LRUCache, _coordinate_hash
+        from pycmbs.utils import hashable
+        self.assertTrue(isinstance(mapping.PROJECTION_CACHE, _LRUCache))
+        C = _LRUCache(maxsize=2)
+        calls = []
+
+        def _builder():
+            calls.append(1)
+            return mapping._freeze((np.zeros(3), np.ones(3)))
+        k1 = ('cyclic', hashable({'projection': 'robin', 'extent': {'xmin': 0.}}),
+              _coordinate_hash(self.D.lon, self.D.lat))
+        X, Y = C.get(k1, _builder)
+        X1, Y1 = C.get(k1, _builder)
+        self.assertTrue(X1 is X)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(C.hits, 1)
+        with self.assertRaises(ValueError):
+            X[0] = 1.  # cached arrays are read-only
+
+        # different grid
+        lat = self.D.lat.copy()
+        lat[0, 0] += 1.
+        k2 = ('cyclic', k1[1], _coordinate_hash(self.D.lon, lat))
+        self.assertNotEqual(k1, k2)
+        C.get(k2, _builder)
+        C.get(('x',), _builder)  # removes the least recently used entry
+        self.assertEqual(len(calls), 3)
+        C.get(k1, _builder)
+        self.assertEqual(len(calls), 4)
+        C.clear()
+        self.assertEqual(C.hits, 0)
+
+    def test_map_plot_unstructured(self):
+        from matplotlib.collections import PolyCollection
+        # ICON like data [time,1,ncell] with a cell crossing the
+        # dateline and one containing the north pole
+        vlon = np.array([[0., 10., 5.], [170., -170., 175.], [0., 120., -120.]])
+        vlat = np.array([[0., 0., 10.], [0., 0., 10.], [80., 80., 80.]])
+        x = Data(None, None)
+        x._init_sample_object(nt=4, ny=1, nx=3)
+        x.lon = vlon.mean(axis=1).reshape((1, 3))
+        x.lat = vlat.mean(axis=1).reshape((1, 3))
+        x.data[:, 0, 1] = np.ma.masked
+        x.gridtype = 'unstructured'
+        x.vlon = vlon
+        x.vlat = vlat
+
+        ofile = self._tmpdir + os.sep + 'icon.png'
+        M = map_plot(x, savegraphicfile=ofile, return_plot_handler=True)
+        self.assertTrue(os.path.exists(ofile))
+        self.assertTrue(isinstance(M.im, PolyCollection))
+        self.assertEqual(len(M.im.get_paths()), 4)
+        xm = x.timmean()
+        self.assertEqual(M.im.get_array().tolist(), [xm[0, 0], None, None, xm[0, 2]])
+        plt.close(M.figure)
+
+        # vertices are required
+        del x.vlon
+        with self.assertRaises(ValueError):
+            mapping.SingleMap(x).plot()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,7 +5,7 @@ For COPYING and LICENSE details, please refer to the file
 COPYRIGHT.md
 """
 
-from pycmbs.benchmarking.models import MeanModel, Model
+from pycmbs.benchmarking.models import MeanModel, MedianModel, EnsembleModel, Model
 import numpy as np
 from pycmbs.data import Data
 import numpy.testing as npt
@@ -42,59 +42,87 @@ def test_mean_model():
     # print M.variables['var2'].div(x).data #should give 0.6
     npt.assert_equal(np.all(np.abs(1. - M.variables['var2'].div(x).data/0.6) < 0.00000001), True)
 
-def xxxxtest_median_model():
+def test_median_model():
     x = Data(None, None)
     x.label = 'nothing'
     d = np.random.random((100, 1, 1))
     x.data = np.ma.array(d, mask= d!=d)
 
-    # odd number and no masked values
-    a = x.copy()
-    a.data[:, 0, 0] = 1.
-    b = x.copy()
-    b.data[:, 0, 0] = 3.
-    c = x.copy()
-    c.data[:, 0, 0] = 2.
-    d = x.copy()
-    d.data[:, 0, 0] = 5.
-    e = x.copy()
-    e.data[:, 0, 0] = 4.
-
-    m = MedianModel()
-    m.add_member(a)
-    m.add_member(b)
-    m.add_member(c)
-    m.add_member(d)
-    m.add_member(e)
-    m.ensmedian()
-
-    # should give the value of 3. for all timesteps
+    def _model(v):
+        y = x.copy()
+        y.data[:, 0, 0] = v
+        M = Model(None, ['var1'], name='x', intervals='season')
+        M.variables = {'var1': y}
+        return M
 
-    del m
+    # odd number and no masked values
+    for method in ['exact', 'sketch']:
+        m = MedianModel(['var1'], intervals='season', method=method)
+        for v in [1., 3., 2., 5., 4.]:
+            m.add_member(_model(v))
+        m.ensmedian()
+        npt.assert_equal(np.all(m.variables['var1'].data == 3.), True)
 
     # even number and no masked values
-    a = x.copy()
-    a.data[:, 0, 0] = 1.
-    b = x.copy()
-    b.data[:, 0, 0] = 3.
-    c = x.copy()
-    c.data[:, 0, 0] = 2.
-    d = x.copy()
-    c.data[:, 0, 0] = 4.
-
-    m = MedianModel()
-    m.add_member(a)
-    m.add_member(b)
-    m.add_member(c)
-    m.add_member(d)
-
+    m = MedianModel(['var1'], intervals='season')
+    for v in [1., 3., 2., 4.]:
+        m.add_member(_model(v))
     m.ensmedian()
-
-    # should give the value of 2.5 for all timesteps
-    del m
-
-
-
-
+    npt.assert_almost_equal(m.variables['var1'].data[:, 0, 0], 2.5)
 
 
+def test_ensemble_model_statistics():
+    x = Data(None, None)
+    x._init_sample_object(nt=60, ny=3, nx=4)
+    members = []
+    E = EnsembleModel(['var1'], intervals='season', percentiles=[10., 50.])
+    for i in range(5):
+        y = x.copy()
+        y.data = np.ma.array(np.random.random(x.data.shape), mask=False)
+        y.data[:, 0, 0] = np.ma.masked
+        if i == 0:
+            y.data[:, 1, 1] = np.ma.masked
+            y.std = np.ones(x.data.shape)  # statistics of a single member
+            y.n = np.ones(x.data.shape)
+        z = y.copy()
+        if i == 1:  # timeseries only partly overlapping
+            z.time = z.time[10:]
+            z.data = z.data[10:]
+        members.append(y.data)
+        M = Model(None, ['var1'], name='x', intervals='season')
+        M.variables = {'var1': y, 'var1_org': (z.time, None, z)}
+        E.add_member(M)
+    E.ensstat()
+    X = np.ma.array(members)
+
+    npt.assert_almost_equal(E.variables['var1'].data, X.mean(axis=0))
+    npt.assert_almost_equal(E.get_ensemble_statistic('var1', 'std').data, X.std(axis=0))
+    npt.assert_almost_equal(E.get_ensemble_statistic('var1', 'min').data, X.min(axis=0))
+    npt.assert_almost_equal(E.get_ensemble_statistic('var1', 'max').data, X.max(axis=0))
+    npt.assert_almost_equal(E.get_ensemble_statistic('var1', 'p50').data, np.ma.median(X, axis=0))
+    npt.assert_equal(E.get_ensemble_statistic('var1', 'count').data[0, 1, 1], 4)
+    npt.assert_equal(E.variables['var1'].data.mask[0, 0, 0], True)
+    for s in ['mean', 'std', 'count']:
+        npt.assert_equal(hasattr(E.get_ensemble_statistic('var1', s), 'std'), False)
+        npt.assert_equal(hasattr(E.get_ensemble_statistic('var1', s), 'n'), False)
+
+    # aggregation of the timeseries; member 1 is missing the first timesteps
+    t, m, D = E.variables['var1_org']
+    npt.assert_equal(len(t), 60)
+    c = E.get_ensemble_statistic('var1_org', 'count').data
+    npt.assert_equal(c[0, 1, 2], 4)
+    npt.assert_equal(c[20, 1, 2], 5)
+    npt.assert_almost_equal(D.data[20], X.mean(axis=0)[20])
+    npt.assert_almost_equal(D.data[0, 1, 2], np.delete(X[:, 0, 1, 2], 1).mean())
+
+    # the mean model requires valid data for all models
+    M = MeanModel(['var1'], intervals='season')
+    for i in range(5):
+        y = x.copy()
+        y.data = np.ma.array(members[i], copy=True)
+        A = Model(None, ['var1'], name='x', intervals='season')
+        A.variables = {'var1': y}
+        M.add_member(A)
+    M.ensmean()
+    npt.assert_equal(M.variables['var1'].data.mask[0, 1, 1], True)
+    npt.assert_almost_equal(M.variables['var1'].data[0, 2, 2], X[:, 0, 2, 2].mean())
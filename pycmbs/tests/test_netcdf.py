@@ -8,6 +8,9 @@ COPYRIGHT.md
 import unittest
 from pycmbs import netcdf
 import numpy as np
+import tempfile
+import shutil
+import os
 
 class TestPycmbsNetcdf(unittest.TestCase):
 
@@ -31,6 +34,154 @@ class TestPycmbsNetcdf(unittest.TestCase):
     def test_netCDFHandlerinit_Default(self):
         cdf = netcdf.NetCDFHandler()
 
+    def _write_file(self, filename, time, units, data):
+        F = netcdf.NetCDFHandler()
+        F.open_file(filename, 'w')
+        F.create_dimension('time', size=None)
+        F.create_dimension('lat', size=data.shape[1])
+        F.create_dimension('lon', size=data.shape[2])
+        F.create_variable('time', 'd', ('time',))
+        F.create_variable('tas', 'f4', ('time', 'lat', 'lon'), fill_value=-999.)
+        F.set_attribute('time', 'units', units)
+        F.F.variables['time'][:] = time
+        F.F.variables['tas'][:] = data
+        F.close()
+
+    def test_multi_file_reader(self):
+        d = tempfile.mkdtemp()
+        try:
+            x = np.random.random((30, 3, 4))
+            x[5, 1, 2] = -999.
+            # files are not ordered and use different time units
+            self._write_file(d + os.sep + 'a.nc', np.arange(20, 30), 'days since 2000-01-01', x[20:30])
+            self._write_file(d + os.sep + 'b.nc', np.arange(0, 12) * 24., 'hours since 2000-01-01', x[0:12])
+            self._write_file(d + os.sep + 'c.nc', np.arange(12, 20), 'days since 2000-01-01', x[12:20])
+            files = [d + os.sep + f for f in ['a.nc', 'b.nc', 'c.nc']]
+
+            R = netcdf.MultiFileReader(files, 'tas', chunksize=5)
+            self.assertEqual(R.nt, 30)
+            self.assertEqual(R.time_units, 'days since 2000-01-01')
+            self.assertEqual(R.shape, (3, 4))
+            self.assertTrue(np.allclose(R.time, np.arange(30)))
+            chunks = [c for c in R]
+            self.assertEqual([len(t) for t, c in chunks], [5, 5, 2, 5, 3, 5, 5])
+            t, y = R.read()
+            self.assertTrue(np.allclose(t, np.arange(30)))
+            self.assertTrue(y.mask[5, 1, 2])
+            self.assertEqual(y.mask.sum(), 1)
+            self.assertTrue(np.allclose(y, x.astype('f4')))
+
+            # same results without background thread
+            R = netcdf.MultiFileReader(files, 'tas', prefetch=0)
+            t1, y1 = R.read()
+            self.assertTrue(np.all(y1 == y))
+            self.assertEqual(len([c for c in R]), 3)
+
+            # each file is opened once per pass
+            opened = []
+            _open = R._open
+
+            def _count(f):
+                opened.append(_open(f))
+                return opened[-1]
+            R = netcdf.MultiFileReader(files, 'tas', chunksize=2)
+            R._open = _count
+            self.assertEqual(len([c for c in R]), 15)
+            self.assertEqual(len(opened), 3)
+            self.assertFalse(any([File.F.isopen() for File in opened]))
+
+            # stop iteration early; the file is closed
+            R = netcdf.MultiFileReader(files, 'tas', chunksize=1, prefetch=1)
+            opened = []
+            R._open = _count
+            for i, c in enumerate(R):
+                if i == 2:
+                    break
+            del c
+            self.assertFalse(any([File.F.isopen() for File in opened]))
+
+            with self.assertRaises(ValueError):
+                netcdf.MultiFileReader(files, 'nix')
+            with self.assertRaises(ValueError):
+                netcdf.MultiFileReader([], 'tas')
+        finally:
+            shutil.rmtree(d)
+
+    def test_file_pool(self):
+        d = tempfile.mkdtemp()
+        try:
+            files = [d + os.sep + 'f%i.nc' % i for i in xrange(3)]
+            for i, f in enumerate(files):
+                self._write_file(f, np.arange(5), 'days since 2000-01-01', np.ones((5, 2, 3)) * i)
+
+            P = netcdf.NetCDFFilePool(maxsize=2)
+            # outside of a session, files are not kept open
+            File = P.get(files[0])
+            self.assertFalse(isinstance(File, netcdf.PooledNetCDFHandler))
+            File.close()
+            self.assertEqual(P.misses, 0)
+
+            with P.session():
+                File = P.get(files[0])
+                self.assertTrue(isinstance(File, netcdf.PooledNetCDFHandler))
+                self.assertEqual(sorted(File.get_variable_keys()), ['tas', 'time'])
+                info = File.get_variable_info('time')
+                self.assertEqual(info['units'], 'days since 2000-01-01')
+                self.assertEqual(info['calendar'], None)
+                self.assertEqual(File.get_variable_info('tas')['fill_value'], -999.)
+                self.assertEqual(File.get_variable_info('tas')['shape'], (5, 2, 3))
+                File.close()  # file stays open
+                self.assertTrue(P.get(files[0]) is File)
+                self.assertEqual(P.get(files[0]).get_variable('tas').mean(), 0.)
+                self.assertEqual((P.hits, P.misses), (2, 1))
+
+                # least recently used file is closed
+                P.get(files[1])
+                P.get(files[2])
+                self.assertEqual(len(P._files), 2)
+                P.get(files[0])
+                self.assertEqual((P.hits, P.misses), (2, 4))
+
+                # modified files are opened again
+                self._write_file(files[1], np.arange(5), 'days since 2000-01-01', np.ones((5, 2, 3)) * 5.)
+                self.assertEqual(P.get(files[1]).get_variable('tas').mean(), 5.)
+
+                with P.session():  # nested session
+                    P.get(files[1])
+                self.assertEqual(len(P._files), 2)
+            self.assertEqual(len(P._files), 0)
+        finally:
+            shutil.rmtree(d)
+
+    def test_pooled_data_read(self):
+        from pycmbs.data import Data
+        d = tempfile.mkdtemp()
+        try:
+            f = d + os.sep + 'x.nc'
+            self._write_file(f, np.arange(5), 'days since 2000-01-01', np.random.random((5, 2, 3)))
+            netcdf.NETCDF_POOL.clear()
+            x = Data(f, 'tas', read=True, cell_area=np.ones((2, 3)))
+            self.assertEqual(x.data.shape, (5, 2, 3))
+            self.assertEqual(x.time_str, 'days since 2000-01-01')
+            self.assertEqual(x.calendar, 'standard')
+            self.assertEqual(netcdf.NETCDF_POOL.misses, 1)  # file opened only once
+            self.assertEqual(len(netcdf.NETCDF_POOL._files), 0)
+        finally:
+            shutil.rmtree(d)
+
+    def test_prefetch(self):
+        self.assertEqual(list(netcdf.prefetch(xrange(10), size=3)), range(10))
+
+        def _gen():
+            yield 1
+            raise ValueError('test')
+        g = netcdf.prefetch(_gen())
+        self.assertEqual(g.next(), 1)
+        with self.assertRaises(ValueError):
+            g.next()
+        with self.assertRaises(ValueError):
+            list(netcdf.prefetch(xrange(10), size=0))
+
 
 if __name__ == "__main__":
     unittest.main()
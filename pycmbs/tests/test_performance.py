@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+This file is part of pyCMBS. (c) 2012-2014
+For COPYING and LICENSE details, please refer to the file
+COPYRIGHT.md
+"""
+
+import unittest
+import os
+import tempfile
+import copy
+import time
+
+from pycmbs import performance
+from pycmbs.performance import PerformanceSuite
+
+
+def _run_crash(x):
+    os._exit(3)  # like a process killed without sending a result
+
+
+def _run_hang(x):
+    time.sleep(60.)
+
+
+class TestPerformance(unittest.TestCase):
+
+    def setUp(self):
+        self.S = PerformanceSuite(grids=[(6, 8), 't63'], ntimes=[24, 48], mask_fractions=[0., 0.5],
+                                  cases=['fldmean', 'rasterize_polygons'], repeat=1,
+                                  max_elements=20000, isolate=False)
+
+    def test_configurations(self):
+        c = self.S.configurations()
+        # t63 exceeds max_elements; rasterization only for smallest nt
+        self.assertEqual(len(c), 2 * 2 + 2)
+        self.assertTrue(('rasterize_polygons', (6, 8), 48, 0.) not in c)
+        with self.assertRaises(ValueError):
+            PerformanceSuite(cases=['nothing'])
+
+    def test_run_compare(self):
+        S = PerformanceSuite(grids=[(6, 8)], ntimes=[24], mask_fractions=[0.5],
+                             cases=['fldmean'], repeat=2)  # run isolated
+        ofile = tempfile.mktemp(suffix='.json')
+        res = S.run(outfile=ofile, verbose=False)
+        self.assertTrue(os.path.exists(ofile))
+        r = S.read(ofile)['results'][0]
+        self.assertEqual(r['case'], 'fldmean')
+        self.assertEqual(r['grid'], '6x8')
+        self.assertTrue(r['time_min'] > 0.)
+        os.remove(ofile)
+
+        base = copy.deepcopy(res)
+        self.assertEqual(len(S.compare(res, base, threshold=0.2, min_time=0.)), 0)
+        base['results'][0]['time_min'] = res['results'][0]['time_min'] / 2.
+        base['results'][0]['memory_peak'] = 10.
+        res['results'][0]['memory_peak'] = 20.
+        reg = S.compare(res, base, threshold=0.2, min_time=0.)
+        self.assertEqual(len(reg), 2)
+        self.assertEqual(sorted([x['quantity'] for x in reg]), ['memory', 'time'])
+        self.assertEqual(len(S.compare(res, base, threshold=1.5, min_time=0.)), 0)
+
+    def test_run_failed(self):
+        performance.CASES.update({'crash': (performance._setup_default, _run_crash, None, False),
+                                  'hang': (performance._setup_default, _run_hang, None, False)})
+        try:
+            S = PerformanceSuite(grids=[(6, 8)], ntimes=[24], mask_fractions=[0.],
+                                 cases=['crash', 'hang', 'fldmean'], repeat=1, timeout=2.)
+            t = time.time()
+            res = S.run(verbose=False)
+            self.assertTrue(time.time() - t < 30.)
+        finally:
+            performance.CASES.pop('crash')
+            performance.CASES.pop('hang')
+        r = dict([(x['case'], x) for x in res['results']])
+        self.assertTrue('code 3' in r['crash']['error'])
+        self.assertTrue('Timeout' in r['hang']['error'])
+        self.assertFalse('error' in r['fldmean'].keys())
+
+        # failed runs are not compared
+        base = copy.deepcopy(res)
+        for x in base['results']:
+            x.update({'time_min': 1.E-6, 'memory_peak': 1.E-6})
+        self.assertEqual(len(S.compare(res, base, threshold=0.2, min_time=0.)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -69,6 +69,28 @@ class TestPycmbsPlots(unittest.TestCase):
         S.plot(x, fldmean=False)
         S.legend()
 
+    def test_ScatterPlot_Density(self):
+        x = Data(None, None)
+        x._init_sample_object(nt=50, ny=4, nx=5)
+        y = x.copy()
+        y.data = y.data * 2. + np.random.random(y.shape)
+        y.data[3, 2, 2] = np.ma.masked
+        x.data[3, 2, 2] = np.ma.masked
+        S = ScatterPlot(x)
+        r = S.plot(y, fldmean=False, hexbin=False)
+        S1 = ScatterPlot(x)
+        r1 = S1.plot(y, fldmean=False, density=True, bins=20, chunksize=7)
+        S1.legend()
+        self.assertEqual(r1[5], r[5])  # number of datapairs
+        for i in [0, 2, 3, 4, 6, 7]:
+            self.assertAlmostEqual(r1[i], r[i], 8)
+        self.assertEqual(S1.ax.images[0].get_array().sum(), r[5])
+
+        S2 = ScatterPlot(x, normalize_data=True)
+        r2 = S2.plot(y, fldmean=False, density=True)
+        self.assertAlmostEqual(r2[0], r[0], 8)
+        self.assertAlmostEqual(r2[6], 1., 8)
+
     def test_ScatterPlot_InvalidShape(self):
         x = self.D
         S = ScatterPlot(x)
@@ -189,6 +211,22 @@ class TestPycmbsPlots(unittest.TestCase):
     def test_violin_plot(self):
         Violin_example()
 
+    def test_violin_plot_weights(self):
+        from pycmbs.plots import ViolinPlotBins
+        data = np.random.random((10, 20, 30)) * 6. - 3.
+        area = np.random.random((10, 20, 30))
+        bins = np.linspace(-3., 3., 7)
+        VB = ViolinPlotBins(data, data2=data * 0.5, bins=bins, weights=area)
+        self.assertEqual(len(VB.data), len(bins))
+        self.assertTrue(VB.weights2 is None)
+        for d, w in zip(VB.data, VB.weights):
+            self.assertEqual(len(d), len(w))
+        self.assertEqual(sum([len(d) for d in VB.data]), data.size)
+        self.assertTrue(np.all(VB.data[2] >= -1.) & np.all(VB.data[2] < 0.))
+        self.assertTrue(np.all(np.in1d(VB.weights[2], area[(data >= -1.) & (data < 0.)])))
+        VB.plot()
+        VB.plot(classic=True)
+
 
     def test_globalmeanplot(self):
         G = GlobalMeanPlot()
@@ -87,6 +87,84 @@ class TestData(unittest.TestCase):
         self.assertEqual(res.data[1,2], 0.7)
         self.assertEqual(res.ny*res.nx - res.data.mask.sum(), 4)
 
+    def test_rasterize_idw(self):
+        x = Data(None, None)
+        x._init_sample_object(ny=1, nx=272)
+        x.lon = np.asarray([1.5, 1.5, 3.5, 2.5])
+        x.lat = np.asarray([10.1, 9.9, 12., 11.])
+        x.data = np.asarray([1., 3., 5., 7.])
+
+        lon = np.asarray([1.5, 2.5, 3.5])
+        lat = np.asarray([10., 11., 12.])
+        LON, LAT = np.meshgrid(lon, lat)
+
+        res = x._rasterize(LON, LAT, radius=0.2, method='idw', k=2)
+        self.assertAlmostEqual(res.data[0, 0], 2.)  # equal distance to two points
+        self.assertEqual(res.data[1, 1], 7.)  # exact match
+        self.assertEqual(res.data[2, 2], 5.)
+        self.assertEqual(res.data.mask.sum(), 6)
+
+    def test_rasterize_timeseries(self):
+        x = Data(None, None)
+        x._init_sample_object(nt=5, ny=1, nx=4)
+        x.lon = np.asarray([2.25, 2.45, 1.8, 3.6])
+        x.lat = np.asarray([11.9, 10.1, 10.2, 11.3])
+        x.data = np.ma.array(np.random.random((5, 4)))
+        x.data[2, 1] = np.ma.masked
+
+        LON, LAT = np.meshgrid(np.asarray([1.5, 2.5, 3.5]), np.asarray([10., 11., 12.]))
+        res = x._rasterize(LON, LAT, radius=0.5)
+        self.assertEqual(res.data.shape, (5, 3, 3))
+        self.assertTrue(np.all(res.data[:, 0, 0] == x.data[:, 2]))
+        self.assertTrue(res.data.mask[2, 0, 1])
+        self.assertFalse(res.data.mask[3, 0, 1])
+
+        # neighbour tables are reused for the same geometries
+        from pycmbs.grid import get_resampler
+        R1 = get_resampler(x.lon, x.lat, LON, LAT, 0.5)
+        R2 = get_resampler(x.lon.copy(), x.lat.copy(), LON, LAT, 0.5)
+        self.assertTrue(R1 is R2)
+        self.assertFalse(R1 is get_resampler(x.lon, x.lat, LON, LAT, 0.6))
+
+    def test_resample_single_timestep(self):
+        from pycmbs.grid import Resampler
+        lon, lat = np.meshgrid(np.asarray([1.4, 2.6, 3.4]), np.asarray([10.1, 11.2]))
+        LON, LAT = np.meshgrid(np.asarray([1.5, 2.5, 3.5]), np.asarray([10., 11., 12.]))
+        R = Resampler(lon, lat, LON, LAT, 0.5)
+        d = np.random.random((2, 3))
+
+        # a single timestep keeps its time dimension
+        res1 = R.resample(d.reshape((1, 2, 3)))
+        self.assertEqual(res1.shape, (1, 3, 3))
+        res = R.resample(d)
+        self.assertEqual(res.shape, (3, 3))
+        self.assertTrue(np.all(res1[0] == res))
+
+        with self.assertRaises(ValueError):
+            R.resample(d.flatten())
+        with self.assertRaises(ValueError):
+            R.resample(np.random.random((2, 2, 3, 1)))
+
+    def test_resampler_cache_bounded(self):
+        from pycmbs import grid
+        grid.clear_resampler_cache()
+        LON, LAT = np.meshgrid(np.asarray([1.5, 2.5, 3.5]), np.asarray([10., 11., 12.]))
+        lon = np.asarray([2.25, 2.45, 1.8, 3.6])
+        lat = np.asarray([11.9, 10.1, 10.2, 11.3])
+        R0 = grid.get_resampler(lon, lat, LON, LAT, 0.1)
+        R1 = grid.get_resampler(lon, lat, LON, LAT, 0.2)
+        # recently used entries are kept
+        self.assertTrue(R0 is grid.get_resampler(lon, lat, LON, LAT, 0.1))
+        for i in xrange(grid._RESAMPLERS.maxsize - 1):
+            grid.get_resampler(lon, lat, LON, LAT, 0.3 + 0.1 * i)
+        self.assertEqual(len(grid._RESAMPLERS), grid._RESAMPLERS.maxsize)
+        self.assertTrue(R0 is grid.get_resampler(lon, lat, LON, LAT, 0.1))
+        # least recently used entry was dropped
+        self.assertFalse(R1 is grid.get_resampler(lon, lat, LON, LAT, 0.2))
+        self.assertEqual(len(grid._RESAMPLERS), grid._RESAMPLERS.maxsize)
+        grid.clear_resampler_cache()
+        self.assertEqual(len(grid._RESAMPLERS), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,7 +7,8 @@ COPYRIGHT.md
 
 import unittest
 from nose.tools import assert_raises
-from pycmbs.benchmarking.report import Report
+from pycmbs.benchmarking.report import Report, get_fingerprint
+from pycmbs.data import Data
 import os
 import numpy as np
 import matplotlib.pyplot as plt
@@ -73,6 +74,86 @@ class TestData(unittest.TestCase):
         if os.path.exists(self.R.filename[:-3]+'.pdf'):
             os.remove(self.R.filename[:-3]+'.pdf')
 
+    def test_report_background_saving(self):
+        R = Report('testfile_bg', 'myreport', 'Alex Loew', outdir=self._tmpdir + os.sep,
+                   nproc=2, autocompile=False)
+        for i in range(5):
+            f = plt.figure()
+            ax = f.add_subplot(111)
+            ax.plot(np.random.random(200))
+            R.figure(f, caption='Figure %i' % i)
+            plt.close(f)  # figure is saved from a snapshot
+        R.close()
+        self.assertEqual(len(R._pending), 0)
+        for i in range(5):
+            self.assertTrue(os.path.exists(self._tmpdir + os.sep + 'fig_' + str(i + 1).zfill(5) + '.png'))
+        tex = open(R.filename).read()
+        self.assertTrue(tex.index('fig_00001.png') < tex.index('fig_00005.png'))
+
+        # invalid output directory
+        R = Report('testfile_bg', 'myreport', 'Alex Loew', outdir=self._tmpdir + os.sep,
+                   nproc=2, autocompile=False)
+        R.outdir = self._tmpdir + os.sep + 'notexisting' + os.sep
+        f = plt.figure()
+        R.figure(f)
+        plt.close(f)
+        with self.assertRaises(ValueError):
+            R.wait()
+        # the report is still finished and closed
+        with self.assertRaises(ValueError):
+            R.close()
+        self.assertTrue(R.file.closed)
+        self.assertTrue('end{document}' in open(R.filename).read())
+
+    def test_report_figure_cache(self):
+        x = Data(None, None)
+        x.data = np.ma.array(np.random.random((3, 4, 5)))
+        x.label = 'testdata'
+        fp = get_fingerprint('map_season', x, {'vmin': 0., 'cticks': [0, 1]})
+        self.assertEqual(fp, get_fingerprint('map_season', x.copy(), {'cticks': [0, 1], 'vmin': 0.}))
+        self.assertNotEqual(fp, get_fingerprint('map_season', x, {'vmin': 0.5, 'cticks': [0, 1]}))
+        y = x.copy()
+        y.data.mask = np.zeros(y.shape, dtype='bool')
+        y.data.mask[0, 0, 0] = True
+        self.assertNotEqual(fp, get_fingerprint('map_season', y, {'vmin': 0., 'cticks': [0, 1]}))
+        y = x.copy()
+        y.cell_area = np.ones((4, 5))
+        self.assertNotEqual(fp, get_fingerprint('map_season', y, {'vmin': 0., 'cticks': [0, 1]}))
+        y = x.copy()
+        y.weighting_type = 'all'
+        self.assertNotEqual(fp, get_fingerprint('map_season', y, {'vmin': 0., 'cticks': [0, 1]}))
+
+        for nproc in [1, 2]:
+            outdir = tempfile.mkdtemp() + os.sep
+            R = Report('cache', 'myreport', 'Alex Loew', outdir=outdir, autocompile=False, nproc=nproc)
+            self.assertFalse(R.reuse_figure(fp))
+            f = plt.figure()
+            R.figure(f, caption='cached', fingerprint=fp)
+            R.figure(f, caption='not cached')
+            R.figure(f, caption='dropped later', fingerprint=get_fingerprint('dropped'))
+            plt.close(f)
+            R.close()
+            self.assertEqual(len(R.reused_figures), 0)
+            self.assertEqual(len(os.listdir(R.cache_dir)), 3)
+
+            # second report: the first figure is taken from the cache
+            R = Report('cache', 'myreport', 'Alex Loew', outdir=outdir, autocompile=False, nproc=nproc)
+            os.remove(outdir + 'fig_00001.png')
+            self.assertTrue(R.reuse_figure(fp, caption='cached'))
+            self.assertFalse(R.reuse_figure(get_fingerprint('other')))
+            R.close()
+            self.assertEqual(R.reused_figures, ['fig_00001.png'])
+            self.assertTrue(os.path.exists(outdir + 'fig_00001.png'))
+            self.assertTrue('cached' in open(R.filename).read())
+            self.assertTrue(os.path.exists(outdir + 'cache_figures.json'))
+            # figures which are not part of the report any more are removed from the cache
+            self.assertEqual(sorted(os.listdir(R.cache_dir)), sorted([R._cache_key(fp) + '.png', 'index.json']))
+
+            # without cache
+            R = Report('cache', 'myreport', 'Alex Loew', outdir=outdir, autocompile=False, figure_cache=False)
+            self.assertFalse(R.reuse_figure(fp))
+            R.close()
+
     def test_report_InvalidFigure(self):
         f = None
         r = self.R.figure(f, caption='My figure caption')
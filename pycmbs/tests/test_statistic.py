@@ -19,6 +19,111 @@ class TestStatistic(TestCase):
         # test get_significance routine
         self.assertAlmostEqual(get_significance(0.5, 100.), 1.18049202704e-07, delta=1.e-6)
 
+    def test_quantiles(self):
+        from scipy.stats import mstats
+        x = np.ma.array(np.random.randn(50, 3, 4), mask=np.random.random((50, 3, 4)) > 0.7)
+        x[:, 0, 0] = np.ma.masked
+        x[1:, 0, 1] = np.ma.masked
+        x[0, 0, 1] = 1.5  # single valid value
+        p = [0., 0.05, 0.5, 0.95, 1.]
+        r = quantiles(x, p)
+        self.assertEqual(r.shape, (5, 3, 4))
+        self.assertTrue(np.all(r.mask[:, 0, 0]))
+        self.assertTrue(np.all(r[:, 0, 1] == x[0, 0, 1]))
+        for i in xrange(3):
+            for j in xrange(4):
+                if i + j == 0:
+                    continue
+                ref = mstats.mquantiles(x[:, i, j], prob=p)
+                self.assertTrue(np.all(np.abs(r[:, i, j] - ref) < 1.E-12))
+
+    def test_binned_kde(self):
+        from scipy.stats import gaussian_kde
+        x = np.random.normal(size=5000) * 2. + 3.
+        xx = np.linspace(-5., 10., 200)
+        xr, r = binned_kde(x, x=xx)
+        ref = gaussian_kde(x).evaluate(xx)
+        self.assertTrue(np.all(xr == xx))
+        self.assertTrue(np.abs(r - ref).max() < 1.E-3 * ref.max())
+        self.assertAlmostEqual(np.trapz(r, xx), 1., 2)
+
+        # default positions; silverman
+        xr, r = binned_kde(x, bw_method='silverman')
+        self.assertEqual(len(xr), 101)
+        self.assertEqual(xr[0], x.min())
+        ref = gaussian_kde(x, bw_method='silverman').evaluate(xr)
+        self.assertTrue(np.abs(r - ref).max() < 1.E-3 * ref.max())
+
+        # constant weights do not change the result; masked values are ignored
+        w = np.ones_like(x) * 2.5
+        xm = np.ma.array(np.concatenate([x, [1000.]]), mask=np.concatenate([np.zeros(len(x)), [1]]).astype('bool'))
+        xr, r1 = binned_kde(xm, x=xx, weights=np.concatenate([w, [1.]]))
+        xr, r2 = binned_kde(x, x=xx)
+        self.assertTrue(np.allclose(r1, r2))
+
+        # weights shift the distribution
+        w = np.where(x > 3., 3., 1.)
+        xr, r = binned_kde(x, x=xx, weights=w)
+        self.assertTrue(np.sum(r * xx) / np.sum(r) > 3.5)
+
+        with self.assertRaises(ValueError):
+            binned_kde(np.ones(10))
+        with self.assertRaises(ValueError):
+            binned_kde(x, weights=np.ones(10))
+
+    def test_quantile_sketch(self):
+        x = np.random.randn(3000, 2, 3)
+        p = [0., 0.05, 0.5, 0.95, 1.]
+        ref = quantiles(x, p)
+
+        # exact as long as the summary is not compressed
+        S = QuantileSketch((2, 3), size=200)
+        for i in xrange(0, 300, 50):
+            S.update(x[i:i + 50])
+        self.assertTrue(np.all(np.abs(S.quantiles(p) - quantiles(x[0:300], p)) < 1.E-12))
+
+        # approximate results; merged from two chunks
+        S1 = QuantileSketch((2, 3), size=200)
+        S2 = QuantileSketch((2, 3), size=200)
+        for i in xrange(0, 1500, 100):
+            S1.update(x[i:i + 100])
+            S2.update(x[1500 + i:1600 + i])
+        S1.merge(S2)
+        r = S1.quantiles(p)
+        self.assertTrue(np.all(S1.count() == 3000))
+        self.assertTrue(np.all(r[0] == x.min(axis=0)))
+        self.assertTrue(np.all(r[-1] == x.max(axis=0)))
+        self.assertTrue(np.all(np.abs(r[1:4] - ref[1:4]) < 0.15))
+
+        with self.assertRaises(ValueError):
+            S1.update(np.random.random((10, 3, 3)))
+
+    def test_pair_statistics(self):
+        x = np.random.random((200, 2, 3)) + 1000.
+        y = 2. * x + np.random.random(x.shape)
+        x[5, 1, 1] = np.nan
+
+        # statistics for each element, merged from two chunks
+        S = PairStatistics((2, 3))
+        S2 = PairStatistics((2, 3))
+        S.update(x[0:120], y[0:120])
+        S2.update(x[120:], y[120:])
+        S.merge(S2)
+        self.assertEqual(S.count()[1, 1], 199)
+        valid = ~np.isnan(x[:, 1, 1])
+        xv = x[valid, 1, 1]
+        yv = y[valid, 1, 1]
+        self.assertAlmostEqual(S.correlation()[1, 1], np.corrcoef(xv, yv)[0, 1], 10)
+        self.assertAlmostEqual(S.regression()[0][1, 1], np.polyfit(xv, yv, 1)[0], 8)
+        self.assertAlmostEqual(S.rms()[1, 1], np.sqrt(np.mean((xv - yv) ** 2)), 10)
+        self.assertAlmostEqual(S.centered_rms()[1][1, 1], np.std(xv - yv), 10)
+
+        # statistics of all pairs
+        S = PairStatistics()
+        S.update(x, y)
+        self.assertEqual(S.count(), 1199)
+        self.assertAlmostEqual(S.std()[0], np.nanstd(x), 10)
+
 
 
 class TestLomb(TestCase):
@@ -7,6 +7,7 @@ COPYRIGHT.md
 """
 
 import os
+import numpy as np
 
 """
 This module contains generic utility functions
@@ -27,6 +28,20 @@ def print_log(the_type, s):
     print txt
 
 
+def hashable(x):
+    """
+    hashable representation of a (nested) structure of dictionaries,
+    lists, tuples and arrays, e.g. to use it as key of a cache
+    """
+    if isinstance(x, dict):
+        return tuple([(k, hashable(x[k])) for k in sorted(x.keys())])
+    if isinstance(x, (list, tuple)):
+        return tuple([hashable(v) for v in x])
+    if isinstance(x, np.ndarray):
+        return ('ndarray', x.shape, tuple(np.ravel(x).tolist()))
+    return x
+
+
 def get_pycmbs_root_directory():
     return os.path.dirname(os.path.realpath(__file__))
 
@@ -15,6 +15,7 @@ import matplotlib.pyplot as plt
 import sys
 import os
 import pylab
+import multiprocessing
 import pickle
 
 from pycmbs.plots import GlecklerPlot, GlobalMeanPlot
@@ -308,7 +309,8 @@ def main():
                  'pyCMBS report - ' + CF.options['report'],
                  CF.options['author'],
                  outdir=outdir,
-                 dpi=300, format=CF.options['report_format'])
+                 dpi=300, format=CF.options['report_format'],
+                 nproc=multiprocessing.cpu_count())
     cmd = 'cp ' + os.environ['PYCMBSPATH'] + os.sep + \
         'logo' + os.sep + 'Phytonlogo5.pdf ' + rep.outdir
     os.system(cmd)